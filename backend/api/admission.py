@@ -0,0 +1,115 @@
+"""
+Admission control hooks for the API endpoints
+
+Requests to prediction, batch and report endpoints take a slot from the worker's
+AdmissionController before the view runs and give it back on teardown. Clients
+may send ``X-Request-Deadline-Ms``, the milliseconds they will wait for the
+response; otherwise each class has a default deadline below the frontend's
+30 second timeout. Shed requests get 429 or 503 with ``Retry-After``.
+
+A request that waits for another one with the same Idempotency-Key gives its
+slot back while it waits (suspend_admission) and only takes a new one if it has
+to run the view after all (resume_admission).
+
+Configuration (per worker):
+
+- ``ADMISSION_CONTROL=0`` disables admission control
+- ``ADMISSION_CAPACITY``: requests of all classes running at once (default 4)
+- ``ADMISSION_PREDICT_RESERVED``: slots only predictions may use (default a quarter of the capacity)
+"""
+import os
+import logging
+
+from flask import request, jsonify, g, current_app
+
+from src.services.admission import AdmissionController, AdmissionRejected, EndpointClass
+
+# Endpoint class of each admission-controlled view
+ENDPOINT_CLASSES = {
+    'api.predict': 'predict',
+    'api.what_if': 'predict',
+    'api.predict_batch': 'batch',
+    'api.generate_pdf': 'report',
+    'api.download_pdf': 'report'
+}
+
+DEADLINE_HEADER = 'X-Request-Deadline-Ms'
+
+def create_controller() -> AdmissionController:
+    """Build the admission controller configured by the environment"""
+    capacity = int(os.environ.get('ADMISSION_CAPACITY', 4))
+    reserved = int(os.environ.get('ADMISSION_PREDICT_RESERVED', max(1, capacity // 4)))
+    shared = max(1, capacity - reserved)
+    return AdmissionController(capacity, {
+        'predict': EndpointClass('predict', capacity, max_queue=8, default_deadline=5.0, reserved=reserved),
+        'batch': EndpointClass('batch', max(1, shared // 2), max_queue=2, default_deadline=25.0),
+        'report': EndpointClass('report', max(1, shared // 2), max_queue=2, default_deadline=25.0)
+    })
+
+def _client_timeout():
+    """Seconds the client will wait, from the deadline header, or None"""
+    try:
+        value = float(request.headers[DEADLINE_HEADER]) / 1000
+    except (KeyError, ValueError):
+        return None
+    return value if value > 0 else None
+
+def _shed_response(e: AdmissionRejected, endpoint_class: str):
+    """429/503 response with Retry-After for a shed request"""
+    logging.getLogger(__name__).warning(
+        f"Shed {request.method} {request.path} ({endpoint_class}): {e.reason}")
+    response = jsonify({
+        'error': 'Too Many Requests' if e.status_code == 429 else 'Service Unavailable',
+        'message': f'Server is overloaded ({e.reason}); retry after {e.retry_after} s',
+        'retry_after': e.retry_after
+    })
+    response.status_code = e.status_code
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def suspend_admission():
+    """Give back the current request's slot while it waits without using it"""
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        current_app.extensions['admission'].release(ticket)
+        g.admission_suspended = ticket.endpoint_class
+
+def resume_admission():
+    """
+    Take a slot again for a suspended request that now has to run
+
+    Returns:
+        Response: The shed response if no slot is available in time, else None
+    """
+    endpoint_class = g.pop('admission_suspended', None)
+    if endpoint_class is None:
+        return None
+    try:
+        g.admission_ticket = current_app.extensions['admission'].acquire(endpoint_class, _client_timeout())
+    except AdmissionRejected as e:
+        return _shed_response(e, endpoint_class)
+    return None
+
+def init_app(app):
+    """Register the admission hooks when admission control is enabled"""
+    if os.environ.get('ADMISSION_CONTROL', '1') == '0':
+        return
+    controller = create_controller()
+    app.extensions['admission'] = controller
+
+    @app.before_request
+    def admit_request():
+        endpoint_class = ENDPOINT_CLASSES.get(request.endpoint)
+        if endpoint_class is None or request.method == 'OPTIONS':
+            return None
+        try:
+            g.admission_ticket = controller.acquire(endpoint_class, _client_timeout())
+        except AdmissionRejected as e:
+            return _shed_response(e, endpoint_class)
+        return None
+
+    @app.teardown_request
+    def release_request(error=None):
+        ticket = g.pop('admission_ticket', None)
+        if ticket is not None:
+            controller.release(ticket)
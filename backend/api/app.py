@@ -3,11 +3,15 @@ Main Flask Application for Heart Disease Prediction API
 """
 import os
 import logging
-from flask import Flask, jsonify, request
+import time
+from flask import Flask, jsonify, request, g, Response
 from flask_cors import CORS
 from datetime import datetime
 import json
 
+from src.services.metrics import REGISTRY, REQUESTS, REQUEST_SECONDS, CONTENT_TYPE, process_memory
+from src.services.tracing import Tracer, begin_request_trace, end_request_trace
+
 def create_app():
     """Create and configure the Flask application."""
     app = Flask(__name__)
@@ -19,8 +23,8 @@ def create_app():
     )
     app.logger.setLevel(logging.INFO)
     
-    # Enable CORS for all routes
-    CORS(app)
+    # Enable CORS for all routes; let the frontend read the timing, trace and back-off headers
+    CORS(app, expose_headers=['Server-Timing', 'traceparent', 'Retry-After'])
     
     # Configure JSON serialization
     app.config['JSON_SORT_KEYS'] = False
@@ -57,9 +61,16 @@ def create_app():
             'timestamp': datetime.now().isoformat()
         }), 500
     
+    # Request tracing (spans are exported only when TRACE_EXPORT_PATH is set)
+    tracer = Tracer.from_environment()
+    app.extensions['tracer'] = tracer
+    
     # Middleware for request logging
     @app.before_request
     def log_request_info():
+        g.request_start = time.perf_counter()
+        g.trace = tracer.start(request.headers.get('traceparent'))
+        g.trace_token = begin_request_trace(g.trace)
         app.logger.info('Request: %s %s', 
                        str(request.method), 
                        str(request.url))
@@ -70,21 +81,65 @@ def create_app():
                        str(request.method), 
                        str(request.url), 
                        str(response.status_code))
+        
+        # Label by route pattern rather than URL so unknown paths cannot grow the label set
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUESTS.labels(request.method, endpoint, response.status_code).inc()
+        if 'request_start' in g:
+            elapsed = time.perf_counter() - g.request_start
+            REQUEST_SECONDS.labels(request.method, endpoint).observe(elapsed)
+            
+            # Per-stage breakdown for browsers and proxies, plus the trace context
+            response.headers['Server-Timing'] = g.trace.server_timing(elapsed)
+            response.headers['Timing-Allow-Origin'] = '*'
+            if tracer.enabled:
+                response.headers['traceparent'] = g.trace.traceparent()
+                tracer.finish(g.trace, f'{request.method} {endpoint}', {
+                    'http.method': request.method,
+                    'http.route': endpoint,
+                    'http.status_code': response.status_code,
+                    'process.pid': os.getpid()
+                })
         return response
     
+    @app.teardown_request
+    def end_trace(error=None):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            end_request_trace(token)
+    
     # Import and register routes
     from . import routes
     app.register_blueprint(routes.bp, url_prefix='/api')
     
+    # Concurrency limits and load shedding per endpoint class
+    from . import admission
+    admission.init_app(app)
+    
+    # Admin profiling endpoints (disabled unless ADMIN_TOKEN is set)
+    from . import profiling
+    profiling.init_app(app)
+    
     # Health check endpoint
     @app.route('/health')
     def health_check():
         return jsonify({
             'status': 'healthy',
+            'ready': routes.predictor.is_ready,
             'timestamp': datetime.now().isoformat(),
-            'environment': app.config['ENV']
+            'environment': app.config['ENV'],
+            'memory': process_memory()
         })
     
+    # Probes for orchestrators and load balancers (same as /api/health/live and /api/health/ready)
+    app.add_url_rule('/health/live', 'liveness', routes.liveness)
+    app.add_url_rule('/health/ready', 'readiness', routes.readiness)
+    
+    # Metrics endpoint (Prometheus text exposition format, summed over all workers)
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+    
     return app
 
 # For running the app directly
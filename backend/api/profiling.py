@@ -0,0 +1,241 @@
+"""
+On-demand profiling hooks for live API workers
+
+Disabled unless ADMIN_TOKEN is set. Every request must then carry the token in
+the X-Admin-Token header.
+
+- Per-request cProfile: send any request with ``X-Profile: 1``; the response
+  carries ``X-Profile-Id`` and the stats are served by
+  ``GET /admin/profiling/profiles/<id>`` (text, or ``?format=pstats``).
+- Stack sampling: ``POST /admin/profiling/stacks?seconds=N`` samples all threads
+  of the worker that receives it in the background and writes collapsed stacks
+  (flamegraph.pl / speedscope input), fetched with ``GET /admin/profiling/stacks/<id>``.
+  ``?wait=1`` returns the stacks directly, which is only useful with threaded workers.
+- Memory: ``POST /admin/profiling/tracemalloc/start``, then
+  ``GET /admin/profiling/tracemalloc/snapshot`` for the top allocation sites and
+  the growth since the previous snapshot, ``POST /admin/profiling/tracemalloc/stop``.
+
+Results are written to PROFILE_DIR so any worker can serve them; tracemalloc
+state is per worker and every response names the worker's pid.
+"""
+import os
+import io
+import sys
+import hmac
+import time
+import uuid
+import pstats
+import cProfile
+import tempfile
+import threading
+import tracemalloc
+import logging
+from collections import Counter
+
+from flask import Blueprint, request, jsonify, g, Response, abort
+
+bp = Blueprint('profiling', __name__)
+
+# Longest stack sampling run accepted by one request
+MAX_SAMPLE_SECONDS = 60
+
+_tracemalloc_lock = threading.Lock()
+_last_snapshot = None
+
+def _profile_dir():
+    path = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'heart_profiles'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _result_path(kind, result_id, extension):
+    # Ids are generated here; refuse anything else so paths cannot escape the directory
+    if not result_id.isalnum():
+        abort(404)
+    return os.path.join(_profile_dir(), f'{kind}-{result_id}.{extension}')
+
+def _is_authorized():
+    """Check the X-Admin-Token header against ADMIN_TOKEN"""
+    token = os.environ.get('ADMIN_TOKEN')
+    supplied = request.headers.get('X-Admin-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+@bp.before_request
+def require_admin_token():
+    """Hide the admin endpoints when disabled and reject requests without the token"""
+    if not os.environ.get('ADMIN_TOKEN'):
+        abort(404)
+    if not _is_authorized():
+        return jsonify({'error': 'Forbidden', 'message': 'A valid X-Admin-Token header is required'}), 403
+
+def start_request_profile():
+    """Start a cProfile run for this request when asked for with X-Profile: 1"""
+    if request.headers.get('X-Profile') == '1' and _is_authorized():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def finish_request_profile(response):
+    """Stop the request's cProfile run and store its stats"""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+
+    profiler.disable()
+    profile_id = uuid.uuid4().hex
+    profiler.dump_stats(_result_path('profile', profile_id, 'pstats'))
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+@bp.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Get the stats of a profiled request (text sorted by cumulative time, or raw pstats)"""
+    path = _result_path('profile', profile_id, 'pstats')
+    if not os.path.exists(path):
+        return jsonify({'error': 'Profile not found'}), 404
+
+    if request.args.get('format') == 'pstats':
+        with open(path, 'rb') as f:
+            return Response(f.read(), mimetype='application/octet-stream')
+
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.sort_stats(request.args.get('sort', 'cumulative')).print_stats(int(request.args.get('limit', 50)))
+    return Response(output.getvalue(), mimetype='text/plain')
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+def sample_stacks(seconds, interval=0.005):
+    """
+    Sample the stacks of all other threads of this process
+
+    Args:
+        seconds (float): Sampling duration
+        interval (float): Seconds between samples
+
+    Returns:
+        Counter: Number of samples per collapsed stack ("thread;outer;...;inner")
+    """
+    own_thread = threading.get_ident()
+    names = {}
+    stacks = Counter()
+    deadline = time.perf_counter() + seconds
+
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            if thread_id not in names:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = []
+            while frame is not None:
+                frames.append(_frame_label(frame))
+                frame = frame.f_back
+            frames.append(names.get(thread_id, f'thread-{thread_id}'))
+            stacks[';'.join(reversed(frames))] += 1
+        time.sleep(interval)
+    return stacks
+
+def _collapsed(stacks):
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+@bp.route('/stacks', methods=['POST'])
+def start_stack_sampling():
+    """Sample stack traces of every thread of this worker for N seconds"""
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+    except ValueError:
+        return jsonify({'error': 'seconds and interval must be numbers'}), 400
+    if not 0 < seconds <= MAX_SAMPLE_SECONDS or not 0.0005 <= interval <= 1:
+        return jsonify({'error': f'seconds must be in (0, {MAX_SAMPLE_SECONDS}] and interval in [0.0005, 1]'}), 400
+
+    if request.args.get('wait') == '1':
+        return Response(_collapsed(sample_stacks(seconds, interval)), mimetype='text/plain')
+
+    sample_id = uuid.uuid4().hex
+    path = _result_path('stacks', sample_id, 'txt')
+
+    def run():
+        collapsed = _collapsed(sample_stacks(seconds, interval))
+        with open(path + '.tmp', 'w') as f:
+            f.write(collapsed)
+        os.replace(path + '.tmp', path)
+
+    threading.Thread(target=run, name='stack-sampler', daemon=True).start()
+    return jsonify({'id': sample_id, 'pid': os.getpid(), 'seconds': seconds, 'interval': interval}), 202
+
+@bp.route('/stacks/<sample_id>', methods=['GET'])
+def get_stacks(sample_id):
+    """Get the collapsed stacks of a finished sampling run"""
+    path = _result_path('stacks', sample_id, 'txt')
+    if not os.path.exists(path):
+        return jsonify({'error': 'Sampling run not found or still running'}), 404
+    with open(path) as f:
+        return Response(f.read(), mimetype='text/plain')
+
+@bp.route('/tracemalloc/start', methods=['POST'])
+def start_tracemalloc():
+    """Start tracing Python memory allocations in this worker"""
+    global _last_snapshot
+    nframes = int(request.args.get('frames', 10))
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(nframes)
+        _last_snapshot = None
+    return jsonify({'tracing': True, 'pid': os.getpid(), 'frames': tracemalloc.get_traceback_limit()})
+
+@bp.route('/tracemalloc/stop', methods=['POST'])
+def stop_tracemalloc():
+    """Stop tracing memory allocations in this worker"""
+    global _last_snapshot
+    with _tracemalloc_lock:
+        tracemalloc.stop()
+        _last_snapshot = None
+    return jsonify({'tracing': False, 'pid': os.getpid()})
+
+@bp.route('/tracemalloc/snapshot', methods=['GET'])
+def tracemalloc_snapshot():
+    """Get the top allocation sites and their growth since the previous snapshot"""
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return jsonify({'error': 'tracemalloc is not running in this worker', 'pid': os.getpid()}), 409
+
+    limit = int(request.args.get('limit', 25))
+    key_type = 'traceback' if request.args.get('group') == 'traceback' else 'lineno'
+
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+        ])
+        previous, _last_snapshot = _last_snapshot, snapshot
+
+    def describe(stat):
+        return {
+            'location': [f'{frame.filename}:{frame.lineno}' for frame in stat.traceback],
+            'size_kb': round(stat.size / 1024, 3),
+            'count': stat.count
+        }
+
+    current, peak = tracemalloc.get_traced_memory()
+    result = {
+        'pid': os.getpid(),
+        'traced_mb': round(current / 1024 ** 2, 3),
+        'peak_mb': round(peak / 1024 ** 2, 3),
+        'top': [describe(stat) for stat in snapshot.statistics(key_type)[:limit]]
+    }
+    if previous is not None:
+        result['growth'] = [
+            dict(describe(stat), size_diff_kb=round(stat.size_diff / 1024, 3), count_diff=stat.count_diff)
+            for stat in snapshot.compare_to(previous, key_type)[:limit]
+        ]
+    return jsonify(result)
+
+def init_app(app):
+    """Register the admin endpoints and the per-request profiling hooks"""
+    app.register_blueprint(bp, url_prefix='/admin/profiling')
+    app.before_request(start_request_profile)
+    app.after_request(finish_request_profile)
+    if os.environ.get('ADMIN_TOKEN'):
+        logging.getLogger(__name__).warning("Profiling endpoints enabled at /admin/profiling")
@@ -1,12 +1,16 @@
 import os
 import sys
 import json
+import math
+import hashlib
 import logging
+import functools
 from datetime import datetime
 from io import BytesIO
 import base64
 
-from flask import Blueprint, request, jsonify, send_file
+import pandas as pd
+from flask import Blueprint, request, jsonify, send_file, make_response, Response
 from flask_cors import CORS
 
 # Add src directory to Python path
@@ -14,6 +18,10 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from src.prediction.predictor import HeartDiseasePredictor
 from src.services.pdf_generator import PDFGenerator
+from src.services.metrics import timed_stage, process_memory, IDEMPOTENT_REQUESTS
+from src.services.idempotency import IdempotencyStore
+from api.validators import validate_csv_file
+from api.admission import suspend_admission, resume_admission
 
 # Create blueprint
 bp = Blueprint('api', __name__)
@@ -21,8 +29,92 @@ bp = Blueprint('api', __name__)
 # Initialize predictor
 predictor = HeartDiseasePredictor()
 
+# Optionally move inference into a pool of processes so this tier stays I/O-bound
+if os.environ.get('INFERENCE_BACKEND') == 'process':
+    predictor.start_inference_pool(
+        processes=int(os.environ['INFERENCE_PROCESSES']) if os.environ.get('INFERENCE_PROCESSES') else None
+    )
+
+# Persist every prediction for audit and drift analysis without blocking requests
+if os.environ.get('PREDICTION_LOG_DIR'):
+    predictor.start_prediction_log(os.environ['PREDICTION_LOG_DIR'])
+
+# Serve candidate models next to the best model: MODEL_AB_WEIGHTS="name=share,..." routes
+# a share of requests to each candidate, MODEL_SHADOW="name,..." scores every request off the response path
+if os.environ.get('MODEL_AB_WEIGHTS') or os.environ.get('MODEL_SHADOW'):
+    from src.prediction.registry import parse_weights
+    predictor.start_model_registry(
+        candidates_dir=os.environ.get('MODEL_CANDIDATES_DIR'),
+        weights=parse_weights(os.environ.get('MODEL_AB_WEIGHTS')),
+        shadows=[name.strip() for name in os.environ.get('MODEL_SHADOW', '').split(',') if name.strip()]
+    )
+
+# Score warm-up batches in the background; /api/health/ready turns 200 once they finish
+predictor.start_warm_up()
+
 # Initialize PDF generator
 pdf_generator = PDFGenerator()
+
+# Responses of requests sent with an Idempotency-Key, shared by the workers on this host
+idempotency_store = IdempotencyStore.from_environment()
+
+# Longest accepted Idempotency-Key header
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+def idempotent(view):
+    """
+    Replay the stored response when a request repeats an Idempotency-Key
+    
+    The first request with a key runs the view; duplicates that arrive while it runs
+    wait for it, without holding an admission slot, and get the same response.
+    Client errors are stored too, server errors are not, so a retry after a failure
+    runs again.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return view(*args, **kwargs)
+        if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return jsonify({'error': f'Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters'}), 400
+        
+        # Keys are scoped to the endpoint; the body digest detects a key reused for another request
+        endpoint = request.url_rule.rule
+        scoped_key = f'{endpoint} {key}'
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        claim = idempotency_store.claim(scoped_key, fingerprint, on_wait=suspend_admission)
+        
+        if claim.outcome == 'mismatch':
+            IDEMPOTENT_REQUESTS.labels(endpoint, 'mismatch').inc()
+            return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+        if claim.outcome == 'timeout':
+            IDEMPOTENT_REQUESTS.labels(endpoint, 'timeout').inc()
+            response = jsonify({'error': 'A request with this Idempotency-Key is still being processed'})
+            response.headers['Retry-After'] = '1'
+            return response, 409
+        if claim.outcome == 'replay':
+            IDEMPOTENT_REQUESTS.labels(endpoint, 'coalesced' if claim.waited else 'replayed').inc()
+            response = Response(claim.body, status=claim.status_code, content_type=claim.content_type)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        
+        IDEMPOTENT_REQUESTS.labels(endpoint, 'new').inc()
+        # A duplicate whose original failed runs the view itself, so it needs a slot again
+        shed = resume_admission()
+        if shed is not None:
+            idempotency_store.release(scoped_key)
+            return shed
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.release(scoped_key)
+            raise
+        if response.status_code >= 500:
+            idempotency_store.release(scoped_key)
+        else:
+            idempotency_store.complete(scoped_key, response.status_code, response.content_type, response.get_data())
+        return response
+    return wrapper
     
 @bp.route('/health', methods=['GET'])
 def health_check():
@@ -30,16 +122,72 @@ def health_check():
     logging.info("Health check endpoint called")
     return jsonify({
         'status': 'healthy',
+        'ready': predictor.is_ready,
+        'timestamp': datetime.now().isoformat(),
+        'memory': process_memory()
+    })
+
+@bp.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness probe: the worker process is up and answering requests"""
+    return jsonify({
+        'status': 'alive',
+        'pid': os.getpid(),
         'timestamp': datetime.now().isoformat()
     })
 
+@bp.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 otherwise"""
+    status = predictor.readiness()
+    status['status'] = 'ready' if status['ready'] else 'not_ready'
+    status['timestamp'] = datetime.now().isoformat()
+    return jsonify(status), 200 if status['ready'] else 503
+
+# Largest number of patients accepted by one batch request
+MAX_BATCH_SIZE = 10000
+
+REQUIRED_FIELDS = ['age', 'sex', 'cp', 'trestbps', 'chol', 'fbs', 'restecg', 'thalach', 'exang', 'oldpeak', 'slope', 'ca', 'thal']
+
+def _is_non_finite(value):
+    """Check whether a value parses as NaN or infinity (which counts as a missing field)"""
+    try:
+        return not math.isfinite(float(value))
+    except (ValueError, TypeError):
+        return False
+
+def _check_patient_fields(input_data):
+    """
+    Check that a patient record has every required field with a finite numeric value
+    
+    Args:
+        input_data (dict): Patient data
+        
+    Returns:
+        str: Error message, or None if the record is valid
+    """
+    missing_fields = [field for field in REQUIRED_FIELDS
+                      if field not in input_data or _is_non_finite(input_data[field])]
+    if missing_fields:
+        return f'Missing required fields: {missing_fields}'
+    
+    for field in REQUIRED_FIELDS:
+        try:
+            float(input_data[field])
+        except (ValueError, TypeError):
+            return f'Invalid value for field {field}: {input_data[field]}'
+    
+    return None
+
 @bp.route('/predict', methods=['POST'])
+@idempotent
 def predict():
     """Prediction endpoint"""
     logging.info("Predict endpoint called")
     try:
         # Get input data
-        input_data = request.get_json()
+        with timed_stage('predict_request', 'parse'):
+            input_data = request.get_json()
         
         logging.info(f"Received input data: {input_data}")
         
@@ -50,33 +198,144 @@ def predict():
         # Log the received data for debugging
         logging.info(f"Received prediction request with data: {input_data}")
         
-        # Validate that all required fields are present
-        required_fields = ['age', 'sex', 'cp', 'trestbps', 'chol', 'fbs', 'restecg', 'thalach', 'exang', 'oldpeak', 'slope', 'ca', 'thal']
-        missing_fields = [field for field in required_fields if field not in input_data]
-        
-        if missing_fields:
-            return jsonify({'error': f'Missing required fields: {missing_fields}'}), 400
-            
-        # Validate that all fields have numeric values
-        for field in required_fields:
-            try:
-                float(input_data[field])
-            except (ValueError, TypeError):
-                return jsonify({'error': f'Invalid value for field {field}: {input_data[field]}'}), 400
+        # Validate that all required fields are present and numeric
+        with timed_stage('predict_request', 'validate'):
+            error = _check_patient_fields(input_data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Make prediction
-        result = predictor.predict(input_data)
+        with timed_stage('predict_request', 'predict'):
+            result = predictor.predict(input_data, request.headers.get('X-Routing-Key'))
         
         # Add input data to result for tracking
         result['input_data'] = input_data
         
         logging.info(f"Prediction successful: {result}")
-        return jsonify(result)
+        with timed_stage('predict_request', 'serialize'):
+            return jsonify(result)
         
     except Exception as e:
         logging.error(f"Prediction error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Prediction failed', 'details': str(e)}), 500
 
+@bp.route('/predict/batch', methods=['POST'])
+@idempotent
+def predict_batch():
+    """Batch prediction endpoint: CSV upload or JSON list of patients"""
+    logging.info("Batch predict endpoint called")
+    try:
+        # Get input data from an uploaded CSV file or a JSON body
+        with timed_stage('batch_request', 'parse'):
+            if 'file' in request.files:
+                file = request.files['file']
+                is_valid, errors = validate_csv_file(file)
+                patients = pd.read_csv(file).to_dict('records') if is_valid else None
+            else:
+                errors = []
+                patients = request.get_json(silent=True)
+                if isinstance(patients, dict):
+                    patients = patients.get('patients')
+        
+        if errors:
+            return jsonify({'error': 'Invalid file', 'details': errors}), 400
+        if not isinstance(patients, list) or not patients:
+            return jsonify({'error': 'No patient data provided'}), 400
+        if len(patients) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} patients per request'}), 400
+        
+        # Invalid rows are reported in place; the rest are scored together
+        with timed_stage('batch_request', 'validate'):
+            predictions = [None] * len(patients)
+            valid_rows = []
+            for i, patient in enumerate(patients):
+                error = _check_patient_fields(patient) if isinstance(patient, dict) else 'Patient must be an object'
+                if error:
+                    predictions[i] = {'error': 'Invalid input', 'message': error}
+                else:
+                    valid_rows.append(i)
+        
+        # Per-patient explanations are opt-in; otherwise every row gets the global importances
+        explain = request.args.get('explain', '').lower() in ('1', 'true', 'yes')
+        with timed_stage('batch_request', 'predict'):
+            results = predictor.batch_predict([patients[i] for i in valid_rows],
+                                              request.headers.get('X-Routing-Key'), explain) if valid_rows else []
+        for i, result in zip(valid_rows, results):
+            predictions[i] = result
+        
+        successful = [p for p in predictions if 'error' not in p]
+        risk_distribution = {'Low': 0, 'Medium': 0, 'High': 0}
+        for p in successful:
+            risk_distribution[p['risk_level']] += 1
+        
+        with timed_stage('batch_request', 'serialize'):
+            return jsonify({
+                'predictions': predictions,
+                'statistics': {
+                    'total': len(predictions),
+                    'successful': len(successful),
+                    'failed': len(predictions) - len(successful),
+                    'average_probability': (
+                        sum(p['probability'] for p in successful) / len(successful) if successful else None
+                    ),
+                    'risk_distribution': risk_distribution
+                }
+            })
+        
+    except Exception as e:
+        logging.error(f"Batch prediction error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Batch prediction failed', 'details': str(e)}), 500
+
+@bp.route('/what-if', methods=['POST'])
+def what_if():
+    """What-if sweep endpoint: risk curve or surface over one or more features"""
+    logging.info("What-if endpoint called")
+    try:
+        input_data = request.get_json()
+        
+        if not isinstance(input_data, dict) or not isinstance(input_data.get('patient'), dict):
+            return jsonify({'error': 'A base patient is required'}), 400
+        
+        error = _check_patient_fields(input_data['patient'])
+        if error:
+            return jsonify({'error': error}), 400
+        
+        sweeps = input_data.get('sweep')
+        if isinstance(sweeps, dict):
+            sweeps = [sweeps]
+        if not isinstance(sweeps, list) or not all(isinstance(spec, dict) for spec in sweeps):
+            return jsonify({'error': 'sweep must be a list of feature sweeps'}), 400
+        
+        try:
+            result = predictor.sweep(input_data['patient'], sweeps)
+        except (ValueError, TypeError, KeyError) as e:
+            return jsonify({'error': 'Invalid sweep', 'details': str(e)}), 400
+        
+        return jsonify(result)
+        
+    except Exception as e:
+        logging.error(f"What-if error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'What-if analysis failed', 'details': str(e)}), 500
+
+@bp.route('/models', methods=['GET'])
+def models():
+    """Served models with their A/B weights, latency and shadow agreement (this worker's traffic)"""
+    report = predictor.models_report()
+    report['timestamp'] = datetime.now().isoformat()
+    return jsonify(report)
+
+@bp.route('/drift', methods=['GET'])
+def drift():
+    """Data drift of recent inputs against the training distribution (all workers' traffic)"""
+    report = predictor.drift_report()
+    if report is None:
+        return jsonify({
+            'error': 'Drift monitoring unavailable',
+            'details': 'The loaded model has no drift reference; retrain to create one'
+        }), 503
+    report['timestamp'] = datetime.now().isoformat()
+    return jsonify(report)
+
 @bp.route('/generate-pdf', methods=['POST'])
 def generate_pdf():
     """Generate PDF report endpoint"""
@@ -92,11 +351,12 @@ def generate_pdf():
         pdf_bytes = pdf_generator.generate_heart_disease_report(prediction_data)
         
         # Create response with PDF data
-        return jsonify({
-            'success': True,
-            'pdf_data': base64.b64encode(pdf_bytes).decode('utf-8'),
-            'filename': f'heart_disease_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
-        })
+        with timed_stage('report', 'encode'):
+            return jsonify({
+                'success': True,
+                'pdf_data': base64.b64encode(pdf_bytes).decode('utf-8'),
+                'filename': f'heart_disease_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf'
+            })
         
     except Exception as e:
         logging.error(f"PDF generation error: {str(e)}")
@@ -0,0 +1,54 @@
+"""
+Gunicorn configuration for the Heart Disease Prediction API
+"""
+import os
+import shutil
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Threaded workers, so requests over the admission limits wait in (or are shed
+# from) the worker's admission queues instead of the listen backlog
+worker_class = 'gthread'
+
+if os.environ.get('INFERENCE_BACKEND') == 'process':
+    # Inference runs in each worker's process pool, so a few threaded workers
+    # are enough to keep every core busy
+    workers = int(os.environ.get('GUNICORN_WORKERS', 1))
+    threads = int(os.environ.get('GUNICORN_THREADS', 16))
+    os.environ.setdefault('ADMISSION_CAPACITY', str(os.cpu_count() or 4))
+else:
+    # In-process inference holds the GIL, so admit two requests per worker at a time
+    workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+    os.environ.setdefault('ADMISSION_CAPACITY', '2')
+
+# Every worker writes its metrics to this directory and /metrics sums them.
+# Set before the workers import the application so they all see it.
+os.environ.setdefault('METRICS_MULTIPROC_DIR', '/tmp/heart_metrics')
+
+def on_starting(server):
+    """Start each server run with empty metrics and up-to-date shared model weights"""
+    metrics_dir = os.environ['METRICS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+    # Written here, once, because workers only map the flat forest arrays
+    if os.environ.get('SHARED_MODEL_WEIGHTS', '1') != '0':
+        from src.prediction.flat_forest import refresh_flat_forest
+        from src.prediction.predictor import DEFAULT_MODEL_PATH
+        from src.prediction.registry import CANDIDATES_DIR
+
+        bundles = [DEFAULT_MODEL_PATH]
+        candidates_dir = os.path.join(DEFAULT_MODEL_PATH, CANDIDATES_DIR)
+        if os.path.isdir(candidates_dir):
+            bundles += [os.path.join(candidates_dir, name) for name in sorted(os.listdir(candidates_dir))]
+        for bundle in bundles:
+            try:
+                refresh_flat_forest(bundle)
+            except Exception as e:
+                server.log.warning(f"Could not write flat forest arrays for {bundle}: {e}")
+
+def child_exit(server, worker):
+    """Drop the gauges of an exited worker; its counters keep counting towards the totals"""
+    from src.services.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
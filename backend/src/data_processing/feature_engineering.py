@@ -3,13 +3,45 @@ Feature engineering utilities for heart disease prediction
 """
 import pandas as pd
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Union
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.validation import check_is_fitted
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Binning rules shared by the individual and fused feature engineering steps
+AGE_BINS = [0, 30, 40, 50, 60, 100]
+AGE_LABELS = ['<30', '30-40', '40-50', '50-60', '60+']
+
+# Lower edges (inclusive) of each BP category after 'Low'
+BP_EDGES = [90, 120, 130, 140, 180]
+BP_LABELS = ['Low', 'Normal', 'Elevated', 'High Stage 1', 'High Stage 2', 'Hypertensive Crisis']
+
+# Lower edges (inclusive) of each cholesterol category after 'Desirable'
+CHOL_EDGES = [200, 240]
+CHOL_LABELS = ['Desirable', 'Borderline High', 'High']
+
+RISK_SCORE_COLUMNS = ['age', 'sex', 'trestbps', 'chol', 'thalach']
+
+INTERACTIONS = [
+    ('age', 'trestbps'),
+    ('age', 'chol'),
+    ('trestbps', 'chol'),
+    ('thalach', 'age')
+]
+
+# Numeric engineered columns appended by HeartFeatureTransformer
+ENGINEERED_FEATURE_NAMES = (
+    [f'age_group_{label}' for label in AGE_LABELS] +
+    [f'bp_category_{label}' for label in BP_LABELS] +
+    [f'chol_category_{label}' for label in CHOL_LABELS] +
+    ['risk_score'] +
+    [f'{col1}_{col2}_interaction' for col1, col2 in INTERACTIONS]
+)
+
 def create_age_groups(df: pd.DataFrame, age_column: str = 'age') -> pd.DataFrame:
     """
     Create age group categories
@@ -30,8 +62,8 @@ def create_age_groups(df: pd.DataFrame, age_column: str = 'age') -> pd.DataFrame
     # Create age groups
     df_copy['age_group'] = pd.cut(
         df_copy[age_column],
-        bins=[0, 30, 40, 50, 60, 100],
-        labels=['<30', '30-40', '40-50', '50-60', '60+'],
+        bins=AGE_BINS,
+        labels=AGE_LABELS,
         right=False
     )
     
@@ -114,8 +146,7 @@ def create_risk_score(df: pd.DataFrame) -> pd.DataFrame:
     df_copy = df.copy()
     
     # Required columns for risk score calculation
-    required_columns = ['age', 'sex', 'trestbps', 'chol', 'thalach']
-    missing_columns = [col for col in required_columns if col not in df_copy.columns]
+    missing_columns = [col for col in RISK_SCORE_COLUMNS if col not in df_copy.columns]
     
     if missing_columns:
         logger.warning(f"Missing columns for risk score calculation: {missing_columns}")
@@ -146,41 +177,136 @@ def create_interaction_features(df: pd.DataFrame) -> pd.DataFrame:
     """
     df_copy = df.copy()
     
-    # Define interaction pairs
-    interactions = [
-        ('age', 'trestbps'),
-        ('age', 'chol'),
-        ('trestbps', 'chol'),
-        ('thalach', 'age')
-    ]
-    
-    for col1, col2 in interactions:
+    for col1, col2 in INTERACTIONS:
         if col1 in df_copy.columns and col2 in df_copy.columns:
             df_copy[f'{col1}_{col2}_interaction'] = df_copy[col1] * df_copy[col2]
             logger.info(f"Created interaction feature: {col1}_{col2}_interaction")
     
     return df_copy
 
-def get_all_engineered_features(df: pd.DataFrame) -> pd.DataFrame:
+def _bin_codes(values: np.ndarray, edges: List[float]) -> np.ndarray:
+    """
+    Map values to category codes given the inclusive lower edges of each category
+    
+    Code 0 is everything below the first edge; NaN values get code -1.
+    
+    Args:
+        values (np.ndarray): Values to bin
+        edges (List[float]): Sorted lower edges of categories 1..len(edges)
+        
+    Returns:
+        np.ndarray: int8 category codes
+    """
+    codes = np.searchsorted(edges, values, side='right').astype(np.int8)
+    codes[np.isnan(values)] = -1
+    return codes
+
+def _as_float(values) -> np.ndarray:
+    """Get a column as a float array without copying float data"""
+    values = np.asarray(values)
+    if values.dtype.kind != 'f':
+        values = values.astype(np.float64)
+    return values
+
+def _compute_risk_score(age, sex, trestbps, chol, thalach, out: np.ndarray = None) -> np.ndarray:
+    """
+    Compute the composite risk score used by create_risk_score
+    
+    Args:
+        age, sex, trestbps, chol, thalach: Source column arrays
+        out (np.ndarray): Optional float array to write the score into; the score is
+            computed in its dtype (float64 by default)
+        
+    Returns:
+        np.ndarray: Risk score for each row
+    """
+    n = len(age)
+    dtype = np.float64 if out is None else out.dtype
+    risk_score = np.empty(n, dtype=dtype) if out is None else out
+    term = np.empty(n, dtype=dtype)
+    
+    np.multiply(age, 0.2 / 100, out=risk_score, dtype=dtype)
+    np.multiply(sex, 0.1, out=term, dtype=dtype)
+    risk_score += term
+    np.subtract(trestbps, 90, out=term, dtype=dtype)
+    term *= 0.2 / 110
+    risk_score += term
+    np.subtract(chol, 100, out=term, dtype=dtype)
+    term *= 0.2 / 500
+    risk_score += term
+    np.subtract(thalach, 60, out=term, dtype=dtype)
+    term *= -0.3 / 160
+    term += 0.3
+    risk_score += term
+    
+    return risk_score
+
+def compute_engineered_columns(df: pd.DataFrame) -> Dict[str, object]:
+    """
+    Compute all engineered feature columns in a single pass
+    
+    Each source column is read once and every output is written into its own
+    preallocated array, so the input frame is never copied.
+    
+    Args:
+        df (pd.DataFrame): Input dataframe
+        
+    Returns:
+        Dict[str, object]: Mapping of engineered column name to its values, in the
+        same order and with the same values as the individual create_* functions
+    """
+    columns = {}
+    
+    if 'age' in df.columns:
+        age = _as_float(df['age'].to_numpy())
+        # pd.cut with right=False: [0, 30), [30, 40), ..., [60, 100)
+        codes = np.searchsorted(AGE_BINS, age, side='right').astype(np.int8) - 1
+        codes[(codes < 0) | (codes >= len(AGE_LABELS)) | np.isnan(age)] = -1
+        columns['age_group'] = pd.Categorical.from_codes(codes, categories=AGE_LABELS, ordered=True)
+    
+    if 'trestbps' in df.columns:
+        codes = _bin_codes(_as_float(df['trestbps'].to_numpy()), BP_EDGES)
+        columns['bp_category'] = np.array(BP_LABELS + ['Unknown'])[codes]
+    
+    if 'chol' in df.columns:
+        codes = _bin_codes(_as_float(df['chol'].to_numpy()), CHOL_EDGES)
+        columns['chol_category'] = np.array(CHOL_LABELS + ['Unknown'])[codes]
+    
+    if all(col in df.columns for col in RISK_SCORE_COLUMNS):
+        columns['risk_score'] = _compute_risk_score(*(df[col].to_numpy() for col in RISK_SCORE_COLUMNS))
+    
+    for col1, col2 in INTERACTIONS:
+        if col1 in df.columns and col2 in df.columns:
+            left = df[col1].to_numpy()
+            right = df[col2].to_numpy()
+            # Widen small integer dtypes (e.g. int8 from compact loading) to avoid overflow
+            dtype = np.result_type(left, right, np.int64) if left.dtype.kind in 'iub' and right.dtype.kind in 'iub' \
+                else np.result_type(left, right)
+            columns[f'{col1}_{col2}_interaction'] = np.multiply(left, right, dtype=dtype)
+    
+    return columns
+
+def get_all_engineered_features(df: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
     """
     Apply all feature engineering steps
     
+    Uses the fused single-pass engine; the result matches chaining the individual
+    create_* functions.
+    
     Args:
         df (pd.DataFrame): Input dataframe
+        inplace (bool): Whether to append the engineered columns to ``df`` itself
+            instead of a shallow copy that shares the original column data
         
     Returns:
         pd.DataFrame: Dataframe with all engineered features
     """
     logger.info("Starting feature engineering pipeline")
     
-    df_engineered = df.copy()
+    df_engineered = df if inplace else df.copy(deep=False)
     
-    # Apply all feature engineering functions
-    df_engineered = create_age_groups(df_engineered)
-    df_engineered = create_bp_categories(df_engineered)
-    df_engineered = create_chol_categories(df_engineered)
-    df_engineered = create_risk_score(df_engineered)
-    df_engineered = create_interaction_features(df_engineered)
+    for name, values in compute_engineered_columns(df).items():
+        df_engineered[name] = values
     
     logger.info(f"Feature engineering completed. New shape: {df_engineered.shape}")
     return df_engineered
@@ -211,14 +337,118 @@ def get_engineered_feature_names() -> List[str]:
     standard_features = get_feature_names()
     
     # Engineered features
-    engineered_features = [
-        'age_group_<30', 'age_group_30-40', 'age_group_40-50', 'age_group_50-60', 'age_group_60+',
-        'bp_category_Low', 'bp_category_Normal', 'bp_category_Elevated', 
-        'bp_category_High Stage 1', 'bp_category_High Stage 2', 'bp_category_Hypertensive Crisis',
-        'chol_category_Desirable', 'chol_category_Borderline High', 'chol_category_High',
-        'risk_score',
-        'age_trestbps_interaction', 'age_chol_interaction', 
-        'trestbps_chol_interaction', 'thalach_age_interaction'
-    ]
+    engineered_features = list(ENGINEERED_FEATURE_NAMES)
+    
+    return standard_features + engineered_features
+
+class HeartFeatureTransformer(BaseEstimator, TransformerMixin):
+    """
+    Scikit-learn transformer that appends the engineered features as numeric columns
     
-    return standard_features + engineered_features
\ No newline at end of file
+    The output is the input columns followed by ENGINEERED_FEATURE_NAMES: one-hot
+    age group, BP and cholesterol categories, the risk score and the interaction
+    features. transform() works directly on NumPy arrays, so the same fitted object
+    can be pickled with the model and applied to single requests at serving time.
+    """
+    
+    def __init__(self, feature_names: List[str] = None, dtype: type = np.float64):
+        """
+        Args:
+            feature_names (List[str]): Input column order used when fitting on an array.
+                Defaults to the standard feature names
+            dtype (type): Float dtype the features are computed and returned in
+        """
+        self.feature_names = feature_names
+        self.dtype = dtype
+    
+    def fit(self, X: Union[pd.DataFrame, np.ndarray], y=None) -> 'HeartFeatureTransformer':
+        """
+        Record the input column layout
+        
+        Args:
+            X (Union[pd.DataFrame, np.ndarray]): Training features
+            y: Ignored
+            
+        Returns:
+            HeartFeatureTransformer: The fitted transformer
+        """
+        if isinstance(X, pd.DataFrame):
+            names = [str(col) for col in X.columns]
+        else:
+            names = list(self.feature_names or get_feature_names())
+        
+        missing_columns = [col for col in RISK_SCORE_COLUMNS if col not in names]
+        if missing_columns:
+            raise ValueError(f"Missing columns for feature engineering: {missing_columns}")
+        
+        self.feature_names_in_ = np.array(names, dtype=object)
+        self.n_features_in_ = len(names)
+        self.column_index_ = {col: names.index(col) for col in RISK_SCORE_COLUMNS}
+        return self
+    
+    def get_feature_names_out(self, input_features=None) -> np.ndarray:
+        """
+        Get output feature names
+        
+        Returns:
+            np.ndarray: Input column names followed by the engineered feature names
+        """
+        check_is_fitted(self, 'feature_names_in_')
+        return np.array(list(self.feature_names_in_) + ENGINEERED_FEATURE_NAMES, dtype=object)
+    
+    def transform(self, X: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """
+        Append engineered features to a batch or a single row
+        
+        Args:
+            X (Union[pd.DataFrame, np.ndarray]): Features in the fitted column order.
+                A 1-D array is treated as a single row
+            
+        Returns:
+            np.ndarray: Array of shape (n_rows, n_features_in_ + 19) in the transformer's dtype
+        """
+        check_is_fitted(self, 'feature_names_in_')
+        
+        if isinstance(X, pd.DataFrame):
+            X = X[list(self.feature_names_in_)].to_numpy(dtype=self.dtype)
+        else:
+            X = np.asarray(X, dtype=self.dtype)
+            if X.ndim == 1:
+                X = X.reshape(1, -1)
+        
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got {X.shape[1]}")
+        
+        n_rows = X.shape[0]
+        n_in = self.n_features_in_
+        out = np.zeros((n_rows, n_in + len(ENGINEERED_FEATURE_NAMES)), dtype=self.dtype)
+        out[:, :n_in] = X
+        
+        index = self.column_index_
+        age = X[:, index['age']]
+        trestbps = X[:, index['trestbps']]
+        chol = X[:, index['chol']]
+        rows = np.arange(n_rows)
+        offset = n_in
+        
+        # One-hot age groups; rows outside [0, 100) or NaN get no group
+        codes = np.searchsorted(AGE_BINS, age, side='right') - 1
+        valid = (codes >= 0) & (codes < len(AGE_LABELS))
+        out[rows[valid], offset + codes[valid]] = 1.0
+        offset += len(AGE_LABELS)
+        
+        # One-hot BP and cholesterol categories; NaN maps to 'Unknown' (no column)
+        for values, edges, labels in ((trestbps, BP_EDGES, BP_LABELS), (chol, CHOL_EDGES, CHOL_LABELS)):
+            codes = np.searchsorted(edges, values, side='right')
+            valid = ~np.isnan(values)
+            out[rows[valid], offset + codes[valid]] = 1.0
+            offset += len(labels)
+        
+        _compute_risk_score(*(X[:, index[col]] for col in RISK_SCORE_COLUMNS), out=out[:, offset])
+        offset += 1
+        
+        for col1, col2 in INTERACTIONS:
+            np.multiply(X[:, index[col1]], X[:, index[col2]], out=out[:, offset])
+            offset += 1
+        
+        return out
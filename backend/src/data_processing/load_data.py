@@ -4,13 +4,29 @@ Data loading utilities for heart disease prediction
 import pandas as pd
 import numpy as np
 import os
-from typing import Dict, Tuple
+import sys
+import time
+from typing import Dict, Tuple, Iterator, List, Any
 import logging
 
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Columns every heart disease dataset file must provide
+REQUIRED_COLUMNS = [
+    'age', 'sex', 'cp', 'trestbps', 'chol', 'fbs',
+    'restecg', 'thalach', 'exang', 'oldpeak', 'slope', 'ca', 'thal', 'target'
+]
+
+# Default number of rows per chunk when streaming large files
+DEFAULT_CHUNKSIZE = 250_000
+
 def download_dataset(url: str = None, save_path: str = None) -> str:
     """
     Download the heart disease dataset from UCI repository or load local copy
@@ -61,14 +77,7 @@ def load_csv(file_path: str) -> pd.DataFrame:
         logger.info(f"Loaded dataset with shape: {df.shape}")
         
         # Basic validation
-        required_columns = [
-            'age', 'sex', 'cp', 'trestbps', 'chol', 'fbs',
-            'restecg', 'thalach', 'exang', 'oldpeak', 'slope', 'ca', 'thal', 'target'
-        ]
-        
-        missing_columns = set(required_columns) - set(df.columns)
-        if missing_columns:
-            raise ValueError(f"Missing required columns: {missing_columns}")
+        _validate_columns(df.columns)
         
         return df
         
@@ -76,6 +85,124 @@ def load_csv(file_path: str) -> pd.DataFrame:
         logger.error(f"Error loading dataset: {str(e)}")
         raise ValueError(f"Failed to load dataset: {str(e)}")
 
+def _validate_columns(columns) -> None:
+    """
+    Check that all required dataset columns are present
+    
+    Args:
+        columns: Column labels of the dataset
+        
+    Raises:
+        ValueError: If any required column is missing
+    """
+    missing_columns = set(REQUIRED_COLUMNS) - set(columns)
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {missing_columns}")
+
+def get_column_dtypes() -> Dict[str, str]:
+    """
+    Get compact dtypes for the dataset columns based on the feature descriptions
+    
+    Categorical features (those with enumerated values) are stored as nullable
+    Int8, so a blank cell becomes <NA> instead of failing the parse; everything
+    else is float32, where missing values are NaN.
+    
+    Returns:
+        Dict[str, str]: Mapping of column name to numpy dtype name
+    """
+    dtypes = {}
+    for column, info in get_feature_descriptions().items():
+        dtypes[column] = 'Int8' if 'values' in info else 'float32'
+    return dtypes
+
+def _peak_memory_mb() -> float:
+    """
+    Get the peak resident memory of the current process in megabytes
+    
+    Returns:
+        float: Peak RSS in MB, or NaN if it cannot be determined on this platform
+    """
+    if resource is None:
+        return float('nan')
+    
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+def iter_csv_chunks(file_path: str, chunksize: int = DEFAULT_CHUNKSIZE,
+                    columns: List[str] = None) -> Iterator[pd.DataFrame]:
+    """
+    Stream a CSV file in chunks using compact dtypes
+    
+    Required columns are validated on the header alone before any data rows
+    are parsed, so a malformed multi-gigabyte file fails immediately.
+    
+    Args:
+        file_path (str): Path to CSV file
+        chunksize (int): Number of rows per chunk
+        columns (List[str]): Columns to load. If None, loads all columns
+        
+    Yields:
+        pd.DataFrame: Chunks of the dataset
+        
+    Raises:
+        FileNotFoundError: If file doesn't exist
+        ValueError: If required columns are missing
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Dataset file not found: {file_path}")
+    
+    header = pd.read_csv(file_path, nrows=0).columns
+    _validate_columns(header)
+    
+    dtypes = {col: dtype for col, dtype in get_column_dtypes().items() if col in header}
+    reader = pd.read_csv(file_path, dtype=dtypes, usecols=columns, chunksize=chunksize)
+    
+    with reader:
+        for chunk in reader:
+            yield chunk
+
+def load_csv_chunked(file_path: str, chunksize: int = DEFAULT_CHUNKSIZE,
+                     columns: List[str] = None) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Load a large CSV file chunk by chunk with compact dtypes
+    
+    Args:
+        file_path (str): Path to CSV file
+        chunksize (int): Number of rows per chunk
+        columns (List[str]): Columns to load. If None, loads all columns
+        
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, Any]]: Loaded dataframe and load statistics
+        (rows, chunks, seconds, rows_per_sec, memory_mb, peak_memory_mb)
+    """
+    start_time = time.perf_counter()
+    
+    chunks = list(iter_csv_chunks(file_path, chunksize=chunksize, columns=columns))
+    if chunks:
+        df = pd.concat(chunks, ignore_index=True)
+    else:
+        df = pd.read_csv(file_path, nrows=0, usecols=columns)
+    
+    elapsed = time.perf_counter() - start_time
+    stats = {
+        'rows': len(df),
+        'chunks': len(chunks),
+        'seconds': elapsed,
+        'rows_per_sec': len(df) / elapsed if elapsed > 0 else float('inf'),
+        'memory_mb': df.memory_usage(deep=True).sum() / (1024 * 1024),
+        'peak_memory_mb': _peak_memory_mb()
+    }
+    
+    logger.info(
+        f"Loaded dataset with shape: {df.shape} in {stats['chunks']} chunks "
+        f"({stats['rows_per_sec']:,.0f} rows/sec, {stats['memory_mb']:.1f} MB, "
+        f"peak RSS {stats['peak_memory_mb']:.1f} MB)"
+    )
+    return df, stats
+
 def get_feature_descriptions() -> Dict[str, Dict]:
     """
     Get feature descriptions and metadata
@@ -6,9 +6,16 @@ import numpy as np
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 from sklearn.model_selection import train_test_split
 from sklearn.impute import SimpleImputer
-from typing import Tuple, List
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils.validation import check_is_fitted
+from scipy import sparse
+from typing import Tuple, List, Dict, Iterable, Union
 import logging
 
+from src.data_processing.feature_engineering import get_feature_names
+from src.data_processing.load_data import get_feature_descriptions
+from src.data_processing.sketches import QuantileSketch
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -48,69 +55,299 @@ def handle_missing_values(df: pd.DataFrame) -> pd.DataFrame:
     logger.info("Missing values handled successfully")
     return df_copy
 
-def remove_outliers(df: pd.DataFrame, columns: List[str] = None) -> pd.DataFrame:
+def compute_outlier_bounds(data: Union[pd.DataFrame, Iterable[pd.DataFrame]], columns: List[str],
+                           approximate: bool = False, sketch_capacity: int = 2048,
+                           chunksize: int = 100_000) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute IQR outlier bounds for several columns at once
+    
+    Args:
+        data (Union[pd.DataFrame, Iterable[pd.DataFrame]]): Dataframe, or an iterable of
+            dataframe chunks (e.g. from iter_csv_chunks) for data that doesn't fit in memory
+        columns (List[str]): Columns to compute bounds for
+        approximate (bool): Whether to estimate quartiles with a streaming QuantileSketch
+            instead of an exact np.nanquantile. Always used for chunk iterables
+        sketch_capacity (int): Points kept per column by the sketch
+        chunksize (int): Rows converted at a time when sketching a dataframe
+        
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Lower and upper bounds, one per column
+    """
+    if isinstance(data, pd.DataFrame) and not approximate:
+        q1, q3 = np.nanquantile(data[columns].to_numpy(dtype=np.float64), [0.25, 0.75], axis=0)
+    else:
+        chunks = data
+        if isinstance(data, pd.DataFrame):
+            chunks = (data.iloc[start:start + chunksize] for start in range(0, len(data), chunksize))
+        
+        sketch = QuantileSketch(n_columns=len(columns), capacity=sketch_capacity)
+        for chunk in chunks:
+            sketch.update(chunk[columns].to_numpy(dtype=np.float64))
+        q1, q3 = sketch.quantile([0.25, 0.75])
+    
+    iqr = q3 - q1
+    return q1 - 1.5 * iqr, q3 + 1.5 * iqr
+
+def remove_outliers(df: pd.DataFrame, columns: List[str] = None, approximate: bool = False,
+                    bounds: Tuple[np.ndarray, np.ndarray] = None,
+                    sketch_capacity: int = 2048) -> Tuple[pd.DataFrame, Dict[str, int]]:
     """
     Remove outliers using IQR method
     
+    All columns are checked together: quartiles come from one np.nanquantile call
+    (or a streaming sketch) and rows are filtered with a single boolean mask.
+    
     Args:
         df (pd.DataFrame): Input dataframe
         columns (List[str]): Columns to check for outliers. If None, uses all numerical columns
+        approximate (bool): Whether to estimate quartiles with a streaming QuantileSketch
+        bounds (Tuple[np.ndarray, np.ndarray]): Precomputed (lower, upper) bounds for ``columns``,
+            e.g. from compute_outlier_bounds over a chunked file
+        sketch_capacity (int): Points kept per column by the sketch
         
     Returns:
-        pd.DataFrame: Dataframe with outliers removed
+        Tuple[pd.DataFrame, Dict[str, int]]: Dataframe with outliers removed and the number
+        of outlying values found in each column
     """
-    df_copy = df.copy()
-    
     if columns is None:
-        columns = df_copy.select_dtypes(include=[np.number]).columns.tolist()
+        columns = df.select_dtypes(include=[np.number]).columns.tolist()
+    elif bounds is None:
+        columns = [column for column in columns if column in df.columns]
     
-    initial_shape = df_copy.shape
-    outlier_indices = set()
+    if not columns:
+        logger.info("No columns to check for outliers")
+        return df.copy(), {}
+    
+    if bounds is None:
+        bounds = compute_outlier_bounds(df, columns, approximate=approximate,
+                                        sketch_capacity=sketch_capacity)
+    lower_bound, upper_bound = bounds
+    
+    values = df[columns].to_numpy(dtype=np.float64)
+    outliers = (values < lower_bound) | (values > upper_bound)
+    
+    report = dict(zip(columns, outliers.sum(axis=0).tolist()))
+    df_filtered = df[~outliers.any(axis=1)]
+    
+    logger.info(f"Removed {len(df) - len(df_filtered)} outliers. Shape changed from {df.shape} to {df_filtered.shape}")
+    return df_filtered, report
+
+def get_categorical_columns() -> List[str]:
+    """
+    Get the categorical feature columns declared in the feature descriptions
+    
+    Returns:
+        List[str]: Features with enumerated values (excluding the target)
+    """
+    return [
+        column for column, info in get_feature_descriptions().items()
+        if 'values' in info and column != 'target'
+    ]
+
+class CategoricalEncoder(BaseEstimator, TransformerMixin):
+    """
+    Fitted one-hot encoder with a fixed, schema-defined output layout
+    
+    Categories come from get_feature_descriptions() rather than from the values
+    present in a frame, so the encoded columns are identical for training data,
+    a serving batch and a single request. Output columns follow pd.get_dummies:
+    passthrough columns first, then ``<column>_<category>`` indicators.
+    """
     
-    for column in columns:
-        if column not in df_copy.columns:
-            continue
+    def __init__(self, columns: List[str] = None, drop_first: bool = True,
+                 handle_unknown: str = 'ignore', sparse_output: bool = False, dtype: type = np.float64):
+        """
+        Args:
+            columns (List[str]): Columns to encode. If None, uses the schema's categorical columns
+            drop_first (bool): Whether to drop the first category of each column
+            handle_unknown (str): 'ignore' encodes unseen categories as all zeros
+                (the same as the dropped first category when drop_first is set);
+                'error' raises a ValueError
+            sparse_output (bool): Whether transform_onehot returns a scipy CSR matrix
+            dtype (type): Float dtype of the array returned by transform
+        """
+        self.columns = columns
+        self.drop_first = drop_first
+        self.handle_unknown = handle_unknown
+        self.sparse_output = sparse_output
+        self.dtype = dtype
+    
+    def fit(self, X: Union[pd.DataFrame, np.ndarray], y=None) -> 'CategoricalEncoder':
+        """
+        Fix the input and output column layout
+        
+        No data values are scanned; categories are taken from the feature schema.
+        
+        Args:
+            X (Union[pd.DataFrame, np.ndarray]): Training features. Arrays are assumed
+                to use the standard feature order
+            y: Ignored
             
-        # Calculate Q1, Q3, and IQR
-        Q1 = df_copy[column].quantile(0.25)
-        Q3 = df_copy[column].quantile(0.75)
-        IQR = Q3 - Q1
+        Returns:
+            CategoricalEncoder: The fitted encoder
+        """
+        if self.handle_unknown not in ('ignore', 'error'):
+            raise ValueError(f"handle_unknown must be 'ignore' or 'error', got '{self.handle_unknown}'")
         
-        # Define outlier bounds
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
+        if isinstance(X, pd.DataFrame):
+            names = [str(col) for col in X.columns]
+        else:
+            names = get_feature_names()
         
-        # Find outlier indices
-        column_outliers = df_copy[(df_copy[column] < lower_bound) | 
-                                 (df_copy[column] > upper_bound)].index
-        outlier_indices.update(column_outliers)
-    
-    # Remove outliers
-    df_copy = df_copy.drop(list(outlier_indices))
+        schema = get_feature_descriptions()
+        columns = self.columns if self.columns is not None else get_categorical_columns()
+        columns = [col for col in columns if col in names]
+        
+        unknown_columns = [col for col in columns if 'values' not in schema.get(col, {})]
+        if unknown_columns:
+            raise ValueError(f"No categories defined in the feature schema for: {unknown_columns}")
+        
+        self.feature_names_in_ = np.array(names, dtype=object)
+        self.n_features_in_ = len(names)
+        self.encoded_columns_ = columns
+        self.categories_ = [np.array(sorted(schema[col]['values']), dtype=np.float64) for col in columns]
+        self.encoded_index_ = [names.index(col) for col in columns]
+        self.passthrough_index_ = [i for i, col in enumerate(names) if col not in columns]
+        
+        onehot_names = []
+        for col, categories in zip(columns, self.categories_):
+            kept = categories[1:] if self.drop_first else categories
+            onehot_names.extend(f'{col}_{int(category)}' for category in kept)
+        self.onehot_names_ = onehot_names
+        return self
+    
+    def get_feature_names_out(self, input_features=None) -> np.ndarray:
+        """
+        Get output feature names
+        
+        Returns:
+            np.ndarray: Passthrough column names followed by the indicator column names
+        """
+        check_is_fitted(self, 'feature_names_in_')
+        passthrough = [self.feature_names_in_[i] for i in self.passthrough_index_]
+        return np.array(passthrough + self.onehot_names_, dtype=object)
+    
+    def _as_array(self, X: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """Get the input as a 2-D float array in the fitted column order"""
+        check_is_fitted(self, 'feature_names_in_')
+        
+        if isinstance(X, pd.DataFrame):
+            return X[list(self.feature_names_in_)].to_numpy(dtype=self.dtype)
+        
+        X = np.asarray(X, dtype=self.dtype)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got {X.shape[1]}")
+        return X
+    
+    def _fill_onehot(self, X: np.ndarray, out: np.ndarray):
+        """Write the indicator columns for X into out"""
+        rows = np.arange(X.shape[0])
+        offset = 0
+        
+        for col, index, categories in zip(self.encoded_columns_, self.encoded_index_, self.categories_):
+            values = X[:, index]
+            codes = np.searchsorted(categories, values)
+            known = (codes < len(categories)) & (categories[np.minimum(codes, len(categories) - 1)] == values)
+            
+            if self.handle_unknown == 'error' and not known.all():
+                unseen = np.unique(values[~known]).tolist()
+                raise ValueError(f"Unknown categories {unseen} in column '{col}'")
+            
+            if self.drop_first:
+                known &= codes > 0
+                codes = codes - 1
+            out[rows[known], offset + codes[known]] = 1
+            offset += len(categories) - (1 if self.drop_first else 0)
+    
+    def transform_onehot(self, X: Union[pd.DataFrame, np.ndarray]):
+        """
+        Encode only the categorical columns
+        
+        Args:
+            X (Union[pd.DataFrame, np.ndarray]): Features in the fitted column order
+            
+        Returns:
+            Union[np.ndarray, scipy.sparse.csr_matrix]: uint8 indicators of shape
+            (n_rows, len(onehot_names_))
+        """
+        X = self._as_array(X)
+        onehot = np.zeros((X.shape[0], len(self.onehot_names_)), dtype=np.uint8)
+        self._fill_onehot(X, onehot)
+        
+        if self.sparse_output:
+            return sparse.csr_matrix(onehot)
+        return onehot
     
-    logger.info(f"Removed {len(outlier_indices)} outliers. Shape changed from {initial_shape} to {df_copy.shape}")
-    return df_copy
+    def transform(self, X: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """
+        Encode a batch or a single row into the model input layout
+        
+        Args:
+            X (Union[pd.DataFrame, np.ndarray]): Features in the fitted column order.
+                A 1-D array is treated as a single row
+            
+        Returns:
+            np.ndarray: Array in the encoder's dtype with passthrough columns followed by indicators
+        """
+        X = self._as_array(X)
+        n_passthrough = len(self.passthrough_index_)
+        
+        out = np.zeros((X.shape[0], n_passthrough + len(self.onehot_names_)), dtype=self.dtype)
+        out[:, :n_passthrough] = X[:, self.passthrough_index_]
+        self._fill_onehot(X, out[:, n_passthrough:])
+        return out
+    
+    def transform_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Encode a dataframe, keeping passthrough column dtypes
+        
+        Args:
+            df (pd.DataFrame): Input dataframe with the fitted columns
+            
+        Returns:
+            pd.DataFrame: Dataframe with uint8 indicator columns in place of the categorical columns
+        """
+        passthrough = df[[self.feature_names_in_[i] for i in self.passthrough_index_]]
+        onehot = self.transform_onehot(df)
+        if sparse.issparse(onehot):
+            onehot = onehot.toarray()
+        
+        onehot = pd.DataFrame(onehot, columns=self.onehot_names_, index=df.index)
+        return pd.concat([passthrough, onehot], axis=1)
 
-def encode_categorical(df: pd.DataFrame, columns: List[str] = None) -> pd.DataFrame:
+def encode_categorical(df: pd.DataFrame, columns: List[str] = None,
+                       encoder: CategoricalEncoder = None) -> pd.DataFrame:
     """
     Encode categorical variables using one-hot encoding
     
     Args:
         df (pd.DataFrame): Input dataframe
-        columns (List[str]): Columns to encode. If None, automatically detects categorical columns
+        columns (List[str]): Columns to encode. If None, uses the categorical columns from
+            the feature descriptions plus any object columns
+        encoder (CategoricalEncoder): Encoder giving a fixed output layout. It is fitted on
+            df if it hasn't been fitted yet; ``columns`` is ignored when it is given
         
     Returns:
         pd.DataFrame: Dataframe with encoded categorical variables
     """
+    if encoder is not None:
+        if not hasattr(encoder, 'feature_names_in_'):
+            encoder.fit(df)
+        df_encoded = encoder.transform_frame(df)
+        logger.info(f"Encoded dataframe shape: {df_encoded.shape}")
+        return df_encoded
+    
     df_copy = df.copy()
     
     if columns is None:
-        # Automatically detect categorical columns (object type or with few unique values)
-        categorical_columns = []
-        for col in df_copy.columns:
-            if df_copy[col].dtype == 'object' or df_copy[col].nunique() <= 10:
-                categorical_columns.append(col)
-        columns = categorical_columns
+        # Use the schema instead of scanning each column's cardinality
+        schema_columns = set(get_categorical_columns())
+        columns = [
+            col for col in df_copy.columns
+            if col in schema_columns or df_copy[col].dtype == 'object'
+        ]
     
     if not columns:
         logger.info("No categorical columns found to encode")
@@ -150,10 +387,11 @@ def scale_features(df: pd.DataFrame, scaler=None, fit=True) -> Tuple[pd.DataFram
     if scaler is None:
         scaler = StandardScaler()
     
+    # Fitted on arrays, like the rows the predictor passes at serving time
     if fit:
-        df_copy[numerical_columns] = scaler.fit_transform(df_copy[numerical_columns])
+        df_copy[numerical_columns] = scaler.fit_transform(df_copy[numerical_columns].to_numpy())
     else:
-        df_copy[numerical_columns] = scaler.transform(df_copy[numerical_columns])
+        df_copy[numerical_columns] = scaler.transform(df_copy[numerical_columns].to_numpy())
     
     return df_copy, scaler
 
@@ -186,13 +424,20 @@ def split_data(df: pd.DataFrame, target_column: str = 'target',
     logger.info(f"Data split - Train: {X_train.shape}, Test: {X_test.shape}")
     return X_train, X_test, y_train, y_test
 
-def preprocess_pipeline(df: pd.DataFrame, target_column: str = 'target') -> Tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series, object]:
+def preprocess_pipeline(df: pd.DataFrame, target_column: str = 'target',
+                        feature_transformer=None,
+                        encoder: CategoricalEncoder = None) -> Tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series, object]:
     """
     Complete preprocessing pipeline
     
     Args:
         df (pd.DataFrame): Input dataframe
         target_column (str): Name of the target column
+        feature_transformer (HeartFeatureTransformer): Optional unfitted feature transformer.
+            When given it is fitted here and applied before encoding, so the same object can
+            be saved with the model and reused at serving time
+        encoder (CategoricalEncoder): Optional unfitted categorical encoder, fitted here and
+            used instead of pd.get_dummies so serving can reproduce the exact column layout
         
     Returns:
         Tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series, StandardScaler]: 
@@ -204,10 +449,27 @@ def preprocess_pipeline(df: pd.DataFrame, target_column: str = 'target') -> Tupl
     df_clean = handle_missing_values(df)
     
     # Remove outliers (optional, can be skipped for prediction)
-    # df_clean = remove_outliers(df_clean)
+    # df_clean, _ = remove_outliers(df_clean)
     
-    # Encode categorical variables
-    df_encoded = encode_categorical(df_clean)
+    if feature_transformer is None and encoder is None:
+        # Encode categorical variables
+        df_encoded = encode_categorical(df_clean)
+    else:
+        features = df_clean.drop(columns=[target_column])
+        
+        if feature_transformer is not None:
+            # Engineer features with the same transformer that will be used at serving time
+            feature_transformer.fit(features)
+            features = pd.DataFrame(
+                feature_transformer.transform(features),
+                columns=feature_transformer.get_feature_names_out(),
+                index=features.index
+            )
+        
+        if encoder is not None:
+            features = encode_categorical(features, encoder=encoder.fit(features))
+        
+        df_encoded = features.assign(**{target_column: df_clean[target_column]})
     
     # Split data
     X_train, X_test, y_train, y_test = split_data(df_encoded, target_column)
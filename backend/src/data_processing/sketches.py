@@ -0,0 +1,152 @@
+"""
+Streaming quantile sketches for data that doesn't fit in memory
+"""
+import numpy as np
+from typing import Union
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class QuantileSketch:
+    """
+    Mergeable weighted quantile sketch over one or more columns
+    
+    Rows are buffered until the buffer holds twice ``capacity`` entries, then each
+    column is compressed to ``capacity`` equal-weight points taken at evenly spaced
+    positions of its weighted CDF. Memory is bounded by ``2 * capacity`` rows no
+    matter how much data is streamed through ``update``; the rank error of a
+    quantile is on the order of ``1 / capacity`` per compression level. NaN values
+    are ignored, matching ``np.nanquantile``.
+    """
+    
+    def __init__(self, n_columns: int = 1, capacity: int = 2048):
+        """
+        Args:
+            n_columns (int): Number of columns tracked by the sketch
+            capacity (int): Number of points kept per column after compression
+        """
+        self.n_columns = n_columns
+        self.capacity = capacity
+        self.values = np.empty((0, n_columns), dtype=np.float64)
+        self.weights = np.empty((0, n_columns), dtype=np.float64)
+        self.count = np.zeros(n_columns, dtype=np.float64)
+    
+    def update(self, X: Union[np.ndarray, list]) -> 'QuantileSketch':
+        """
+        Add a batch of rows to the sketch
+        
+        Args:
+            X (Union[np.ndarray, list]): Array of shape (n_rows, n_columns), or 1-D for one column
+            
+        Returns:
+            QuantileSketch: The updated sketch
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(-1, 1)
+        if X.shape[1] != self.n_columns:
+            raise ValueError(f"Expected {self.n_columns} columns, got {X.shape[1]}")
+        
+        weights = (~np.isnan(X)).astype(np.float64)
+        self.count += weights.sum(axis=0)
+        self.values = np.concatenate([self.values, X])
+        self.weights = np.concatenate([self.weights, weights])
+        
+        if len(self.values) > 2 * self.capacity:
+            self._compress()
+        return self
+    
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        """
+        Merge another sketch over the same columns into this one
+        
+        Args:
+            other (QuantileSketch): Sketch to merge
+            
+        Returns:
+            QuantileSketch: The merged sketch
+        """
+        if other.n_columns != self.n_columns:
+            raise ValueError("Cannot merge sketches with different numbers of columns")
+        
+        self.count += other.count
+        self.values = np.concatenate([self.values, other.values])
+        self.weights = np.concatenate([self.weights, other.weights])
+        
+        if len(self.values) > 2 * self.capacity:
+            self._compress()
+        return self
+    
+    def _sorted(self):
+        """Get values and weights sorted per column (NaN last)"""
+        order = np.argsort(self.values, axis=0)
+        values = np.take_along_axis(self.values, order, axis=0)
+        weights = np.take_along_axis(self.weights, order, axis=0)
+        return values, weights
+    
+    def _compress(self):
+        """Reduce each column to ``capacity`` equal-weight points"""
+        values, weights = self._sorted()
+        cumulative = np.cumsum(weights, axis=0)
+        total = cumulative[-1]
+        
+        targets = (np.arange(self.capacity) + 0.5) / self.capacity
+        compressed = np.empty((self.capacity, self.n_columns), dtype=np.float64)
+        
+        for j in range(self.n_columns):
+            if total[j] == 0:
+                compressed[:, j] = np.nan
+                continue
+            index = np.searchsorted(cumulative[:, j], targets * total[j], side='left')
+            compressed[:, j] = values[np.minimum(index, len(values) - 1), j]
+        
+        self.values = compressed
+        self.weights = np.where(np.isnan(compressed), 0.0, total / self.capacity)
+    
+    def quantile(self, q: Union[float, list, np.ndarray]) -> np.ndarray:
+        """
+        Estimate quantiles of every column
+        
+        Args:
+            q (Union[float, list, np.ndarray]): Quantile or quantiles in [0, 1]
+            
+        Returns:
+            np.ndarray: Array of shape (len(q), n_columns), or (n_columns,) for a scalar q
+        """
+        q = np.asarray(q, dtype=np.float64)
+        values, weights = self._sorted()
+        result = np.full((q.size, self.n_columns), np.nan)
+        
+        for j in range(self.n_columns):
+            valid = weights[:, j] > 0
+            if not valid.any():
+                continue
+            w = weights[valid, j]
+            cumulative = np.cumsum(w)
+            # Rank of each point, scaled so unit weights reproduce np.quantile's linear interpolation
+            span = cumulative[-1] - w[-1]
+            positions = (cumulative - w) / span if span > 0 else np.zeros_like(w)
+            result[:, j] = np.interp(q.ravel(), positions, values[valid, j])
+        
+        return result[0] if q.ndim == 0 else result
+    
+    def cdf(self, x: Union[float, list, np.ndarray], column: int = 0) -> np.ndarray:
+        """
+        Estimate the fraction of values in a column that are <= x
+        
+        Args:
+            x (Union[float, list, np.ndarray]): Values to rank
+            column (int): Column index
+            
+        Returns:
+            np.ndarray: Estimated CDF values in [0, 1]
+        """
+        values, weights = self._sorted()
+        valid = weights[:, column] > 0
+        if not valid.any():
+            return np.full(np.shape(x), np.nan)
+        
+        cumulative = np.cumsum(weights[valid, column])
+        return np.interp(x, values[valid, column], cumulative / cumulative[-1], left=0.0, right=1.0)
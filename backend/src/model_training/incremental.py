@@ -0,0 +1,331 @@
+"""
+Incremental retraining of a saved model on newly labeled data
+
+Instead of retraining every model on the full history, an incremental run
+updates the saved bundle with the new rows only:
+
+- The scaler is refit from its stored sufficient statistics. StandardScaler
+  keeps the count (n_samples_seen_), mean (mean_) and variance (var_ = M2 / n)
+  of everything it has seen; partial_fit combines them with the statistics of
+  the new rows using the parallel variance update.
+- Split thresholds of the existing trees were learned in the old scaled space.
+  Scaling is a positive affine map per feature, so each threshold is mapped to
+  the new scaled space and the trees keep splitting the raw inputs where they
+  did. Values lying exactly on a split keep their side as well for every value
+  seen in the new rows; the lineage records how far rescaling moved the
+  probabilities on the held-out rows.
+- A random forest grows new trees fitted on the new rows (warm_start); XGBoost
+  continues boosting from the saved booster for additional rounds.
+- The new rows are split like the full pipeline. Only the training part is
+  folded into the scaler statistics and fitted by the new trees; the held-out
+  20% measure the update and are never trained on, so rows_seen counts
+  training rows only. The drift reference absorbs all new rows.
+- The population percentile index needs the model's out-of-fold probabilities
+  on the whole reference population, which an incremental run does not have.
+  It is kept as is and marked stale in the lineage and the model card, with the
+  version it was built for, until the next full training rebuilds it.
+
+The cost of a run therefore depends on the number of new rows and added
+trees, not on the size of the history. Each run appends an entry to the
+bundle's lineage and rewrites the model card.
+"""
+import os
+import copy
+import json
+import time
+import pickle
+import logging
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+from src.model_training.train import (
+    save_best_model, count_estimators, lineage_entry, load_lineage, save_lineage, create_model_card
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Trees or boosting rounds added by an incremental run
+DEFAULT_NEW_ESTIMATORS = 10
+
+def _load_artifact(model_path: str, filename: str, required: bool = False) -> Any:
+    artifact_file = os.path.join(model_path, filename)
+    if not os.path.exists(artifact_file):
+        if required:
+            raise FileNotFoundError(f"No {filename} in {model_path}")
+        return None
+    with open(artifact_file, 'rb') as f:
+        return pickle.load(f)
+
+def _probe_images(X: np.ndarray, scaler: Any) -> list:
+    """Per feature, the float32 scaled values of the distinct raw values in X, in raw order"""
+    images = []
+    for j in range(X.shape[1]):
+        values = np.unique(X[:, j])
+        scaled = ((values - scaler.mean_[j]) / scaler.scale_[j]).astype(np.float32).astype(np.float64)
+        images.append(np.concatenate([[-np.inf], scaled, [np.inf]]))
+    return images
+
+def _map_thresholds(thresholds: np.ndarray, features: np.ndarray, multiplier: np.ndarray, offset: np.ndarray,
+                    old_images: list, new_images: list, strict: bool) -> np.ndarray:
+    """
+    Map thresholds to the new scaling, keeping the side of every probe value
+
+    Args:
+        thresholds (np.ndarray): Thresholds in the old scaling
+        features (np.ndarray): Feature index of each threshold
+        multiplier (np.ndarray): Per-feature old_scale / new_scale
+        offset (np.ndarray): Per-feature (old_mean - new_mean) / new_scale
+        old_images (list): Probe values per feature in the old scaling (None: no probes)
+        new_images (list): The same probe values in the new scaling
+        strict (bool): Values below the threshold go left (XGBoost) instead of at or below (scikit-learn)
+
+    Returns:
+        np.ndarray: Mapped thresholds (float32 values when strict)
+    """
+    mapped = thresholds * multiplier[features] + offset[features]
+    if strict:
+        mapped = mapped.astype(np.float32).astype(np.float64)
+    if old_images is None:
+        return mapped
+
+    for j in np.unique(features):
+        selected = features == j
+        old, new = old_images[j], new_images[j]
+        # Probe values going left in the old scaling are old[1:k]; they must stay left of the new threshold
+        k = np.searchsorted(old, thresholds[selected], side='left' if strict else 'right')
+        lo, hi = new[k - 1], new[k]
+        value = mapped[selected]
+        if strict:
+            value = np.where(value <= lo, np.nextafter(lo.astype(np.float32), np.float32(np.inf)), value)
+            value = np.where(value > hi, hi, value)
+        else:
+            value = np.where(value < lo, lo, value)
+            value = np.where(value >= hi, np.nextafter(hi.astype(np.float32), np.float32(-np.inf)), value)
+        # Probes rounding to the same new value cannot be separated
+        mapped[selected] = np.where(lo < hi, value, mapped[selected])
+    return mapped
+
+def rescale_splits(model: Any, old_scaler: Any, new_scaler: Any, X: np.ndarray = None) -> Any:
+    """
+    Map the split thresholds of a tree ensemble from one scaling of the features to another
+
+    A threshold t on scaled feature j splits the raw values at t * old_scale + old_mean,
+    which is (t * old_scale + old_mean - new_mean) / new_scale in the new scaling.
+    Discrete features often have values lying exactly on a threshold, whose side then
+    depends on float32 rounding (both libraries compare float32 features). The distinct
+    raw values of X are used as probes: each mapped threshold is moved, by at most
+    the distance to the nearest probe, so that every probe stays on its old side.
+
+    Args:
+        model (Any): Fitted random forest or XGBoost classifier, updated in place
+        old_scaler (Any): Scaler the model was trained with
+        new_scaler (Any): Scaler the model will be used with
+        X (np.ndarray): Unscaled features whose values keep their branches (optional)
+
+    Returns:
+        Any: The model
+
+    Raises:
+        ValueError: If the model is not a supported tree ensemble
+    """
+    multiplier = old_scaler.scale_ / new_scaler.scale_
+    offset = (old_scaler.mean_ - new_scaler.mean_) / new_scaler.scale_
+    old_images = new_images = None
+    if X is not None:
+        X = np.asarray(X, dtype=np.float64)
+        old_images, new_images = _probe_images(X, old_scaler), _probe_images(X, new_scaler)
+
+    if hasattr(model, 'estimators_'):
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            internal = tree.feature >= 0
+            # tree_.threshold is a view of the node array, so this updates the tree
+            tree.threshold[internal] = _map_thresholds(tree.threshold[internal], tree.feature[internal], multiplier,
+                                                       offset, old_images, new_images, strict=False)
+        return model
+
+    if hasattr(model, 'get_booster'):
+        booster = model.get_booster()
+        config = json.loads(booster.save_raw('json'))
+        for tree in config['learner']['gradient_booster']['model']['trees']:
+            # JSON holds the shortest decimals of float32 values; round them back to those values
+            conditions = np.array(tree['split_conditions'], dtype=np.float32).astype(np.float64)
+            features = np.array(tree['split_indices'])
+            # Leaves store their value in split_conditions
+            internal = np.array(tree['left_children']) >= 0
+            conditions[internal] = _map_thresholds(conditions[internal], features[internal], multiplier, offset,
+                                                   old_images, new_images, strict=True)
+            tree['split_conditions'] = conditions.tolist()
+        booster.load_model(bytearray(json.dumps(config).encode()))
+        return model
+
+    raise ValueError(f"Incremental retraining supports random forests and XGBoost, not {type(model).__name__}")
+
+def _grow(model: Any, X: np.ndarray, y: pd.Series, n_new_estimators: int) -> Any:
+    """Add trees or boosting rounds fitted on the new rows only"""
+    if hasattr(model, 'estimators_'):
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_new_estimators)
+        model.fit(X, y)
+        model.set_params(warm_start=False)
+        return model
+
+    grown = copy.deepcopy(model)
+    grown.set_params(n_estimators=n_new_estimators)
+    grown.fit(X, y, xgb_model=model.get_booster())
+    grown.set_params(n_estimators=grown.get_booster().num_boosted_rounds())
+    return grown
+
+def _evaluate(model: Any, X: np.ndarray, y: pd.Series) -> Dict[str, float]:
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
+
+    y_pred = model.predict(X)
+    y_pred_proba = model.predict_proba(X)[:, 1]
+    return {
+        'accuracy': accuracy_score(y, y_pred),
+        'precision': precision_score(y, y_pred, zero_division=0),
+        'recall': recall_score(y, y_pred, zero_division=0),
+        'f1_score': f1_score(y, y_pred, zero_division=0),
+        'roc_auc': roc_auc_score(y, y_pred_proba) if y.nunique() > 1 else float('nan')
+    }
+
+def incremental_training_pipeline(new_df: pd.DataFrame, model_path: str = None,
+                                  n_new_estimators: int = DEFAULT_NEW_ESTIMATORS,
+                                  target_column: str = 'target') -> Dict[str, Any]:
+    """
+    Update the saved model with newly labeled data
+
+    The new rows are split like the full pipeline; the held-out part (excluded from
+    the scaler update and the new trees) measures the model before and after the
+    update, and how far rescaling the existing trees moved their probabilities.
+    The updated bundle replaces the saved one, the drift reference absorbs the new
+    rows, and the percentile index is kept but recorded as stale in the lineage.
+
+    Args:
+        new_df (pd.DataFrame): Newly labeled raw data with the model's input columns and the target
+        model_path (str): Model directory (default: the trained models directory)
+        n_new_estimators (int): Trees (random forest) or boosting rounds (XGBoost) to add
+        target_column (str): Name of the target column
+
+    Returns:
+        Dict[str, Any]: The updated model, its lineage entry, the held-out metrics before
+        and after the update, and the ONNX export and float32 validation reports
+
+    Raises:
+        ValueError: If the saved model is not a supported tree ensemble or the new
+        training rows do not contain every class
+    """
+    from src.data_processing.preprocess import handle_missing_values, encode_categorical, split_data
+    from src.prediction.onnx_export import export_onnx_model
+    from src.prediction.precision import validate_float32
+    from src.prediction.predictor import HeartDiseasePredictor
+
+    if model_path is None:
+        model_path = os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'trained_models')
+    start = time.perf_counter()
+
+    model = _load_artifact(model_path, 'best_model.pkl', required=True)
+    scaler = _load_artifact(model_path, 'scaler.pkl', required=True)
+    feature_names = _load_artifact(model_path, 'feature_names.pkl', required=True)
+    feature_transformer = _load_artifact(model_path, 'feature_transformer.pkl')
+    categorical_encoder = _load_artifact(model_path, 'categorical_encoder.pkl')
+    percentile_index = _load_artifact(model_path, 'percentile_index.pkl')
+    drift_reference = _load_artifact(model_path, 'drift_reference.pkl')
+    lineage = load_lineage(model_path)
+    if count_estimators(model) is None:
+        raise ValueError(f"Incremental retraining supports random forests and XGBoost, not {type(model).__name__}")
+
+    # Preprocess the new rows with the fitted steps; nothing is refit on them
+    df_clean = handle_missing_values(new_df)
+    features = df_clean.drop(columns=[target_column])
+    if feature_transformer is not None:
+        features = pd.DataFrame(feature_transformer.transform(features),
+                                columns=feature_transformer.get_feature_names_out(), index=features.index)
+    if categorical_encoder is not None:
+        features = encode_categorical(features, encoder=categorical_encoder)
+    elif feature_transformer is None:
+        features = encode_categorical(features)
+    features = features.reindex(columns=feature_names, fill_value=0).astype(np.float64)
+
+    X_train, X_test, y_train, y_test = split_data(features.assign(**{target_column: df_clean[target_column]}),
+                                                  target_column)
+    if set(np.unique(y_train)) != set(model.classes_):
+        raise ValueError(f"New training rows must contain every class {list(model.classes_)}")
+
+    # Arrays throughout, like the rows the predictor passes at serving time
+    def scale(X: pd.DataFrame, fitted_scaler: Any) -> np.ndarray:
+        return fitted_scaler.transform(X.to_numpy())
+
+    previous_metrics = _evaluate(model, scale(X_test, scaler), y_test)
+    previous_probabilities = model.predict_proba(scale(X_test, scaler))[:, 1]
+    parent = lineage[-1]['version'] if lineage else HeartDiseasePredictor._file_version(
+        os.path.join(model_path, 'best_model.pkl'))
+    n_before = count_estimators(model)
+
+    # Fold the new training rows (not the held-out ones) into the scaler's count, mean and variance
+    new_scaler = copy.deepcopy(scaler).partial_fit(X_train.to_numpy())
+    rescale_splits(model, scaler, new_scaler, X=features)
+    rescaled = model.predict_proba(scale(X_test, new_scaler))[:, 1]
+    rescale_check = {
+        'max_abs_probability_difference': float(np.abs(rescaled - previous_probabilities).max()),
+        'label_flips': int(np.sum((rescaled >= 0.5) != (previous_probabilities >= 0.5)))
+    }
+
+    model = _grow(model, scale(X_train, new_scaler), y_train, n_new_estimators)
+    metrics = _evaluate(model, scale(X_test, new_scaler), y_test)
+
+    if drift_reference is not None:
+        drift_reference.update(df_clean)
+    save_best_model(model, new_scaler, feature_names, model_path=model_path,
+                    feature_transformer=feature_transformer, categorical_encoder=categorical_encoder,
+                    percentile_index=percentile_index, drift_reference=drift_reference)
+
+    # Re-export the ONNX graph and re-check float32 inference on the new held-out rows
+    if feature_transformer is not None or categorical_encoder is not None:
+        input_features = list((feature_transformer or categorical_encoder).feature_names_in_)
+        held_out = df_clean.loc[X_test.index, input_features].to_numpy(dtype=np.float64)
+    else:
+        input_features = feature_names
+        held_out = X_test.to_numpy(dtype=np.float64)
+    onnx_report = export_onnx_model(model, new_scaler, input_features, held_out, model_path=model_path,
+                                    feature_transformer=feature_transformer,
+                                    categorical_encoder=categorical_encoder)
+    float32_report = validate_float32(held_out, model_path=model_path)
+
+    # The percentile index still describes the model of the last full training
+    details = {}
+    if percentile_index is not None:
+        built_for = lineage[-1].get('percentile_index', {}).get('built_for', lineage[-1]['version']) \
+            if lineage else parent
+        details['percentile_index'] = {'built_for': built_for, 'stale': True}
+    
+    entry = lineage_entry(model, model_path, 'incremental', len(X_train), new_scaler.n_samples_seen_, metrics,
+                          parent=parent, estimators_added=count_estimators(model) - n_before, **details,
+                          previous_metrics={name: float(value) for name, value in previous_metrics.items()},
+                          rescale_check=rescale_check,
+                          seconds=time.perf_counter() - start)
+    lineage.append(entry)
+    save_lineage(model_path, lineage)
+    model_name = lineage[0].get('model_name', type(model).__name__)
+    create_model_card(model_name, metrics, save_path=model_path, lineage=lineage)
+
+    logger.info(f"Incremental update of {model_name} with {len(X_train)} rows: "
+                f"{n_before} -> {count_estimators(model)} estimators, "
+                f"held-out F1 {previous_metrics['f1_score']:.4f} -> {metrics['f1_score']:.4f} "
+                f"in {entry['seconds']:.1f} s")
+    return {
+        'model': model,
+        'lineage_entry': entry,
+        'metrics': metrics,
+        'previous_metrics': previous_metrics,
+        'onnx_export': onnx_report,
+        'float32_validation': float32_report
+    }
+
+if __name__ == "__main__":
+    # Update the saved model with the labeled rows of a CSV file
+    import sys
+    incremental_training_pipeline(pd.read_csv(sys.argv[1]))
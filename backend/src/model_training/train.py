@@ -4,17 +4,19 @@ Model training utilities for heart disease prediction
 import pandas as pd
 import numpy as np
 import pickle
+import json
 import os
 import logging
 from datetime import datetime
-from typing import Dict, Tuple, Any
+from typing import Dict, Tuple, Any, List
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.svm import SVC
 from sklearn.neural_network import MLPClassifier
 from xgboost import XGBClassifier
-from sklearn.model_selection import GridSearchCV, cross_val_score
+from sklearn.base import clone
+from sklearn.model_selection import GridSearchCV, cross_val_score, cross_val_predict
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -23,6 +25,9 @@ import seaborn as sns
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# History of full and incremental trainings of the saved model
+LINEAGE_FILE = 'lineage.json'
+
 def train_all_models(X_train: pd.DataFrame, y_train: pd.Series) -> Dict[str, Any]:
     """
     Train multiple models for heart disease prediction
@@ -53,11 +58,12 @@ def train_all_models(X_train: pd.DataFrame, y_train: pd.Series) -> Dict[str, Any
     for name, model in models.items():
         try:
             logger.info(f"Training {name}...")
-            model.fit(X_train, y_train)
+            # Fitted on arrays, like the rows the predictor passes at serving time
+            model.fit(X_train.to_numpy(), y_train)
             trained_models[name] = model
             
             # Cross-validation scores
-            cv_scores = cross_val_score(model, X_train, y_train, cv=5, scoring='accuracy')
+            cv_scores = cross_val_score(model, X_train.to_numpy(), y_train, cv=5, scoring='accuracy')
             model_performance[name] = {
                 'cv_mean': cv_scores.mean(),
                 'cv_std': cv_scores.std()
@@ -156,7 +162,7 @@ def hyperparameter_tuning(X_train: pd.DataFrame, y_train: pd.Series,
         verbose=1
     )
     
-    grid_search.fit(X_train, y_train)
+    grid_search.fit(X_train.to_numpy(), y_train)
     
     logger.info(f"Best parameters for {model_name}: {grid_search.best_params_}")
     logger.info(f"Best cross-validation score: {grid_search.best_score_:.4f}")
@@ -186,8 +192,8 @@ def evaluate_models(models: Dict[str, Any], X_test: pd.DataFrame, y_test: pd.Ser
     for name, model in models.items():
         try:
             # Make predictions
-            y_pred = model.predict(X_test)
-            y_pred_proba = model.predict_proba(X_test)[:, 1] if hasattr(model, 'predict_proba') else None
+            y_pred = model.predict(X_test.to_numpy())
+            y_pred_proba = model.predict_proba(X_test.to_numpy())[:, 1] if hasattr(model, 'predict_proba') else None
             
             # Calculate metrics
             metrics = {
@@ -210,7 +216,26 @@ def evaluate_models(models: Dict[str, Any], X_test: pd.DataFrame, y_test: pd.Ser
     
     return evaluation_results
 
-def save_best_model(model: Any, scaler: Any, feature_names: list, model_path: str = None):
+def _save_optional_artifact(artifact: Any, model_path: str, filename: str):
+    """
+    Pickle an optional model artifact, removing any stale copy when it is None
+    
+    Args:
+        artifact (Any): Object to save, or None
+        model_path (str): Model directory
+        filename (str): Artifact file name
+    """
+    artifact_file = os.path.join(model_path, filename)
+    if artifact is not None:
+        with open(artifact_file, 'wb') as f:
+            pickle.dump(artifact, f)
+    elif os.path.exists(artifact_file):
+        # Don't leave an artifact from a previous run next to a model trained without it
+        os.remove(artifact_file)
+
+def save_best_model(model: Any, scaler: Any, feature_names: list, model_path: str = None,
+                    feature_transformer: Any = None, categorical_encoder: Any = None,
+                    percentile_index: Any = None, drift_reference: Any = None):
     """
     Save the best model, scaler, and feature names
     
@@ -219,6 +244,10 @@ def save_best_model(model: Any, scaler: Any, feature_names: list, model_path: st
         scaler (Any): Fitted scaler
         feature_names (list): List of feature names
         model_path (str): Path to save the model files
+        feature_transformer (Any): Fitted feature transformer applied before encoding (optional)
+        categorical_encoder (Any): Fitted categorical encoder applied before scaling (optional)
+        percentile_index (Any): Reference risk distribution for percentile queries (optional)
+        drift_reference (Any): Training distribution of the raw inputs for drift monitoring (optional)
     """
     if model_path is None:
         model_path = os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'trained_models')
@@ -241,10 +270,127 @@ def save_best_model(model: Any, scaler: Any, feature_names: list, model_path: st
     with open(feature_file, 'wb') as f:
         pickle.dump(feature_names, f)
     
+    # Save preprocessing steps applied before scaling
+    _save_optional_artifact(feature_transformer, model_path, 'feature_transformer.pkl')
+    _save_optional_artifact(categorical_encoder, model_path, 'categorical_encoder.pkl')
+    
+    # Save population percentile index
+    _save_optional_artifact(percentile_index, model_path, 'percentile_index.pkl')
+    
+    # Save the reference distribution live inputs are compared against
+    _save_optional_artifact(drift_reference, model_path, 'drift_reference.pkl')
+    
+    # Save forests as flat arrays that serving workers memory-map and share
+    from src.prediction.flat_forest import save_flat_forest
+    save_flat_forest(model, model_path)
+    
     logger.info(f"Model, scaler, and feature names saved to {model_path}")
 
+def save_candidate_models(candidates: Dict[str, Any], scaler: Any, feature_names: list, X: pd.DataFrame,
+                          y: pd.Series, raw_df: pd.DataFrame, model_path: str = None, **artifacts):
+    """
+    Save every candidate model as a complete bundle that can be served next to the best model
+    
+    Args:
+        candidates (Dict[str, Any]): Trained models by candidate name
+        scaler (Any): Fitted scaler
+        feature_names (list): List of feature names
+        X (pd.DataFrame): Preprocessed features of the reference population (for percentiles)
+        y (pd.Series): Target of the reference population
+        raw_df (pd.DataFrame): Unprocessed data with 'age' and 'sex', indexed like X
+        model_path (str): Model directory; bundles go to its 'candidates' subdirectory
+        **artifacts: Preprocessing steps and drift reference passed to save_best_model
+    """
+    from src.prediction.registry import CANDIDATES_DIR
+    
+    if model_path is None:
+        model_path = os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'trained_models')
+    
+    for name, model in candidates.items():
+        save_best_model(model, scaler, feature_names, model_path=os.path.join(model_path, CANDIDATES_DIR, name),
+                        percentile_index=build_percentile_index(model, X, y, raw_df), **artifacts)
+    logger.info(f"Saved {len(candidates)} candidate models: {sorted(candidates)}")
+
+def build_percentile_index(model: Any, X: pd.DataFrame, y: pd.Series, raw_df: pd.DataFrame, cv: int = 5):
+    """
+    Build the population percentile index from out-of-sample reference probabilities
+    
+    Each patient's probability comes from a copy of the model fitted on the other
+    cross-validation folds, so the reference distribution is not sharpened by the
+    model having seen the patient, as live patients are scored.
+    
+    Args:
+        model (Any): Trained model (its unfitted configuration is refitted per fold)
+        X (pd.DataFrame): Preprocessed features of the reference population
+        y (pd.Series): Target of the reference population
+        raw_df (pd.DataFrame): Unprocessed data with 'age' and 'sex', indexed like X
+        cv (int): Number of cross-validation folds
+        
+    Returns:
+        PercentileIndex: Fitted percentile index
+    """
+    from src.prediction.percentiles import PercentileIndex
+    
+    probabilities = cross_val_predict(clone(model), X.to_numpy(), y, cv=cv, method='predict_proba')[:, 1]
+    raw = raw_df.loc[X.index]
+    return PercentileIndex().fit(probabilities, raw['age'].to_numpy(), raw['sex'].to_numpy())
+
+def count_estimators(model: Any) -> int:
+    """Get the number of trees or boosting rounds of an ensemble (None for other models)"""
+    if hasattr(model, 'estimators_'):
+        return len(model.estimators_)
+    if hasattr(model, 'get_booster'):
+        return model.get_booster().num_boosted_rounds()
+    return None
+
+def lineage_entry(model: Any, model_path: str, mode: str, rows: int, rows_seen: int,
+                  metrics: Dict[str, float], parent: str = None, **details) -> Dict[str, Any]:
+    """
+    Describe a saved model for the lineage
+    
+    Args:
+        model (Any): Trained model, already saved to model_path
+        model_path (str): Model directory
+        mode (str): 'full' or 'incremental'
+        rows (int): Training rows used by this training
+        rows_seen (int): Training rows the model and scaler have seen in total
+        metrics (Dict[str, float]): Performance metrics on the held-out rows
+        parent (str): Version of the model this one was trained from
+        **details: Further fields recorded with the entry
+        
+    Returns:
+        Dict[str, Any]: Lineage entry
+    """
+    from src.prediction.predictor import HeartDiseasePredictor
+    
+    return dict({
+        'version': HeartDiseasePredictor._file_version(os.path.join(model_path, 'best_model.pkl')),
+        'parent': parent,
+        'mode': mode,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'model_type': type(model).__name__,
+        'estimators': count_estimators(model),
+        'rows': int(rows),
+        'rows_seen': int(rows_seen),
+        'metrics': {name: float(value) for name, value in metrics.items() if name != 'confusion_matrix'}
+    }, **details)
+
+def load_lineage(model_path: str) -> List[Dict[str, Any]]:
+    """Get the lineage of the saved model, oldest training first"""
+    lineage_file = os.path.join(model_path, LINEAGE_FILE)
+    if not os.path.exists(lineage_file):
+        return []
+    with open(lineage_file) as f:
+        return json.load(f)
+
+def save_lineage(model_path: str, lineage: List[Dict[str, Any]]):
+    """Write the lineage of the saved model"""
+    with open(os.path.join(model_path, LINEAGE_FILE), 'w') as f:
+        json.dump(lineage, f, indent=2)
+
 def create_model_card(model_name: str, metrics: Dict[str, float], 
-                     best_params: Dict = None, save_path: str = None) -> str:
+                     best_params: Dict = None, save_path: str = None,
+                     lineage: List[Dict[str, Any]] = None) -> str:
     """
     Create a model card with metadata and performance information
     
@@ -253,6 +399,7 @@ def create_model_card(model_name: str, metrics: Dict[str, float],
         metrics (Dict[str, float]): Performance metrics
         best_params (Dict): Best hyperparameters (optional)
         save_path (str): Path to save the model card
+        lineage (List[Dict[str, Any]]): Full and incremental trainings of the model (optional)
         
     Returns:
         str: Model card content
@@ -281,6 +428,22 @@ def create_model_card(model_name: str, metrics: Dict[str, float],
     else:
         model_card += "Default hyperparameters\n"
     
+    if lineage:
+        model_card += """
+## Lineage
+| Version | Parent | Mode | Date | Rows | Rows Seen | Estimators | F1 Score |
+|---|---|---|---|---|---|---|---|
+"""
+        for entry in lineage:
+            model_card += (f"| {entry['version']} | {entry['parent'] or '-'} | {entry['mode']} | {entry['date']} "
+                           f"| {entry['rows']} | {entry['rows_seen']} | {entry['estimators'] or '-'} "
+                           f"| {entry['metrics'].get('f1_score', 0):.4f} |\n")
+        
+        percentile_index = lineage[-1].get('percentile_index', {})
+        if percentile_index.get('stale'):
+            model_card += (f"\nThe population percentile index was built for version {percentile_index['built_for']} "
+                           "and is stale until the next full training rebuilds it.\n")
+    
     model_card += """
 ## Notes
 This model was trained on the UCI Heart Disease dataset for predicting heart disease risk.
@@ -294,23 +457,36 @@ This model was trained on the UCI Heart Disease dataset for predicting heart dis
     
     return model_card
 
-def main_training_pipeline():
+def main_training_pipeline(engineer_features: bool = True, encode_categoricals: bool = True):
     """
     Main training pipeline that executes the complete model training process
+    
+    Args:
+        engineer_features (bool): Whether to train on the engineered features produced by
+            HeartFeatureTransformer, which is then saved with the model for serving
+        encode_categoricals (bool): Whether to one-hot encode the categorical features with
+            CategoricalEncoder, which is then saved with the model for serving
     """
     logger.info("Starting main training pipeline")
     
     try:
         # Import data loading functions
         from src.data_processing.load_data import load_processed_data
-        from src.data_processing.preprocess import preprocess_pipeline
-        from src.data_processing.feature_engineering import get_feature_names
+        from src.data_processing.preprocess import preprocess_pipeline, handle_missing_values, CategoricalEncoder
+        from src.data_processing.feature_engineering import HeartFeatureTransformer
+        from src.prediction.drift import DriftReference
+        from src.prediction.onnx_export import export_onnx_model
+        from src.prediction.precision import validate_float32
         
         # Load data
         train_df, test_df = load_processed_data()
         
         # Preprocess data
-        X_train, X_test, y_train, y_test, scaler = preprocess_pipeline(train_df)
+        feature_transformer = HeartFeatureTransformer() if engineer_features else None
+        categorical_encoder = CategoricalEncoder() if encode_categoricals else None
+        X_train, X_test, y_train, y_test, scaler = preprocess_pipeline(
+            train_df, feature_transformer=feature_transformer, encoder=categorical_encoder
+        )
         
         # Train all models
         training_results = train_all_models(X_train, y_train)
@@ -343,8 +519,8 @@ def main_training_pipeline():
         tuned_evaluation = {}
         for model_name, tuning_result in tuned_models.items():
             tuned_model = tuning_result['model']
-            y_pred = tuned_model.predict(X_test)
-            y_pred_proba = tuned_model.predict_proba(X_test)[:, 1]
+            y_pred = tuned_model.predict(X_test.to_numpy())
+            y_pred_proba = tuned_model.predict_proba(X_test.to_numpy())[:, 1]
             
             tuned_evaluation[model_name] = {
                 'accuracy': accuracy_score(y_test, y_pred),
@@ -370,12 +546,50 @@ def main_training_pipeline():
         else:
             best_params = {}
         
+        # Reference risk distribution per age group and sex, over all labeled patients (out of fold)
+        X_all, y_all = pd.concat([X_train, X_test]), pd.concat([y_train, y_test])
+        percentile_index = build_percentile_index(best_model, X_all, y_all, train_df)
+        
+        # Training distribution of the raw inputs, for drift monitoring of live traffic
+        drift_reference = DriftReference().fit(train_df)
+        
         # Save best model
-        feature_names = get_feature_names()
-        save_best_model(best_model, scaler, feature_names)
+        model_path = os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'trained_models')
+        feature_names = list(X_train.columns)
+        save_best_model(best_model, scaler, feature_names, model_path=model_path,
+                        feature_transformer=feature_transformer, categorical_encoder=categorical_encoder,
+                        percentile_index=percentile_index, drift_reference=drift_reference)
+        
+        # A full training starts a new lineage that incremental trainings extend
+        lineage = [lineage_entry(best_model, model_path, 'full', len(X_train), scaler.n_samples_seen_,
+                                 best_metrics, model_name=best_model_name)]
+        save_lineage(model_path, lineage)
+        
+        # Raw inputs of the test set, in serving order, for checking the alternative inference paths
+        if feature_transformer is not None or categorical_encoder is not None:
+            input_features = list((feature_transformer or categorical_encoder).feature_names_in_)
+            held_out = handle_missing_values(train_df).loc[X_test.index, input_features].to_numpy(dtype=np.float64)
+        else:
+            input_features = feature_names
+            held_out = scaler.inverse_transform(X_test)
+        
+        # Compile the bundle to a portable ONNX graph, checked against the pickled path
+        onnx_report = export_onnx_model(best_model, scaler, input_features, held_out,
+                                        feature_transformer=feature_transformer,
+                                        categorical_encoder=categorical_encoder)
+        
+        # Measure the probability deviation and label flips of float32 inference
+        float32_report = validate_float32(held_out)
+        
+        # Save the baselines and tuned models as candidates for shadow and A/B serving
+        candidates = {name.lower(): model for name, model in models.items()}
+        candidates.update({f'{name.lower()}_tuned': result['model'] for name, result in tuned_models.items()})
+        save_candidate_models(candidates, scaler, feature_names, X_all, y_all, train_df,
+                              feature_transformer=feature_transformer, categorical_encoder=categorical_encoder,
+                              drift_reference=drift_reference)
         
         # Create model card
-        model_card = create_model_card(best_model_name, best_metrics, best_params)
+        model_card = create_model_card(best_model_name, best_metrics, best_params, lineage=lineage)
         logger.info("Model card created")
         logger.info(model_card)
         
@@ -393,7 +607,9 @@ def main_training_pipeline():
             'best_model_name': best_model_name,
             'best_metrics': best_metrics,
             'all_models_performance': evaluation_results,
-            'tuned_models_performance': tuned_evaluation
+            'tuned_models_performance': tuned_evaluation,
+            'onnx_export': onnx_report,
+            'float32_validation': float32_report
         }
         
     except Exception as e:
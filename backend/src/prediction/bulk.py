@@ -0,0 +1,358 @@
+"""
+Offline bulk scoring of large patient files
+
+score_file streams a CSV or Parquet file in chunks and scores them in a pool of
+worker processes, each with the model bundle loaded once. A worker validates its
+chunk against the feature schema, scores the valid rows with one vectorized
+call and returns the chunk already formatted as CSV, so the parent process only
+reads input and appends output. Chunks are written in input order; invalid rows
+keep their place with an error message instead of a probability.
+
+After every written chunk a checkpoint next to the output records how many
+chunks and output bytes are complete. An interrupted run resumes from there:
+the output is truncated to the last complete chunk and the input is skipped up
+to the next one.
+
+Workers load the pickled model rather than the memory-mapped flat forest: a
+short-lived scoring job gains nothing from sharing pages with web workers, and
+scikit-learn's compiled traversal is the fastest path for large chunks.
+"""
+import os
+import json
+import time
+import logging
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.data_processing.load_data import get_feature_descriptions
+from src.prediction.predictor import HeartDiseasePredictor, LOW_RISK_BELOW, HIGH_RISK_FROM
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rows read, validated and scored as one unit of work
+DEFAULT_CHUNK_ROWS = 100_000
+
+# Chunks queued per worker process, bounding the memory held by unwritten chunks
+CHUNKS_PER_PROCESS = 2
+
+# Contributions listed in the explanation column
+DEFAULT_TOP_FEATURES = 3
+
+CHECKPOINT_SUFFIX = '.progress.json'
+
+def risk_levels(probabilities: np.ndarray) -> np.ndarray:
+    """Map positive-class probabilities to 'Low', 'Medium' or 'High' like the API"""
+    return np.select([probabilities < LOW_RISK_BELOW, probabilities < HIGH_RISK_FROM],
+                     ['Low', 'Medium'], 'High').astype(object)
+
+def _schema_checks(input_features: List[str]) -> List[Tuple[str, Any, Any]]:
+    """(feature, allowed values or None, (low, high) or None) for the schema's features"""
+    schema = get_feature_descriptions()
+    checks = []
+    for feature in input_features:
+        info = schema.get(feature, {})
+        values = np.array(sorted(info['values']), dtype=np.float64) if 'values' in info else None
+        bounds = tuple(float(bound) for bound in info['range'].split('-')) if 'range' in info else None
+        checks.append((feature, values, bounds))
+    return checks
+
+def validate_chunk(df: pd.DataFrame, input_features: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Validate a chunk against the feature schema
+
+    Args:
+        df (pd.DataFrame): Chunk with every input feature column
+        input_features (List[str]): Model input columns, in serving order
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: float64 raw features of shape (n_rows, n_features),
+        and the first error of each row (None for valid rows)
+    """
+    n_rows = len(df)
+    raw = np.empty((n_rows, len(input_features)), dtype=np.float64)
+    errors = np.full(n_rows, None, dtype=object)
+
+    for j, (feature, values, bounds) in enumerate(_schema_checks(input_features)):
+        column = pd.to_numeric(df[feature], errors='coerce').to_numpy(dtype=np.float64)
+        raw[:, j] = column
+        problems = [(np.isnan(column), f'Missing or invalid value for field: {feature}')]
+        if values is not None:
+            problems.append((~np.isin(column, values) & ~np.isnan(column),
+                             f'{feature} must be one of {values.astype(int).tolist()}'))
+        if bounds is not None:
+            problems.append(((column < bounds[0]) | (column > bounds[1]),
+                             f'{feature} must be between {bounds[0]:g} and {bounds[1]:g}'))
+        for failed, message in problems:
+            errors[failed & pd.isnull(errors)] = message
+    return raw, errors
+
+def iter_input_chunks(path: str, columns: List[str], chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                      skip_chunks: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    Stream the given columns of a CSV or Parquet file in chunks
+
+    Args:
+        path (str): .csv (optionally compressed) or .parquet file
+        columns (List[str]): Columns to read; all must be present
+        chunk_rows (int): Rows per chunk
+        skip_chunks (int): Leading chunks to skip without scoring them
+
+    Yields:
+        pd.DataFrame: Chunks of at most chunk_rows rows
+
+    Raises:
+        ValueError: If a column is missing or the format is not supported
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Input file not found: {path}")
+
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Reading Parquet files requires pyarrow")
+        parquet = pq.ParquetFile(path)
+        missing = set(columns) - set(parquet.schema_arrow.names)
+        if missing:
+            raise ValueError(f"Missing required columns: {sorted(missing)}")
+        for i, batch in enumerate(parquet.iter_batches(batch_size=chunk_rows, columns=columns)):
+            if i >= skip_chunks:
+                yield batch.to_pandas()
+        return
+
+    if '.csv' not in os.path.basename(path):
+        raise ValueError(f"Unsupported input format: {path} (expected .csv or .parquet)")
+    header = pd.read_csv(path, nrows=0).columns
+    missing = set(columns) - set(header)
+    if missing:
+        raise ValueError(f"Missing required columns: {sorted(missing)}")
+
+    # No dtypes: malformed values must reach validation instead of failing the reader
+    skip_rows = skip_chunks * chunk_rows
+    if skip_rows:
+        # Skip a plain line count (header included) and name the columns from the header
+        reader = pd.read_csv(path, usecols=columns, chunksize=chunk_rows, skiprows=skip_rows + 1,
+                             header=None, names=list(header))
+    else:
+        reader = pd.read_csv(path, usecols=columns, chunksize=chunk_rows)
+    with reader:
+        yield from reader
+
+def count_input_rows(path: str) -> Optional[int]:
+    """Number of rows of a Parquet file from its metadata (None for CSV files)"""
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return None
+
+# Model bundle of a worker process, loaded by _init_worker
+_predictor = None
+
+def _load_predictor(model_path: str, precision: str) -> HeartDiseasePredictor:
+    """Load the bundle for scoring, with the pickled model's compiled tree traversal"""
+    return HeartDiseasePredictor(model_path=model_path, precision=precision, shared_weights=False)
+
+def _init_worker(model_path: str, precision: str):
+    global _predictor
+    _predictor = _load_predictor(model_path, precision)
+    if _predictor.model is None:
+        raise RuntimeError(f"No trained model found in {model_path}")
+
+def _format_explanations(contributions: np.ndarray, feature_names: List[str], top: int) -> List[str]:
+    """Render the largest contributions of each row as 'feature:+0.1234;...'"""
+    names = np.asarray(feature_names, dtype=object)
+    order = np.argsort(-np.abs(contributions), axis=1)[:, :top]
+    values = np.take_along_axis(contributions, order, axis=1)
+    return [';'.join(f'{name}:{value:+.4f}' for name, value in zip(names[row_order], row_values))
+            for row_order, row_values in zip(order, values)]
+
+def score_chunk(df: pd.DataFrame, first_row: int, input_features: List[str], id_column: str = None,
+                explain: bool = False, top_features: int = DEFAULT_TOP_FEATURES,
+                predictor: HeartDiseasePredictor = None) -> Tuple[bytes, int, int]:
+    """
+    Validate and score one chunk and format it as CSV rows
+
+    Args:
+        df (pd.DataFrame): Input chunk
+        first_row (int): Position of the chunk's first row in the input file
+        input_features (List[str]): Model input columns, in serving order
+        id_column (str): Input column copied to the output instead of the row number
+        explain (bool): Add the largest feature contributions of every row
+        top_features (int): Contributions per explanation
+        predictor (HeartDiseasePredictor): Bundle to score with (default: the worker's)
+
+    Returns:
+        Tuple[bytes, int, int]: CSV rows without header, rows and invalid rows in the chunk
+    """
+    predictor = predictor or _predictor
+    raw, errors = validate_chunk(df, input_features)
+    valid = pd.isnull(errors)
+    n_rows = len(df)
+
+    probability = np.full(n_rows, np.nan)
+    prediction = pd.array(np.zeros(n_rows, dtype=np.int64), dtype='Int64')
+    prediction[~valid] = pd.NA
+    explanation = np.full(n_rows, '', dtype=object)
+    if valid.any():
+        probabilities, contributions = predictor._score(raw[valid].astype(predictor.dtype, copy=False),
+                                                        'bulk', explain=explain)
+        probability[valid] = probabilities[:, 1]
+        prediction[valid] = predictor.model.classes_[np.argmax(probabilities, axis=1)]
+        if explain and contributions is not None:
+            explanation[valid] = _format_explanations(contributions, predictor.feature_names, top_features)
+
+    output = {
+        id_column or 'row': df[id_column].to_numpy() if id_column else np.arange(first_row, first_row + n_rows),
+        'probability': probability,
+        'prediction': prediction,
+        'risk_level': np.where(valid, risk_levels(probability), '')
+    }
+    if explain:
+        output['explanation'] = explanation
+    output['error'] = np.where(valid, '', errors)
+    text = pd.DataFrame(output).to_csv(index=False, header=False, float_format='%.6f', lineterminator='\n')
+    return text.encode(), n_rows, int(n_rows - valid.sum())
+
+def _score_task(args: tuple) -> Tuple[bytes, int, int]:
+    return score_chunk(*args)
+
+def output_columns(id_column: str = None, explain: bool = False) -> List[str]:
+    return [id_column or 'row', 'probability', 'prediction', 'risk_level'] + \
+        (['explanation'] if explain else []) + ['error']
+
+def _input_signature(input_path: str, chunk_rows: int, id_column: str, explain: bool,
+                     model_version: str) -> Dict[str, Any]:
+    """Settings a checkpoint is only valid for"""
+    stat = os.stat(input_path)
+    return {
+        'input': os.path.abspath(input_path),
+        'input_bytes': stat.st_size,
+        'input_mtime': stat.st_mtime,
+        'chunk_rows': chunk_rows,
+        'id_column': id_column,
+        'explain': explain,
+        'model_version': model_version
+    }
+
+def _write_checkpoint(path: str, checkpoint: Dict[str, Any]):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def score_file(input_path: str, output_path: str, model_path: str = None, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+               processes: int = None, id_column: str = None, explain: bool = False,
+               top_features: int = DEFAULT_TOP_FEATURES, precision: str = None, resume: bool = True,
+               progress: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
+    """
+    Score every row of a file into a CSV output file
+
+    Args:
+        input_path (str): CSV or Parquet file with the model input columns
+        output_path (str): CSV file to write
+        model_path (str): Trained model directory (default: the trained models directory)
+        chunk_rows (int): Rows per chunk
+        processes (int): Worker processes (default: CPU count)
+        id_column (str): Input column identifying rows in the output (default: row number)
+        explain (bool): Add the largest feature contributions of every row
+        top_features (int): Contributions per explanation
+        precision (str): 'float64' or 'float32' inference (default: INFERENCE_PRECISION)
+        resume (bool): Continue from the checkpoint of an interrupted run with the same settings
+        progress (Callable): Called with the running statistics after every written chunk
+
+    Returns:
+        Dict[str, Any]: Rows scored and invalid in this run, totals, chunks, seconds and rows per second
+
+    Raises:
+        ValueError: If the checkpoint belongs to different input or settings
+    """
+    reference = HeartDiseasePredictor(model_path=model_path, precision='float64')
+    if reference.model is None:
+        raise ValueError("No trained model found")
+    input_features = reference._input_feature_names()
+    columns = input_features + ([id_column] if id_column and id_column not in input_features else [])
+    processes = processes or os.cpu_count() or 1
+
+    checkpoint_path = output_path + CHECKPOINT_SUFFIX
+    signature = _input_signature(input_path, chunk_rows, id_column, explain, reference.model_version)
+    checkpoint = None
+    if resume and os.path.exists(checkpoint_path) and os.path.exists(output_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['signature'] != signature:
+            raise ValueError(f"{checkpoint_path} belongs to another input file, model or settings; "
+                             "remove it or score without resuming")
+        logger.info(f"Resuming after chunk {checkpoint['chunks']} ({checkpoint['rows']:,} rows)")
+    if checkpoint is None:
+        checkpoint = {'signature': signature, 'chunks': 0, 'rows': 0, 'invalid_rows': 0,
+                      'output_bytes': 0, 'complete': False}
+
+    stats = {
+        'input': input_path, 'output': output_path, 'processes': processes,
+        'resumed_from_rows': checkpoint['rows'], 'total_rows': count_input_rows(input_path),
+        'rows': 0, 'invalid_rows': 0
+    }
+    start = time.perf_counter()
+
+    with open(output_path, 'r+b' if checkpoint['output_bytes'] else 'wb') as output:
+        # Drop anything written after the last complete chunk
+        output.truncate(checkpoint['output_bytes'])
+        output.seek(checkpoint['output_bytes'])
+        if not checkpoint['output_bytes']:
+            output.write((','.join(output_columns(id_column, explain)) + '\n').encode())
+
+        def write(result: Tuple[bytes, int, int]):
+            text, n_rows, n_invalid = result
+            output.write(text)
+            output.flush()
+            os.fsync(output.fileno())
+            checkpoint.update(chunks=checkpoint['chunks'] + 1, rows=checkpoint['rows'] + n_rows,
+                              invalid_rows=checkpoint['invalid_rows'] + n_invalid, output_bytes=output.tell())
+            _write_checkpoint(checkpoint_path, checkpoint)
+
+            stats['rows'] += n_rows
+            stats['invalid_rows'] += n_invalid
+            stats['seconds'] = time.perf_counter() - start
+            stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+            stats.update(chunks=checkpoint['chunks'], total_scored=checkpoint['rows'])
+            if progress is not None:
+                progress(dict(stats))
+
+        chunks = iter_input_chunks(input_path, columns, chunk_rows, skip_chunks=checkpoint['chunks'])
+        first_row = checkpoint['rows']
+        if processes == 1:
+            predictor = _load_predictor(reference.model_path, precision)
+            for df in chunks:
+                write(score_chunk(df, first_row, input_features, id_column, explain, top_features, predictor))
+                first_row += len(df)
+        else:
+            # Bounded in-flight queue: results are written in order while later chunks are scored
+            with ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(reference.model_path, precision)) as pool:
+                pending = deque()
+                for df in chunks:
+                    pending.append(pool.submit(_score_task, (df, first_row, input_features, id_column,
+                                                             explain, top_features)))
+                    first_row += len(df)
+                    if len(pending) >= processes * CHUNKS_PER_PROCESS:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+
+    checkpoint['complete'] = True
+    _write_checkpoint(checkpoint_path, checkpoint)
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    stats.update(chunks=checkpoint['chunks'], total_scored=checkpoint['rows'],
+                 total_invalid=checkpoint['invalid_rows'], output_bytes=checkpoint['output_bytes'])
+    logger.info(f"Scored {stats['rows']:,} rows in {stats['seconds']:.1f} s "
+                f"({stats['rows_per_sec']:,.0f} rows/sec, {processes} processes)")
+    return stats
@@ -0,0 +1,255 @@
+"""
+Data drift monitoring of live patient features against the training data
+"""
+import os
+import glob
+import time
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List
+import logging
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Smoothing added to bin proportions so empty bins keep PSI finite
+EPSILON = 1e-4
+
+# Conventional PSI thresholds: below 0.1 stable, up to 0.25 moderate shift, above that significant
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+
+class DriftReference:
+    """
+    Binned distribution of each raw input feature in the training data
+
+    Features with at most ``n_bins`` distinct values (the categorical codes) get one
+    bin per value; continuous features get ``n_bins`` quantile bins. Values outside
+    the training range fall into the first or last bin.
+    """
+
+    def __init__(self, n_bins: int = 10):
+        """
+        Args:
+            n_bins (int): Number of bins for continuous features
+        """
+        self.n_bins = n_bins
+        self.features = []
+        self.edges = {}
+        self.proportions = {}
+        self.count = 0
+
+    def fit(self, df: pd.DataFrame, features: List[str] = None) -> 'DriftReference':
+        """
+        Bin the training distribution of each feature
+
+        Args:
+            df (pd.DataFrame): Raw training data
+            features (List[str]): Features to monitor (default: every column except 'target')
+
+        Returns:
+            DriftReference: The fitted reference
+        """
+        self.features = list(features or [column for column in df.columns if column != 'target'])
+        self.count = len(df)
+
+        for feature in self.features:
+            values = df[feature].to_numpy(dtype=np.float64)
+            unique = np.unique(values)
+            if len(unique) <= self.n_bins:
+                # One bin per observed value, split halfway between neighbours
+                edges = (unique[1:] + unique[:-1]) / 2
+            else:
+                edges = np.unique(np.quantile(values, np.linspace(0, 1, self.n_bins + 1)[1:-1]))
+
+            counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+            self.edges[feature] = edges
+            self.proportions[feature] = counts / counts.sum()
+
+        logger.info(f"Drift reference built for {len(self.features)} features from {self.count} patients")
+        return self
+
+    def update(self, df: pd.DataFrame) -> 'DriftReference':
+        """
+        Add newly labeled training data to the reference, keeping the bin edges
+
+        Args:
+            df (pd.DataFrame): Raw training data with every monitored feature
+
+        Returns:
+            DriftReference: The updated reference
+        """
+        for feature in self.features:
+            edges = self.edges[feature]
+            counts = np.bincount(np.searchsorted(edges, df[feature].to_numpy(dtype=np.float64), side='right'),
+                                 minlength=len(edges) + 1)
+            self.proportions[feature] = (self.proportions[feature] * self.count + counts) / (self.count + len(df))
+        self.count += len(df)
+        return self
+
+class DriftMonitor:
+    """
+    Streaming histograms of live inputs over a sliding time window
+
+    Memory is constant: one (slots x features x bins) count array. The window is
+    split into ``n_slots`` time slots; a slot is cleared when the window moves past
+    it. ``update`` bins a whole micro-batch with one broadcast comparison and one
+    bincount, so scoring requests pay a few microseconds.
+
+    With a ``directory`` (gunicorn), every worker process keeps its array in its own
+    memory-mapped .npy file there, like the metrics files, and ``report`` sums the
+    live slots of all workers' files. Files of exited workers expire with their slots.
+
+    Args:
+        reference (DriftReference): Training distribution to compare against
+        input_features (List[str]): Column order of the raw rows passed to update
+        window_seconds (float): Length of the comparison window
+        n_slots (int): Number of time slots the window is divided into
+        min_count (int): Observations needed before a feature is assessed
+        directory (str): Directory of the per-worker count files (None keeps counts in memory)
+        name (str): Prefix identifying the model's files in the directory
+    """
+
+    def __init__(self, reference: DriftReference, input_features: List[str], window_seconds: float = 3600,
+                 n_slots: int = 12, min_count: int = 100, directory: str = None, name: str = 'model'):
+        self.reference = reference
+        self.features = [feature for feature in reference.features if feature in input_features]
+        self.window_seconds = window_seconds
+        self.n_slots = n_slots
+        self.min_count = min_count
+        self._columns = [input_features.index(feature) for feature in self.features]
+
+        # Edges padded with +inf so every feature has the same number of bins
+        n_bins = max(len(reference.edges[feature]) for feature in self.features) + 1
+        self._edges = np.full((len(self.features), n_bins - 1), np.inf)
+        for i, feature in enumerate(self.features):
+            self._edges[i, :len(reference.edges[feature])] = reference.edges[feature]
+        self._n_bins = n_bins
+        self._offsets = np.arange(len(self.features)) * n_bins
+
+        self._slot_seconds = window_seconds / n_slots
+        self.directory = directory
+        self.name = name
+        # One row per slot: the slot's period id, then its (features x bins) counts
+        self._shape = (n_slots, 1 + len(self.features) * n_bins)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f'drift_{self.name}_{pid}.npy')
+
+    def _bind(self):
+        """Create the count table of the current process (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            table = np.lib.format.open_memmap(self._path(os.getpid()), mode='w+', dtype=np.int64,
+                                              shape=self._shape)
+        else:
+            table = np.zeros(self._shape, dtype=np.int64)
+        table[:, 0] = -1
+        self._slot_ids = table[:, 0]
+        self._counts = table[:, 1:].reshape(self.n_slots, len(self.features), self._n_bins)
+        self._table = table
+        self._pid = os.getpid()
+
+    def _tables(self) -> List[np.ndarray]:
+        """Count tables of every worker (only this process's without a directory)"""
+        if not self.directory:
+            return [self._table] if self._pid == os.getpid() else []
+        tables = []
+        for path in glob.glob(os.path.join(self.directory, f'drift_{self.name}_*.npy')):
+            try:
+                table = np.load(path, mmap_mode='r')
+            except (OSError, ValueError):
+                continue
+            if table.shape == self._shape:
+                tables.append(table)
+        return tables
+
+    def _slot(self, now: float) -> int:
+        """Get the count slot for a time, clearing it if it holds an expired period"""
+        slot_id = int(now // self._slot_seconds)
+        slot = slot_id % self.n_slots
+        if self._slot_ids[slot] != slot_id:
+            self._counts[slot] = 0
+            self._slot_ids[slot] = slot_id
+        return slot
+
+    def update(self, raw: np.ndarray, now: float = None):
+        """
+        Add a micro-batch of raw input rows
+
+        Args:
+            raw (np.ndarray): Raw input features of shape (n_samples, n_input_features)
+            now (float): Unix time of the observations (default: current time)
+        """
+        values = raw[:, self._columns]
+        # Bin index = number of edges at or below the value (searchsorted side='right')
+        bins = (values[:, :, None] >= self._edges[None, :, :]).sum(axis=2)
+        counts = np.bincount((bins + self._offsets).ravel(), minlength=self._shape[1] - 1)
+
+        with self._lock:
+            self._bind()
+            slot = self._slot(time.time() if now is None else now)
+            self._counts[slot] += counts.reshape(len(self.features), self._n_bins)
+
+    def window_counts(self, now: float = None) -> np.ndarray:
+        """Get the (features x bins) counts of the slots inside the current window, over all workers"""
+        now = time.time() if now is None else now
+        current = int(now // self._slot_seconds)
+        counts = np.zeros(self._shape[1] - 1, dtype=np.int64)
+        with self._lock:
+            for table in self._tables():
+                slot_ids = table[:, 0]
+                live = (slot_ids > current - self.n_slots) & (slot_ids <= current)
+                counts += table[live, 1:].sum(axis=0)
+        return counts.reshape(len(self.features), self._n_bins)
+
+    def report(self, now: float = None) -> Dict[str, Any]:
+        """
+        Compare the live window with the training distribution
+
+        PSI is computed on the reference bins; KS is the largest gap between the two
+        cumulative distributions evaluated at the bin edges.
+
+        Args:
+            now (float): Unix time at the end of the window (default: current time)
+
+        Returns:
+            Dict[str, Any]: Per-feature PSI, KS, observation count and status, and the
+            features with significant drift
+        """
+        counts = self.window_counts(now)
+        features = {}
+        for i, feature in enumerate(self.features):
+            n_bins = len(self.reference.edges[feature]) + 1
+            live_counts = counts[i, :n_bins]
+            n = int(live_counts.sum())
+            if n < self.min_count:
+                features[feature] = {'psi': None, 'ks': None, 'count': n, 'status': 'insufficient_data'}
+                continue
+
+            expected = self.reference.proportions[feature]
+            actual = live_counts / n
+            psi = float(np.sum((actual - expected) * np.log((actual + EPSILON) / (expected + EPSILON))))
+            ks = float(np.max(np.abs(np.cumsum(actual) - np.cumsum(expected))))
+            if psi >= PSI_SIGNIFICANT:
+                status = 'significant'
+            elif psi >= PSI_MODERATE:
+                status = 'moderate'
+            else:
+                status = 'stable'
+            features[feature] = {'psi': psi, 'ks': ks, 'count': n, 'status': status}
+
+        return {
+            'window_seconds': self.window_seconds,
+            'observations': int(counts[0].sum()) if len(self.features) else 0,
+            'reference_size': self.reference.count,
+            'drifted_features': [feature for feature, result in features.items()
+                                 if result['status'] == 'significant'],
+            'features': features
+        }
@@ -0,0 +1,295 @@
+"""
+Flattened tree ensembles stored as memory-mapped NumPy arrays
+
+A pickled RandomForestClassifier is unpickled separately by every gunicorn
+worker, so its node arrays are resident once per worker. FlatForest stores the
+nodes of all trees in a few flat .npy files that workers open with
+``mmap_mode='r'``: the pages live in the OS page cache once and every worker maps
+the same physical memory, so extra workers add almost no resident memory.
+The explanation tables of the path-decomposition explainer are stored the same way.
+
+The arrays are written when a model is saved, or by the gunicorn master before the
+workers start (refresh_flat_forest); workers only ever load them.
+
+Every batch is scored by walking the mapped arrays with NumPy, block by block, so
+no worker ever holds a private copy of the nodes.
+"""
+import os
+import json
+import shutil
+import tempfile
+import logging
+from typing import Any
+
+import numpy as np
+from scipy import sparse
+
+from src.prediction.explainer import tree_path_tables, is_averaged_tree_classifier
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FLAT_FOREST_DIR = 'flat_forest'
+
+# Rows per leaf lookup block, bounding the (rows x trees) arrays of a walk; larger
+# blocks fall out of cache and walk more slowly
+BLOCK_ROWS = 1024
+
+ARRAYS = ('left', 'right', 'feature', 'threshold', 'value', 'roots', 'feature_importances',
+          'leaf_index', 'contrib_data', 'contrib_indices', 'contrib_indptr')
+
+def is_flattenable(model: Any) -> bool:
+    """Check whether a model is a single-output scikit-learn tree or averaging forest classifier"""
+    if not is_averaged_tree_classifier(model):
+        return False
+    trees = [model] if hasattr(model, 'tree_') else list(np.ravel(model.estimators_))
+    return bool(trees) and all(tree.tree_.value.shape[1] == 1 for tree in trees)
+
+class FlatForest:
+    """
+    Read-only tree ensemble evaluated directly on flat node arrays
+
+    Node ``i`` of the concatenated trees splits on ``feature[i]`` at ``threshold[i]``
+    (going to ``left[i]`` when ``x <= threshold``) or is a leaf (``feature[i] < 0``)
+    with class probabilities ``value[i]``. Probabilities are averaged over trees
+    exactly like RandomForestClassifier.predict_proba.
+    """
+
+    def __init__(self, arrays: dict, meta: dict):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.classes_ = np.asarray(meta['classes'])
+        self.n_features_in_ = meta['n_features_in']
+        self.max_depth = meta['max_depth']
+        self.expected_value = meta['expected_value']
+        self.n_estimators = len(self.roots)
+        self.feature_importances_ = self.feature_importances
+        # Plain ndarray views of the same pages: indexing a np.memmap wraps every result in a
+        # new memmap object, which dominates the cost of the many small lookups of a walk
+        self._nodes = tuple(np.asarray(arrays[name]) for name in ('left', 'right', 'feature', 'threshold'))
+        self.leaf_contributions = sparse.csr_matrix(
+            (self.contrib_data, self.contrib_indices, self.contrib_indptr),
+            shape=(meta['n_leaves'], self.n_features_in_), copy=False
+        )
+
+    @classmethod
+    def from_model(cls, model: Any) -> 'FlatForest':
+        """
+        Flatten a fitted scikit-learn tree or forest classifier
+
+        Args:
+            model (Any): Fitted DecisionTreeClassifier or forest of them
+
+        Returns:
+            FlatForest: In-memory flattened model
+        """
+        trees = [model.tree_] if hasattr(model, 'tree_') else [tree.tree_ for tree in np.ravel(model.estimators_)]
+
+        left, right, feature, threshold, value, roots = [], [], [], [], [], []
+        offset = 0
+        for tree_ in trees:
+            tree_left = tree_.children_left.astype(np.int64)
+            tree_right = tree_.children_right.astype(np.int64)
+            is_leaf = tree_left == -1
+            left.append(np.where(is_leaf, -1, tree_left + offset))
+            right.append(np.where(is_leaf, -1, tree_right + offset))
+            feature.append(np.where(is_leaf, -1, tree_.feature).astype(np.int32))
+            threshold.append(tree_.threshold.astype(np.float64))
+
+            tree_value = tree_.value[:, 0, :]
+            value.append(tree_value / tree_value.sum(axis=1, keepdims=True))
+            roots.append(offset)
+            offset += tree_.node_count
+
+        n_features = model.n_features_in_
+        leaf_contributions, leaf_index, _, expected_value = tree_path_tables(trees, n_features)
+        leaf_contributions.sort_indices()
+
+        importances = getattr(model, 'feature_importances_', np.zeros(n_features))
+        arrays = {
+            'left': np.concatenate(left),
+            'right': np.concatenate(right),
+            'feature': np.concatenate(feature),
+            'threshold': np.concatenate(threshold),
+            'value': np.vstack(value),
+            'roots': np.asarray(roots, dtype=np.int64),
+            'feature_importances': np.asarray(importances, dtype=np.float64),
+            'leaf_index': leaf_index,
+            'contrib_data': leaf_contributions.data,
+            'contrib_indices': leaf_contributions.indices,
+            'contrib_indptr': leaf_contributions.indptr
+        }
+        meta = {
+            'classes': np.asarray(model.classes_).tolist(),
+            'n_features_in': int(n_features),
+            'max_depth': int(max(tree_.max_depth for tree_ in trees)),
+            'expected_value': expected_value,
+            'n_leaves': int(leaf_contributions.shape[0])
+        }
+        return cls(arrays, meta)
+
+    def _meta(self) -> dict:
+        return {
+            'classes': self.classes_.tolist(),
+            'n_features_in': self.n_features_in_,
+            'max_depth': self.max_depth,
+            'expected_value': self.expected_value,
+            'n_leaves': int(self.leaf_contributions.shape[0])
+        }
+
+    def save(self, directory: str):
+        """
+        Write the arrays to a directory, replacing it atomically
+
+        Args:
+            directory (str): Target directory
+        """
+        parent = os.path.dirname(os.path.abspath(directory))
+        tmp_dir = tempfile.mkdtemp(prefix='.flat_forest_', dir=parent)
+        try:
+            for name in ARRAYS:
+                np.save(os.path.join(tmp_dir, f'{name}.npy'), np.ascontiguousarray(getattr(self, name)))
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump(self._meta(), f)
+
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+            os.replace(tmp_dir, directory)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'FlatForest':
+        """
+        Open a saved flat forest
+
+        Args:
+            directory (str): Directory written by save
+            mmap (bool): Map the arrays read-only instead of reading them into memory
+
+        Returns:
+            FlatForest: The loaded model
+        """
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None)
+            for name in ARRAYS
+        }
+        return cls(arrays, meta)
+
+    def _block_leaves(self, X: np.ndarray) -> np.ndarray:
+        """Leaf ids of shape (n_rows, n_trees) for a block of float32 rows"""
+        left, right, features, thresholds = self._nodes
+        n_rows, n_features = X.shape
+        n_trees = self.n_estimators
+        block = X.ravel()
+        nodes = np.tile(self.roots, n_rows)
+        row_offset = np.repeat(np.arange(n_rows) * n_features, n_trees)
+
+        # Advance the (row, tree) pairs not yet on a leaf one level at a time
+        active = np.arange(len(nodes))
+        while active.size:
+            current = nodes[active]
+            feature = features[current]
+            internal = feature >= 0
+            active, current, feature = active[internal], current[internal], feature[internal]
+            go_left = block[row_offset[active] + feature] <= thresholds[current]
+            nodes[active] = np.where(go_left, left[current], right[current])
+        return nodes.reshape(n_rows, n_trees)
+
+    def _leaf_blocks(self, X: np.ndarray):
+        """Yield (first row, leaf ids of shape (block_rows, n_trees)) for blocks of rows"""
+        # scikit-learn compares float32 features against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        for start in range(0, len(X), BLOCK_ROWS):
+            yield start, self._block_leaves(X[start:start + BLOCK_ROWS])
+
+    def apply(self, X: np.ndarray) -> np.ndarray:
+        """
+        Find the leaf reached in every tree
+
+        Args:
+            X (np.ndarray): Features of shape (n_samples, n_features)
+
+        Returns:
+            np.ndarray: Global leaf node ids of shape (n_samples, n_trees)
+        """
+        blocks = [leaves for _, leaves in self._leaf_blocks(X)]
+        return np.vstack(blocks) if blocks else np.empty((0, self.n_estimators), dtype=np.int64)
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """
+        Predict class probabilities (mean of the trees' leaf probabilities)
+
+        Args:
+            X (np.ndarray): Features of shape (n_samples, n_features)
+
+        Returns:
+            np.ndarray: Probabilities of shape (n_samples, n_classes)
+        """
+        n_samples = 1 if np.ndim(X) == 1 else len(X)
+        probabilities = np.empty((n_samples, len(self.classes_)), dtype=self.value.dtype)
+        for start, leaves in self._leaf_blocks(X):
+            probabilities[start:start + len(leaves)] = np.asarray(self.value)[leaves].mean(axis=1)
+        return probabilities
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """Predict classes"""
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def save_flat_forest(model: Any, model_path: str) -> bool:
+    """
+    Save the flattened form of a forest next to its pickle, or remove a stale one
+
+    Args:
+        model (Any): Trained model
+        model_path (str): Model directory
+
+    Returns:
+        bool: Whether a flat forest was written
+    """
+    directory = os.path.join(model_path, FLAT_FOREST_DIR)
+    if not is_flattenable(model):
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        return False
+
+    FlatForest.from_model(model).save(directory)
+    logger.info(f"Flat forest arrays saved to {directory}")
+    return True
+
+def is_flat_forest_current(model_path: str) -> bool:
+    """Check whether a model directory has flat arrays at least as new as its pickle"""
+    meta_file = os.path.join(model_path, FLAT_FOREST_DIR, 'meta.json')
+    model_file = os.path.join(model_path, 'best_model.pkl')
+    if not os.path.exists(meta_file):
+        return False
+    return not os.path.exists(model_file) or os.path.getmtime(meta_file) >= os.path.getmtime(model_file)
+
+def refresh_flat_forest(model_path: str) -> bool:
+    """
+    Write the flat arrays of a model directory whose pickle has none or newer ones
+
+    Meant to run once before the workers start (e.g. for a bundle saved before flat
+    forests existed, or a pickle replaced by hand); a worker replacing the directory
+    while others map it would pull it out from under them.
+
+    Args:
+        model_path (str): Model directory
+
+    Returns:
+        bool: Whether a flat forest was written
+    """
+    model_file = os.path.join(model_path, 'best_model.pkl')
+    if not os.path.exists(model_file) or is_flat_forest_current(model_path):
+        return False
+    import pickle
+    with open(model_file, 'rb') as f:
+        model = pickle.load(f)
+    return save_flat_forest(model, model_path)
@@ -0,0 +1,430 @@
+"""
+Portable ONNX export of a model bundle and an onnxruntime serving backend
+
+The pickled bundle needs the exact scikit-learn and XGBoost versions it was
+trained with. export_onnx_model compiles the whole scoring path, i.e. the
+feature transformer, categorical encoder, scaler and classifier, into one ONNX
+graph that maps raw input rows to class probabilities. The graph is only kept
+when its probabilities match the pickled path on held-out rows, and the export
+report records that parity check together with single-row and batch latencies
+of both paths.
+
+The feature transformer and categorical encoder are written as plain ONNX
+operators (comparisons, products and one-hot indicators); the scaler becomes a
+subtraction and division, and the classifier is converted with skl2onnx (and
+onnxmltools for XGBoost). The onnx, skl2onnx and onnxruntime packages are
+optional: without them the export is skipped with a warning and the predictor
+keeps the pickled backend.
+"""
+import os
+import json
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from src.data_processing.feature_engineering import (
+    AGE_BINS, BP_EDGES, CHOL_EDGES, INTERACTIONS
+)
+
+try:
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+except ImportError:  # Optional dependency
+    onnx = None
+
+try:
+    import onnxruntime as ort
+except ImportError:  # Optional dependency
+    ort = None
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ONNX_FILE = 'model.onnx'
+EXPORT_REPORT = 'onnx_export.json'
+
+# Operator sets targeted by the exported graph
+TARGET_OPSET = {'': 17, 'ai.onnx.ml': 3}
+
+# Largest absolute probability difference from the pickled path accepted at export
+PARITY_TOLERANCE = 1e-5
+
+# Batch sizes timed for the export report
+BENCHMARK_BATCH_SIZES = (1, 512)
+
+def onnx_available() -> bool:
+    """Check whether the packages needed to export and run ONNX graphs are installed"""
+    if onnx is None or ort is None:
+        return False
+    try:
+        import skl2onnx  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+class _GraphBuilder:
+    """Nodes and constants of the hand-written preprocessing part of the graph"""
+
+    def __init__(self):
+        self.nodes = []
+        self.initializers = []
+        self._count = 0
+
+    def _name(self, prefix: str) -> str:
+        self._count += 1
+        return f'pre_{prefix}_{self._count}'
+
+    def const(self, values, dtype=np.float64) -> str:
+        name = self._name('const')
+        self.initializers.append(numpy_helper.from_array(np.asarray(values, dtype=dtype), name))
+        return name
+
+    def op(self, op_type: str, *inputs: str, output: str = None, **attributes) -> str:
+        output = output or self._name(op_type.lower())
+        self.nodes.append(helper.make_node(op_type, list(inputs), [output], **attributes))
+        return output
+
+    def columns(self, X: str, indices: List[int]) -> str:
+        """Select columns of a (rows, columns) tensor"""
+        return self.op('Gather', X, self.const(list(indices), np.int64), axis=1)
+
+    def indicators(self, condition: str) -> str:
+        return self.op('Cast', condition, to=TensorProto.DOUBLE)
+
+    def between(self, x: str, lower: List[float], upper: List[float]) -> str:
+        """Indicator column k of lower[k] <= x < upper[k], for a single column x; NaN gives zeros"""
+        return self.indicators(self.op('And', self.op('GreaterOrEqual', x, self.const(lower)),
+                                       self.op('Less', x, self.const(upper))))
+
+    def equal(self, x: str, values: np.ndarray) -> str:
+        """Indicator column k of x == values[k], for a single column x"""
+        return self.indicators(self.op('Equal', x, self.const(values)))
+
+def _risk_score_graph(g: _GraphBuilder, column: Dict[str, str]) -> str:
+    """Mirror _compute_risk_score term by term so the score is bit-identical"""
+    score = g.op('Mul', column['age'], g.const([0.2 / 100]))
+    score = g.op('Add', score, g.op('Mul', column['sex'], g.const([0.1])))
+    for col, shift, factor in (('trestbps', 90, 0.2 / 110), ('chol', 100, 0.2 / 500)):
+        score = g.op('Add', score, g.op('Mul', g.op('Sub', column[col], g.const([shift])), g.const([factor])))
+    term = g.op('Mul', g.op('Sub', column['thalach'], g.const([60])), g.const([-0.3 / 160]))
+    return g.op('Add', score, g.op('Add', term, g.const([0.3])))
+
+def _feature_transformer_graph(g: _GraphBuilder, X: str, transformer: Any) -> str:
+    """Append the engineered features like HeartFeatureTransformer.transform"""
+    column = {col: g.columns(X, [index]) for col, index in transformer.column_index_.items()}
+    outputs = [X, g.between(column['age'], AGE_BINS[:-1], AGE_BINS[1:])]
+    for col, edges in (('trestbps', BP_EDGES), ('chol', CHOL_EDGES)):
+        outputs.append(g.between(column[col], [-np.inf] + edges, edges + [np.inf]))
+    outputs.append(_risk_score_graph(g, column))
+    outputs.extend(g.op('Mul', column[col1], column[col2]) for col1, col2 in INTERACTIONS)
+    return g.op('Concat', *outputs, axis=1)
+
+def _categorical_encoder_graph(g: _GraphBuilder, X: str, encoder: Any) -> str:
+    """Move passthrough columns first and one-hot encode the rest like CategoricalEncoder.transform"""
+    outputs = [g.columns(X, encoder.passthrough_index_)] if encoder.passthrough_index_ else []
+    for index, categories in zip(encoder.encoded_index_, encoder.categories_):
+        kept = categories[1:] if encoder.drop_first else categories
+        outputs.append(g.equal(g.columns(X, [index]), kept))
+    return g.op('Concat', *outputs, axis=1)
+
+def _scaler_graph(g: _GraphBuilder, X: str, scaler: Any) -> str:
+    """Standardize like StandardScaler.transform"""
+    from sklearn.preprocessing import StandardScaler
+
+    if not isinstance(scaler, StandardScaler):
+        raise ValueError(f"Unsupported scaler for ONNX export: {type(scaler).__name__}")
+    if scaler.mean_ is not None:
+        X = g.op('Sub', X, g.const(scaler.mean_))
+    if scaler.scale_ is not None:
+        X = g.op('Div', X, g.const(scaler.scale_))
+    return X
+
+def _register_xgboost_converter():
+    """Let skl2onnx convert XGBClassifier through onnxmltools, when both are installed"""
+    try:
+        from xgboost import XGBClassifier
+        from onnxmltools.convert.xgboost.operator_converters.XGBoost import convert_xgboost
+        from skl2onnx import update_registered_converter
+        from skl2onnx.common.shape_calculator import calculate_linear_classifier_output_shapes
+    except ImportError:
+        return
+    update_registered_converter(
+        XGBClassifier, 'XGBoostXGBClassifier', calculate_linear_classifier_output_shapes, convert_xgboost,
+        options={'nocl': [True, False], 'zipmap': [True, False, 'columns']}
+    )
+
+def _classifier_graph(model: Any, n_features: int):
+    """
+    Convert the classifier, preferring double-precision inputs
+
+    Tree models get float32 inputs: scikit-learn and XGBoost compare features
+    with split thresholds in float32, and a float64 comparison would send rows
+    close to a threshold down the other branch.
+
+    Returns:
+        Tuple[onnx.ModelProto, bool]: Graph with input 'features' and output
+        'probabilities', and whether its input is float64
+    """
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import DoubleTensorType, FloatTensorType
+
+    _register_xgboost_converter()
+    errors = []
+    trees = any(hasattr(model, attribute) for attribute in ('tree_', 'estimators_', 'get_booster'))
+    for tensor_type in (FloatTensorType,) if trees else (DoubleTensorType, FloatTensorType):
+        try:
+            graph = convert_sklearn(model, initial_types=[('features', tensor_type([None, n_features]))],
+                                    options={id(model): {'zipmap': False}}, target_opset=TARGET_OPSET)
+            ort.InferenceSession(graph.SerializeToString(), providers=['CPUExecutionProvider'])
+            return graph, tensor_type is DoubleTensorType
+        except Exception as e:
+            errors.append(f"{tensor_type.__name__}: {str(e).splitlines()[0]}")
+    raise ValueError(f"Cannot convert {type(model).__name__}: {'; '.join(errors)}")
+
+def build_onnx_graph(model: Any, scaler: Any, input_features: List[str], feature_transformer: Any = None,
+                     categorical_encoder: Any = None, model_version: str = None):
+    """
+    Compile the scoring path of a bundle into one ONNX graph
+
+    Args:
+        model (Any): Trained classifier
+        scaler (Any): Fitted StandardScaler, or None
+        input_features (List[str]): Raw input columns, in the order of the graph input
+        feature_transformer (Any): Fitted HeartFeatureTransformer (optional)
+        categorical_encoder (Any): Fitted CategoricalEncoder (optional)
+        model_version (str): Version of the pickled model, stored in the graph metadata
+
+    Returns:
+        onnx.ModelProto: Graph mapping float64 'raw' rows to float64 'probabilities'
+    """
+    g = _GraphBuilder()
+    X = 'raw'
+    if feature_transformer is not None:
+        X = _feature_transformer_graph(g, X, feature_transformer)
+    if categorical_encoder is not None:
+        X = _categorical_encoder_graph(g, X, categorical_encoder)
+    if scaler is not None:
+        X = _scaler_graph(g, X, scaler)
+
+    classifier, double = _classifier_graph(model, model.n_features_in_)
+    graph = classifier.graph
+    g.op('Identity' if double else 'Cast', X, output='features', **({} if double else {'to': TensorProto.FLOAT}))
+    # Tree ensembles produce float32 probabilities even from float64 inputs
+    probabilities = next(output for output in graph.output if output.name == 'probabilities')
+    if probabilities.type.tensor_type.elem_type != TensorProto.DOUBLE:
+        for node in graph.node:
+            node.output[:] = ['probabilities_float' if name == 'probabilities' else name for name in node.output]
+        graph.node.append(helper.make_node('Cast', ['probabilities_float'], ['probabilities'], to=TensorProto.DOUBLE))
+
+    nodes = g.nodes + list(graph.node)
+    del graph.node[:]
+    graph.node.extend(nodes)
+    graph.initializer.extend(g.initializers)
+    del graph.input[:]
+    graph.input.append(helper.make_tensor_value_info('raw', TensorProto.DOUBLE, [None, len(input_features)]))
+    del graph.output[:]
+    graph.output.append(helper.make_tensor_value_info('probabilities', TensorProto.DOUBLE, [None, len(model.classes_)]))
+
+    for opset in classifier.opset_import:
+        if opset.domain in ('', 'ai.onnx') and opset.version < TARGET_OPSET['']:
+            opset.version = TARGET_OPSET['']
+    helper.set_model_props(classifier, {
+        'model_version': model_version or '',
+        'input_features': json.dumps(list(input_features)),
+        'classes': json.dumps(np.asarray(model.classes_).tolist()),
+        'model_type': type(model).__name__
+    })
+    onnx.checker.check_model(classifier)
+    return classifier
+
+class OnnxModel:
+    """
+    Exported bundle executed with onnxruntime
+
+    predict_proba takes raw input rows: feature engineering, encoding and scaling
+    are part of the graph.
+
+    Args:
+        graph (Union[str, bytes]): Path of the .onnx file, or the serialized graph
+        threads (int): Intra-op threads of the session. Defaults to 1 because the
+            API already scores in parallel across workers and pool processes
+    """
+
+    def __init__(self, graph, threads: int = 1):
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(graph, options, providers=['CPUExecutionProvider'])
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.model_version = metadata.get('model_version') or None
+        self.input_features = json.loads(metadata['input_features'])
+        self.classes_ = np.asarray(json.loads(metadata['classes']))
+        self.model_type = metadata.get('model_type')
+
+    def predict_proba(self, raw: np.ndarray) -> np.ndarray:
+        """
+        Predict class probabilities
+
+        Args:
+            raw (np.ndarray): Raw input features of shape (n_samples, n_input_features)
+
+        Returns:
+            np.ndarray: float64 probabilities of shape (n_samples, n_classes)
+        """
+        return self.session.run(['probabilities'], {'raw': np.ascontiguousarray(raw, dtype=np.float64)})[0]
+
+    def predict(self, raw: np.ndarray) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(raw), axis=1)]
+
+def load_onnx_model(model_path: str, model_version: str = None, threads: int = None) -> Optional[OnnxModel]:
+    """
+    Load the exported graph of a bundle, if it can serve in place of the pickled model
+
+    Args:
+        model_path (str): Model directory
+        model_version (str): Version of the loaded pickled model; a graph exported
+            from another version is ignored
+        threads (int): Intra-op threads (default: ONNX_THREADS or 1)
+
+    Returns:
+        Optional[OnnxModel]: The runtime model, or None with a warning
+    """
+    onnx_file = os.path.join(model_path, ONNX_FILE)
+    if ort is None:
+        logger.warning("onnxruntime is not installed; using the pickled model")
+        return None
+    if not os.path.exists(onnx_file):
+        logger.warning(f"No {ONNX_FILE} in {model_path}; using the pickled model")
+        return None
+
+    compiled = OnnxModel(onnx_file, threads=threads or int(os.environ.get('ONNX_THREADS', 1)))
+    if model_version is not None and compiled.model_version != model_version:
+        logger.warning(f"{ONNX_FILE} was exported from model {compiled.model_version}, not {model_version}; "
+                       "using the pickled model")
+        return None
+    logger.info(f"Model loaded from {ONNX_FILE} (onnxruntime {ort.__version__})")
+    return compiled
+
+def _median_ms(function: Callable, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+def benchmark_backends(pickled: Callable[[np.ndarray], np.ndarray], compiled: OnnxModel, raw: np.ndarray,
+                       batch_sizes=BENCHMARK_BATCH_SIZES, repeats: int = 50) -> Dict[str, Dict[str, float]]:
+    """
+    Time the pickled and ONNX scoring paths on the same rows
+
+    Args:
+        pickled (Callable): Maps raw rows to probabilities through the pickled bundle
+        compiled (OnnxModel): Exported bundle
+        raw (np.ndarray): Raw rows, repeated to fill the larger batch sizes
+        batch_sizes: Number of rows per timed call
+        repeats (int): Timed calls per path and batch size
+
+    Returns:
+        Dict[str, Dict[str, float]]: Per batch size the median milliseconds of each
+        path and the speedup of ONNX over the pickled path
+    """
+    results = {}
+    for n_rows in batch_sizes:
+        batch = np.resize(raw, (n_rows, raw.shape[1]))
+        for function in (pickled, compiled.predict_proba):
+            function(batch)
+        pickle_ms = _median_ms(lambda: pickled(batch), repeats)
+        onnx_ms = _median_ms(lambda: compiled.predict_proba(batch), repeats)
+        results[str(n_rows)] = {'pickle_ms': pickle_ms, 'onnx_ms': onnx_ms, 'speedup': pickle_ms / onnx_ms}
+    return results
+
+def export_onnx_model(model: Any, scaler: Any, input_features: List[str], reference_rows: np.ndarray,
+                      model_path: str = None, feature_transformer: Any = None, categorical_encoder: Any = None,
+                      tolerance: float = PARITY_TOLERANCE) -> Optional[Dict[str, Any]]:
+    """
+    Export a saved bundle to ONNX after checking parity with the pickled path
+
+    The graph is written to model.onnx only when no probability differs by more
+    than ``tolerance`` and no predicted label changes on the reference rows;
+    otherwise any older export is removed. The parity check and the latency
+    benchmark are written to onnx_export.json.
+
+    Args:
+        model (Any): Trained classifier, as saved by save_best_model
+        scaler (Any): Fitted scaler
+        input_features (List[str]): Raw input columns, in serving order
+        reference_rows (np.ndarray): Held-out raw rows for the parity check and benchmark
+        model_path (str): Model directory of the saved bundle
+        feature_transformer (Any): Fitted feature transformer (optional)
+        categorical_encoder (Any): Fitted categorical encoder (optional)
+        tolerance (float): Largest accepted absolute probability difference
+
+    Returns:
+        Optional[Dict[str, Any]]: The export report, or None if the export was skipped
+    """
+    from src.prediction.predictor import HeartDiseasePredictor
+
+    if model_path is None:
+        model_path = os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'trained_models')
+    onnx_file = os.path.join(model_path, ONNX_FILE)
+    report_file = os.path.join(model_path, EXPORT_REPORT)
+    for stale in (onnx_file, report_file):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    if not onnx_available():
+        logger.warning("onnx, skl2onnx or onnxruntime is not installed; skipping ONNX export")
+        return None
+
+    model_version = HeartDiseasePredictor._file_version(os.path.join(model_path, 'best_model.pkl'))
+    try:
+        graph = build_onnx_graph(model, scaler, input_features, feature_transformer=feature_transformer,
+                                 categorical_encoder=categorical_encoder, model_version=model_version)
+    except Exception as e:
+        logger.warning(f"Skipping ONNX export: {str(e)}")
+        return None
+
+    def pickled(raw: np.ndarray) -> np.ndarray:
+        for step in (feature_transformer, categorical_encoder, scaler):
+            if step is not None:
+                raw = step.transform(raw)
+        return model.predict_proba(raw)
+
+    reference_rows = np.asarray(reference_rows, dtype=np.float64)
+    compiled = OnnxModel(graph.SerializeToString())
+    expected = pickled(reference_rows)
+    actual = compiled.predict_proba(reference_rows)
+    difference = np.abs(actual - expected)[:, 1]
+    parity = {
+        'rows': len(reference_rows),
+        'max_abs_difference': float(difference.max()) if len(difference) else 0.0,
+        'mean_abs_difference': float(difference.mean()) if len(difference) else 0.0,
+        'label_flips': int(np.sum(actual.argmax(axis=1) != expected.argmax(axis=1))),
+        'tolerance': tolerance
+    }
+    parity['passed'] = parity['max_abs_difference'] <= tolerance and parity['label_flips'] == 0
+
+    report = {
+        'model_version': model_version,
+        'model_type': type(model).__name__,
+        'exported': parity['passed'],
+        'versions': {'onnx': onnx.__version__, 'onnxruntime': ort.__version__},
+        'parity': parity
+    }
+    if parity['passed']:
+        onnx.save(graph, onnx_file)
+        report['benchmark'] = benchmark_backends(pickled, compiled, reference_rows)
+        logger.info(f"Exported ONNX model to {onnx_file}: max probability difference "
+                    f"{parity['max_abs_difference']:.2e}, latency {report['benchmark']}")
+    else:
+        logger.warning(f"ONNX export failed the parity check and was not saved: {parity}")
+
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
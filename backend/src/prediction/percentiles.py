@@ -0,0 +1,162 @@
+"""
+Population percentile index for predicted heart disease risk
+"""
+import numpy as np
+from typing import Dict, Any, List, Tuple
+import logging
+
+from src.data_processing.feature_engineering import AGE_BINS, AGE_LABELS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SEX_LABELS = {0: 'female', 1: 'male'}
+
+class PercentileIndex:
+    """
+    Reference distribution of predicted probabilities per age group and sex
+    
+    Built once at training time from the model's probabilities on the reference
+    population. Each stratum keeps its sorted probabilities, or an evenly spaced
+    quantile grid of ``max_points`` values for large strata, so a percentile query
+    is a binary search that never touches the training data. Strata with fewer
+    than ``min_count`` patients fall back to the whole population.
+    """
+    
+    def __init__(self, max_points: int = 1001, min_count: int = 20):
+        """
+        Args:
+            max_points (int): Maximum number of values stored per stratum
+            min_count (int): Minimum stratum size used for percentile queries
+        """
+        self.max_points = max_points
+        self.min_count = min_count
+        self.strata = {}
+    
+    @staticmethod
+    def stratum_key(age: float, sex: float) -> Tuple[str, int]:
+        """
+        Get the stratum of a patient
+        
+        Args:
+            age (float): Age in years
+            sex (float): Sex (0 = female, 1 = male)
+            
+        Returns:
+            Tuple[str, int]: Age group label and sex, or None for ages outside the age groups
+        """
+        code = int(np.searchsorted(AGE_BINS, age, side='right')) - 1
+        if not 0 <= code < len(AGE_LABELS):
+            return None
+        return AGE_LABELS[code], int(sex)
+    
+    def _summarize(self, probabilities: np.ndarray) -> Dict[str, Any]:
+        """Store a sorted array, or a quantile grid when the stratum is large"""
+        probabilities = np.sort(probabilities)
+        if len(probabilities) > self.max_points:
+            return {
+                'values': np.quantile(probabilities, np.linspace(0, 1, self.max_points)),
+                'count': len(probabilities),
+                'exact': False
+            }
+        return {'values': probabilities, 'count': len(probabilities), 'exact': True}
+    
+    def fit(self, probabilities: np.ndarray, age: np.ndarray, sex: np.ndarray) -> 'PercentileIndex':
+        """
+        Build the index from reference probabilities
+        
+        Args:
+            probabilities (np.ndarray): Predicted probability of heart disease per patient
+            age (np.ndarray): Age of each patient
+            sex (np.ndarray): Sex of each patient
+            
+        Returns:
+            PercentileIndex: The fitted index
+        """
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        age = np.asarray(age, dtype=np.float64)
+        sex = np.asarray(sex, dtype=np.float64)
+        
+        self.strata = {'all': self._summarize(probabilities)}
+        
+        codes = np.searchsorted(AGE_BINS, age, side='right') - 1
+        for code, label in enumerate(AGE_LABELS):
+            for sex_value in SEX_LABELS:
+                mask = (codes == code) & (sex == sex_value)
+                if mask.any():
+                    self.strata[(label, sex_value)] = self._summarize(probabilities[mask])
+        
+        logger.info(f"Percentile index built over {len(probabilities)} patients in {len(self.strata) - 1} strata")
+        return self
+    
+    def percentile(self, probability: float, age: float = None, sex: float = None) -> Dict[str, Any]:
+        """
+        Find where a probability falls within the patient's reference stratum
+        
+        Args:
+            probability (float): Predicted probability of heart disease
+            age (float): Age in years (optional)
+            sex (float): Sex (optional)
+            
+        Returns:
+            Dict[str, Any]: Percentage of the stratum with a lower predicted probability,
+            the stratum used, its size and a readable description
+        """
+        if age is None or sex is None:
+            age = sex = np.nan
+        return self.percentiles([probability], [age], [sex])[0]
+    
+    def percentiles(self, probabilities: np.ndarray, age: np.ndarray, sex: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Find the percentiles of many patients with one binary search per stratum
+        
+        Args:
+            probabilities (np.ndarray): Predicted probability of heart disease per patient
+            age (np.ndarray): Age of each patient (NaN when unknown)
+            sex (np.ndarray): Sex of each patient (NaN when unknown)
+            
+        Returns:
+            List[Dict[str, Any]]: One percentile result per patient, as returned by percentile
+        """
+        probabilities = np.asarray(probabilities, dtype=np.float64)
+        codes = np.searchsorted(AGE_BINS, np.asarray(age, dtype=np.float64), side='right') - 1
+        sex = np.trunc(np.asarray(sex, dtype=np.float64))
+        
+        keys = ['all']
+        rows_stratum = np.zeros(len(probabilities), dtype=np.int64)
+        for key, stratum in self.strata.items():
+            if key == 'all' or stratum['count'] < self.min_count:
+                continue
+            mask = (codes == AGE_LABELS.index(key[0])) & (sex == key[1])
+            if mask.any():
+                rows_stratum[mask] = len(keys)
+                keys.append(key)
+        
+        fractions = np.empty(len(probabilities))
+        for j, key in enumerate(keys):
+            rows = rows_stratum == j
+            stratum = self.strata[key]
+            values = stratum['values']
+            if stratum['exact']:
+                fractions[rows] = np.searchsorted(values, probabilities[rows], side='left') / len(values)
+            else:
+                fractions[rows] = np.interp(probabilities[rows], values, np.linspace(0, 1, len(values)))
+        
+        groups = [{'age_group': None, 'sex': None} if key == 'all'
+                  else {'age_group': key[0], 'sex': SEX_LABELS.get(key[1])} for key in keys]
+        results = []
+        for j, fraction in zip(rows_stratum.tolist(), fractions.tolist()):
+            percentile = round(fraction * 100, 1)
+            group = groups[j]
+            if j == 0:
+                description = f"higher than {percentile:g}% of patients"
+            else:
+                description = f"higher than {percentile:g}% of patients aged {group['age_group']}, {group['sex']}"
+            results.append({
+                'percentile': percentile,
+                'stratum': dict(group),
+                'reference_size': self.strata[keys[j]]['count'],
+                'description': description
+            })
+        return results
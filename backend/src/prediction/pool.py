@@ -0,0 +1,280 @@
+"""
+Process-pool inference backend
+
+Feature engineering, scaling, model inference and explanations are CPU-bound
+and hold the GIL, so threads in one web worker cannot run them in parallel.
+InferencePool keeps a fixed set of worker processes, each with the model bundle
+loaded once, and hands them raw feature rows through shared memory: the request
+thread writes the rows into a per-worker SharedMemory buffer and sends only a
+small control tuple over a pipe; the worker writes probabilities and
+contributions back into a second buffer. Nothing row-sized is pickled.
+"""
+import os
+import time
+import atexit
+import queue
+import logging
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+from src.services.admission import remaining_time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rows each worker's buffers hold before they are reallocated larger
+DEFAULT_CAPACITY = 1024
+
+# Seconds between attempts to replace a failed worker, doubling up to the maximum
+RESPAWN_DELAY = 1.0
+MAX_RESPAWN_DELAY = 60.0
+
+def _attach(name: str, cache: dict) -> shared_memory.SharedMemory:
+    """Attach to a shared memory block created by the parent, caching the handle"""
+    if name not in cache:
+        for old in cache.values():
+            old.close()
+        cache.clear()
+        # The parent owns the block; keep the resource tracker from unlinking it here
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, 'shared_memory')
+        except Exception:
+            pass
+        cache[name] = block
+    return cache[name]
+
+def _worker_main(model_path: str, connection):
+    """Load the model bundle, then score requests until told to stop"""
+    from src.prediction.predictor import HeartDiseasePredictor
+
+    try:
+        predictor = HeartDiseasePredictor(model_path=model_path)
+        if predictor.model is None:
+            raise RuntimeError(f"No trained model found in {model_path}")
+        n_inputs = len(predictor._input_feature_names())
+        n_classes = len(predictor.model.classes_)
+        n_contributions = len(predictor.feature_names) if predictor.explainer is not None else 0
+        connection.send(('ready', n_inputs, n_classes, n_contributions))
+    except Exception as e:
+        connection.send(('error', str(e)))
+        return
+
+    inputs, outputs = {}, {}
+    width = n_classes + n_contributions
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        n_rows, capacity, in_name, out_name, explain = message
+        try:
+            raw = np.ndarray((capacity, n_inputs), dtype=np.float64, buffer=_attach(in_name, inputs).buf)[:n_rows]
+            out = np.ndarray((capacity, width), dtype=np.float64, buffer=_attach(out_name, outputs).buf)[:n_rows]
+
+            probabilities, contributions = predictor._score(raw, 'pool_worker', explain=explain)
+            out[:, :n_classes] = probabilities
+            if contributions is not None:
+                out[:, n_classes:] = contributions
+            connection.send(('ok', contributions is not None))
+        except Exception as e:
+            connection.send(('error', str(e)))
+
+    for block in list(inputs.values()) + list(outputs.values()):
+        block.close()
+
+class _Worker:
+    """One pool process with its pipe and shared buffers (owned by the parent)"""
+
+    def __init__(self, context, model_path: str, capacity: int, start_timeout: float):
+        self.model_path = model_path
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(model_path, child_connection),
+                                       name='inference-worker', daemon=True)
+        self.process.start()
+        child_connection.close()
+
+        if not self.connection.poll(start_timeout):
+            self.process.terminate()
+            raise RuntimeError("Inference worker did not start in time")
+        status, *info = self.connection.recv()
+        if status != 'ready':
+            self.process.join()
+            raise RuntimeError(f"Inference worker failed to load the model: {info[0]}")
+
+        self.n_inputs, self.n_classes, self.n_contributions = info
+        self.capacity = 0
+        self.input_block = self.output_block = None
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        """(Re)create the shared buffers for at least capacity rows"""
+        self._release_buffers()
+        self.capacity = capacity
+        self.input_block = shared_memory.SharedMemory(create=True, size=capacity * self.n_inputs * 8)
+        width = self.n_classes + self.n_contributions
+        self.output_block = shared_memory.SharedMemory(create=True, size=max(1, capacity * width * 8))
+
+    def _release_buffers(self):
+        for block in (self.input_block, self.output_block):
+            if block is not None:
+                block.close()
+                block.unlink()
+        self.input_block = self.output_block = None
+
+    def score(self, raw: np.ndarray, explain: bool, timeout: float):
+        n_rows = len(raw)
+        if n_rows > self.capacity:
+            self._allocate(max(n_rows, 2 * self.capacity))
+
+        width = self.n_classes + self.n_contributions
+        np.ndarray((self.capacity, self.n_inputs), dtype=np.float64, buffer=self.input_block.buf)[:n_rows] = raw
+        self.connection.send((n_rows, self.capacity, self.input_block.name, self.output_block.name, explain))
+
+        if not self.connection.poll(timeout):
+            raise TimeoutError("Inference worker did not answer in time")
+        status, detail = self.connection.recv()
+        if status != 'ok':
+            raise RuntimeError(f"Inference failed: {detail}")
+
+        out = np.ndarray((self.capacity, width), dtype=np.float64, buffer=self.output_block.buf)[:n_rows]
+        probabilities = out[:, :self.n_classes].copy()
+        contributions = out[:, self.n_classes:].copy() if detail else None
+        return probabilities, contributions
+
+    def close(self):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+        self._release_buffers()
+
+class InferencePool:
+    """
+    Fixed pool of inference processes sharing nothing but NumPy buffers
+
+    Args:
+        model_path (str): Trained model directory loaded by every worker
+        processes (int): Number of worker processes (default: CPU count)
+        capacity (int): Initial rows per worker buffer; grown on demand
+        start_method (str): multiprocessing start method ('spawn' avoids forking a threaded server)
+        timeout (float): Seconds to wait for one scoring request
+    """
+
+    def __init__(self, model_path: str, processes: int = None, capacity: int = DEFAULT_CAPACITY,
+                 start_method: str = 'spawn', timeout: float = 30.0):
+        self.model_path = model_path
+        self.processes = processes or os.cpu_count() or 1
+        self.capacity = capacity
+        self.timeout = timeout
+        self._context = mp.get_context(start_method)
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+        try:
+            for _ in range(self.processes):
+                self._workers.append(self._start_worker())
+        except Exception:
+            self.close()
+            raise
+        for worker in self._workers:
+            self._idle.put(worker)
+
+        atexit.register(self.close)
+        logger.info(f"Inference pool started with {self.processes} processes")
+
+    def _start_worker(self) -> _Worker:
+        return _Worker(self._context, self.model_path, self.capacity, start_timeout=120)
+
+    def score(self, raw: np.ndarray, explain: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score raw feature rows in an idle worker process
+
+        Args:
+            raw (np.ndarray): Raw input features of shape (n_samples, n_input_features)
+            explain (bool): Also compute per-feature contributions
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Class probabilities, and contributions
+            (None when not requested or no explainer is available)
+        """
+        if self._closed:
+            raise RuntimeError("Inference pool is closed")
+
+        raw = np.ascontiguousarray(raw, dtype=np.float64)
+        
+        # Wait for an idle process no longer than the request's remaining deadline
+        remaining = remaining_time()
+        wait = self.timeout if remaining is None else max(0.0, min(self.timeout, remaining))
+        try:
+            worker = self._idle.get(timeout=wait)
+        except queue.Empty:
+            raise TimeoutError("No inference worker became available in time")
+        try:
+            result = worker.score(raw, explain, self.timeout)
+        except (EOFError, OSError, TimeoutError) as e:
+            # The worker died or hung: drop it and replace it in the background
+            logger.error(f"Inference worker failed, replacing it: {str(e)}")
+            self._retire(worker)
+            raise RuntimeError(f"Inference worker failed: {str(e)}")
+        except Exception:
+            self._idle.put(worker)
+            raise
+        self._idle.put(worker)
+        return result
+
+    def _retire(self, worker: _Worker):
+        """Remove a failed worker and start a thread that replaces it"""
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        threading.Thread(target=self._replace, args=(worker,), name='inference-respawn', daemon=True).start()
+
+    def _replace(self, failed: _Worker):
+        """Stop a failed worker, then start a new one, retrying with backoff until the pool closes"""
+        failed.process.terminate()
+        failed.close()
+
+        delay = RESPAWN_DELAY
+        while not self._closed:
+            try:
+                worker = self._start_worker()
+            except Exception as e:
+                logger.error(f"Could not restart inference worker, retrying in {delay:.0f} s: {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RESPAWN_DELAY)
+                continue
+
+            with self._lock:
+                if not self._closed:
+                    self._workers.append(worker)
+                    self._idle.put(worker)
+                    logger.info("Inference worker restarted")
+                    return
+            worker.close()
+            return
+
+    def close(self):
+        """Stop the worker processes and free the shared buffers"""
+        if self._closed:
+            return
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
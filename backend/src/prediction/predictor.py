@@ -5,54 +5,143 @@ import pandas as pd
 import numpy as np
 import pickle
 import os
+import time
+import hashlib
 import logging
-from typing import Dict, List, Any, Union
+import threading
+from datetime import datetime
+from typing import Dict, List, Any, Union, Tuple
 import warnings
 warnings.filterwarnings("ignore")
 
+from src.prediction.explainer import PredictionExplainer
+from src.prediction.drift import DriftMonitor
+from src.prediction.flat_forest import FlatForest, FLAT_FOREST_DIR, is_flattenable, is_flat_forest_current
+from src.services.metrics import timed_stage, PREDICTIONS, MULTIPROC_DIR_ENV
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Occlusion explanations rescore every row once per feature, so larger batches get
+# the global importances instead
+MAX_OCCLUSION_ROWS = 100
+
+# Model bundle served when no model_path is given
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'trained_models')
+
+# Upper bound on the number of variants scored by a single what-if sweep
+MAX_SWEEP_VARIANTS = 10000
+
+# Probabilities below LOW_RISK_BELOW are low risk, from HIGH_RISK_FROM on high risk
+LOW_RISK_BELOW = 0.3
+HIGH_RISK_FROM = 0.7
+
+# Batch sizes scored once after loading, so first requests find every code path warm
+WARMUP_BATCH_SIZES = (1, 32, 512)
+
+# Inclusive value ranges of the synthetic warm-up patients
+WARMUP_RANGES = {
+    'age': (29, 77), 'sex': (0, 1), 'cp': (0, 3), 'trestbps': (94, 200), 'chol': (126, 564),
+    'fbs': (0, 1), 'restecg': (0, 2), 'thalach': (71, 202), 'exang': (0, 1), 'oldpeak': (0, 6),
+    'slope': (0, 2), 'ca': (0, 3), 'thal': (0, 2)
+}
+
 class HeartDiseasePredictor:
     """
     Heart Disease Prediction Service
     """
     
-    def __init__(self, model_path: str = None):
+    # Optional preprocessing steps saved with the model; populated by _load_model_components
+    feature_transformer = None
+    categorical_encoder = None
+    explainer = None
+    percentile_index = None
+    inference_pool = None
+    prediction_log = None
+    drift_monitor = None
+    registry = None
+    model_version = None
+    compiled_model = None
+    dtype = np.float64
+    
+    def __init__(self, model_path: str = None, precision: str = None, shared_weights: bool = None):
         """
         Initialize the predictor with trained model, scaler, and feature configuration
         
         Args:
             model_path (str): Path to the trained model directory
+            precision (str): 'float64', or 'float32' to preprocess and infer in single
+                precision (default: INFERENCE_PRECISION, else float64)
+            shared_weights (bool): Serve forests from the memory-mapped arrays shared by all
+                workers instead of the pickled model (default: SHARED_MODEL_WEIGHTS, else on)
         """
         if model_path is None:
-            model_path = os.path.join(os.path.dirname(__file__), '..', '..', 'models', 'trained_models')
+            model_path = DEFAULT_MODEL_PATH
         
         self.model_path = model_path
         self.model = None
         self.scaler = None
         self.feature_names = None
+        self.feature_transformer = None
+        self.categorical_encoder = None
         self.explainer = None
+        self.percentile_index = None
+        self.inference_pool = None
+        self.prediction_log = None
+        self.drift_monitor = None
+        self.registry = None
+        self.model_version = None
+        self.compiled_model = None
+        self.dtype = np.float64
+        if shared_weights is None:
+            shared_weights = os.environ.get('SHARED_MODEL_WEIGHTS', '1') != '0'
+        self.shared_weights = shared_weights
+        
+        # Warm-up state reported by readiness(): pending, running, complete or failed
+        self.warm_up_status = 'pending'
+        self.warm_up_seconds = {}
+        self.warm_up_error = None
         
         # Load components
+        start = time.perf_counter()
         self._load_model_components()
+        precision = precision or os.environ.get('INFERENCE_PRECISION', 'float64')
+        if precision not in ('float64', 'float32'):
+            raise ValueError(f"Unknown inference precision: {precision}")
+        if precision == 'float32' and self.model is not None:
+            self.use_float32()
+        self.load_seconds = time.perf_counter() - start
+        self.loaded_at = datetime.now().isoformat()
     
     def _load_model_components(self):
         """Load trained model, scaler, and feature names"""
         try:
-            # Load model
+            # Load model, preferring the memory-mapped arrays that all workers share
             model_file = os.path.join(self.model_path, 'best_model.pkl')
-            if os.path.exists(model_file):
+            flat_dir = os.path.join(self.model_path, FLAT_FOREST_DIR)
+            if self.shared_weights and is_flat_forest_current(self.model_path):
+                self.model = FlatForest.load(flat_dir)
+                self.model_version = self._file_version(
+                    model_file if os.path.exists(model_file) else os.path.join(flat_dir, 'meta.json')
+                )
+                logger.info("Model loaded from memory-mapped flat forest arrays")
+            elif os.path.exists(model_file):
                 with open(model_file, 'rb') as f:
                     self.model = pickle.load(f)
+                self.model_version = self._file_version(model_file)
                 logger.info("Model loaded successfully")
+                if self.shared_weights and is_flattenable(self.model):
+                    # Workers never write the arrays; refresh_flat_forest runs before they start
+                    logger.warning(f"Flat forest arrays in {flat_dir} are missing or older than the pickle, "
+                                   "so this worker keeps a private copy of the model")
             else:
                 # Try to find the existing model in the project root
                 root_model = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'best_model_random_forest_(tuned).pkl')
                 if os.path.exists(root_model):
                     with open(root_model, 'rb') as f:
                         self.model = pickle.load(f)
+                    self.model_version = self._file_version(root_model)
                     logger.info("Using existing model from project root")
                 else:
                     logger.warning("No trained model found")
@@ -94,10 +183,273 @@ class HeartDiseasePredictor:
                     ]
                     logger.info("Using default feature names")
             
+            # Load preprocessing steps (only present for models trained with them)
+            self.feature_transformer = self._load_optional_artifact('feature_transformer.pkl')
+            self.categorical_encoder = self._load_optional_artifact('categorical_encoder.pkl')
+            
+            # Load the population percentile index built at training time
+            self.percentile_index = self._load_optional_artifact('percentile_index.pkl')
+            
+            # Track live inputs against the training distribution
+            drift_reference = self._load_optional_artifact('drift_reference.pkl')
+            if drift_reference is not None:
+                self.drift_monitor = DriftMonitor(
+                    drift_reference, self._input_feature_names(),
+                    window_seconds=float(os.environ.get('DRIFT_WINDOW_SECONDS', 3600)),
+                    directory=os.environ.get(MULTIPROC_DIR_ENV), name=self.model_version or 'model'
+                )
+            
+            # Score with the exported ONNX graph instead of the pickled pipeline when asked to
+            if self.model is not None and os.environ.get('MODEL_BACKEND', 'pickle') == 'onnx':
+                from src.prediction.onnx_export import load_onnx_model
+                self.compiled_model = load_onnx_model(self.model_path, self.model_version)
+            
+            # Build the explainer once so per-node expected values are cached for every request
+            if self.model is not None:
+                try:
+                    self.explainer = PredictionExplainer(self.model, self.feature_names)
+                except Exception as e:
+                    logger.warning(f"Per-prediction explanations unavailable: {str(e)}")
+            
         except Exception as e:
             logger.error(f"Error loading model components: {str(e)}")
             raise
     
+    @staticmethod
+    def _file_version(path: str) -> str:
+        """Identify a model by the first 12 hex digits of its file's SHA-256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()[:12]
+    
+    def _load_optional_artifact(self, filename: str) -> Any:
+        """
+        Load an optional pickled artifact from the model directory
+        
+        Args:
+            filename (str): Artifact file name
+            
+        Returns:
+            Any: The loaded artifact, or None if it doesn't exist
+        """
+        artifact_file = os.path.join(self.model_path, filename)
+        if not os.path.exists(artifact_file):
+            return None
+        
+        with open(artifact_file, 'rb') as f:
+            artifact = pickle.load(f)
+        logger.info(f"Loaded {filename}")
+        return artifact
+    
+    def use_float32(self):
+        """
+        Switch preprocessing and inference to float32
+        
+        The scaler parameters are cast once here; raw rows, engineered features
+        and scaled features are float32 from then on. The model is not copied.
+        """
+        from src.prediction.precision import cast_scaler
+        
+        for step in (self.feature_transformer, self.categorical_encoder):
+            if step is not None:
+                step.dtype = np.float32
+        if self.scaler is not None:
+            self.scaler = cast_scaler(self.scaler)
+        self.dtype = np.float32
+        if self.compiled_model is not None:
+            logger.info("The ONNX backend keeps the precision of the exported graph")
+        logger.info(f"float32 inference enabled ({type(self.model).__name__})")
+    
+    def start_inference_pool(self, processes: int = None):
+        """
+        Run inference in a pool of worker processes instead of the calling thread
+        
+        Args:
+            processes (int): Number of worker processes (default: CPU count)
+        """
+        from src.prediction.pool import InferencePool
+        
+        if self.model is None:
+            logger.warning("No model loaded; inference pool not started")
+            return
+        self.inference_pool = InferencePool(self.model_path, processes=processes)
+    
+    def start_prediction_log(self, directory: str, **kwargs):
+        """
+        Record every prediction asynchronously in an append-only log
+        
+        Args:
+            directory (str): Directory for the log files
+            **kwargs: Buffer and rotation settings passed to PredictionLog
+        """
+        from src.services.prediction_log import PredictionLog
+        
+        self.prediction_log = PredictionLog(directory, self._input_feature_names(), **kwargs)
+    
+    def start_model_registry(self, candidates_dir: str = None, weights: Dict[str, float] = None,
+                             shadows: List[str] = None):
+        """
+        Serve candidate bundles next to this one with A/B routing and shadow scoring
+        
+        Args:
+            candidates_dir (str): Directory of candidate bundles (default: 'candidates' in the model directory)
+            weights (Dict[str, float]): Share of requests served by each candidate
+            shadows (List[str]): Candidates scoring every served batch in the background
+        """
+        from src.prediction.registry import ModelRegistry, CANDIDATES_DIR
+        
+        if self.model is None:
+            logger.warning("No model loaded; model registry not started")
+            return
+        registry = ModelRegistry(self)
+        registry.load_candidates(candidates_dir or os.path.join(self.model_path, CANDIDATES_DIR),
+                                 sorted(set(weights or {}) | set(shadows or [])))
+        registry.configure(weights, shadows)
+        self.registry = registry
+        logger.info(f"Model registry started: A/B weights {weights or {}}, shadows {shadows or []}")
+    
+    def _log_predictions(self, raw: np.ndarray, probabilities: np.ndarray, predictions: np.ndarray,
+                         seconds: float):
+        """Feed scored rows to the drift monitor and the prediction log, when present"""
+        if self.drift_monitor is not None:
+            self.drift_monitor.update(raw)
+        if self.prediction_log is not None:
+            self.prediction_log.record(raw, probabilities[:, 1], predictions, seconds * 1000,
+                                       self.model_version)
+    
+    def _warm_up_rows(self, n_rows: int, rng: np.random.Generator) -> np.ndarray:
+        """Draw synthetic raw patients spread over the plausible value ranges"""
+        input_features = self._input_feature_names()
+        raw = np.zeros((n_rows, len(input_features)), dtype=self.dtype)
+        for j, feature in enumerate(input_features):
+            if feature in WARMUP_RANGES:
+                low, high = WARMUP_RANGES[feature]
+                raw[:, j] = rng.integers(low, high + 1, n_rows)
+        return raw
+    
+    def warm_up(self, batch_sizes: Tuple[int, ...] = WARMUP_BATCH_SIZES):
+        """
+        Score synthetic batches once so lazily built state is ready before real traffic
+        
+        This pages in the model weights, runs the explainer and percentile lookups and,
+        with an inference pool, warms every worker process.
+        
+        Args:
+            batch_sizes (Tuple[int, ...]): Number of rows of each warm-up batch
+        """
+        if self.model is None:
+            self.warm_up_status = 'failed'
+            self.warm_up_error = 'No trained model loaded'
+            return
+        
+        self.warm_up_status = 'running'
+        rng = np.random.default_rng(0)
+        repeats = self.inference_pool.processes if self.inference_pool is not None else 1
+        try:
+            for n_rows in batch_sizes:
+                raw = self._warm_up_rows(n_rows, rng)
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    probabilities, _ = self._score(raw, 'warm_up', explain=True)
+                if self.percentile_index is not None:
+                    self.population_percentile(float(probabilities[0, 1]),
+                                               dict(zip(self._input_feature_names(), raw[0])))
+                self.warm_up_seconds[str(n_rows)] = time.perf_counter() - start
+            
+            # Candidate bundles served or shadowed next to this one need warming too
+            if self.registry is not None:
+                for name, bundle in self.registry.bundles.items():
+                    if bundle is not self:
+                        bundle.warm_up(batch_sizes)
+                        if bundle.warm_up_status != 'complete':
+                            raise RuntimeError(f"Candidate {name}: {bundle.warm_up_error}")
+            self.warm_up_status = 'complete'
+            logger.info(f"Model warmed up with batch sizes {list(batch_sizes)}")
+        except Exception as e:
+            self.warm_up_status = 'failed'
+            self.warm_up_error = str(e)
+            logger.error(f"Model warm-up failed: {str(e)}")
+    
+    def start_warm_up(self) -> threading.Thread:
+        """Run warm_up in a background thread so the worker can answer liveness probes meanwhile"""
+        thread = threading.Thread(target=self.warm_up, name='model-warm-up', daemon=True)
+        thread.start()
+        return thread
+    
+    @property
+    def is_ready(self) -> bool:
+        """Whether the model is loaded and warmed up"""
+        return self.model is not None and self.warm_up_status == 'complete'
+    
+    def readiness(self) -> Dict[str, Any]:
+        """
+        Describe whether this predictor can serve traffic
+        
+        Returns:
+            Dict[str, Any]: Readiness flag and reason, the loaded model's version and
+            load time, warm-up progress and which caches are populated
+        """
+        if self.model is None:
+            reason = 'No trained model loaded'
+        elif self.warm_up_status != 'complete':
+            reason = self.warm_up_error or f'Warm-up {self.warm_up_status}'
+        else:
+            reason = None
+        
+        return {
+            'ready': reason is None,
+            'reason': reason,
+            'model': {
+                'version': self.model_version,
+                'type': type(self.model).__name__ if self.model is not None else None,
+                'loaded_at': self.loaded_at,
+                'load_seconds': self.load_seconds,
+                'shared_weights': isinstance(self.model, FlatForest),
+                'backend': 'onnx' if self.compiled_model is not None else 'pickle',
+                'precision': np.dtype(self.dtype).name
+            },
+            'warm_up': {
+                'status': self.warm_up_status,
+                'seconds': dict(self.warm_up_seconds),
+                'error': self.warm_up_error
+            },
+            'caches': {
+                'explainer': self.explainer is not None,
+                'percentile_index': self.percentile_index is not None,
+                'inference_pool': self.inference_pool.processes if self.inference_pool is not None else 0,
+                'warm': self.warm_up_status == 'complete'
+            }
+        }
+    
+    def _input_feature_names(self) -> List[str]:
+        """Get the raw input features, in the order expected by the preprocessing steps"""
+        for step in (self.feature_transformer, self.categorical_encoder):
+            if step is not None:
+                return list(step.feature_names_in_)
+        return self.feature_names
+    
+    def _transform(self, raw: np.ndarray) -> np.ndarray:
+        """
+        Apply the training-time feature transform and scaling to raw input rows
+        
+        Args:
+            raw (np.ndarray): Raw features of shape (n_samples, n_input_features)
+            
+        Returns:
+            np.ndarray: Model-ready feature array
+        """
+        if self.feature_transformer is not None:
+            raw = self.feature_transformer.transform(raw)
+        if self.categorical_encoder is not None:
+            raw = self.categorical_encoder.transform(raw)
+        
+        # Scale features if scaler is available
+        if self.scaler is not None:
+            raw = self.scaler.transform(raw)
+        return raw.astype(self.dtype, copy=False)
+    
     def preprocess_input(self, patient_data: Dict[str, Any]) -> np.ndarray:
         """
         Preprocess input data for prediction
@@ -109,113 +461,301 @@ class HeartDiseasePredictor:
             np.ndarray: Processed feature array
         """
         try:
-            # Create DataFrame from patient data
-            df = pd.DataFrame([patient_data])
-            
-            # Ensure all required features are present
-            for feature in self.feature_names:
-                if feature not in df.columns:
-                    df[feature] = 0  # Default value
-            
-            # Select and order features
-            df = df[self.feature_names]
-            
-            # Scale features if scaler is available
-            if self.scaler is not None:
-                df_scaled = self.scaler.transform(df)
-            else:
-                df_scaled = df.values
+            # Missing features default to 0
+            raw = np.array(
+                [[float(patient_data.get(feature, 0)) for feature in self._input_feature_names()]],
+                dtype=self.dtype
+            )
             
-            return df_scaled
+            return self._transform(raw)
             
         except Exception as e:
             logger.error(f"Error preprocessing input: {str(e)}")
             raise
     
-    def predict(self, patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    def preprocess_batch(self, data_list: List[Dict[str, Any]]) -> Tuple[np.ndarray, List[int], Dict[int, str]]:
+        """
+        Preprocess several patients into a single feature array
+        
+        Args:
+            data_list (List[Dict[str, Any]]): List of patient data dictionaries
+            
+        Returns:
+            Tuple[np.ndarray, List[int], Dict[int, str]]: Processed features for the valid rows,
+            their positions in data_list, and error messages for rows that could not be parsed
+        """
+        raw, valid_rows, errors = self._parse_batch(data_list)
+        return self._transform(raw), valid_rows, errors
+    
+    def _parse_batch(self, data_list: List[Dict[str, Any]]) -> Tuple[np.ndarray, List[int], Dict[int, str]]:
+        """Collect the raw input features of the rows that can be parsed"""
+        input_features = self._input_feature_names()
+        raw = np.empty((len(data_list), len(input_features)), dtype=self.dtype)
+        valid_rows = []
+        errors = {}
+        
+        for i, patient_data in enumerate(data_list):
+            try:
+                raw[len(valid_rows)] = [float(patient_data.get(feature, 0)) for feature in input_features]
+                valid_rows.append(i)
+            except (TypeError, ValueError, AttributeError) as e:
+                errors[i] = str(e)
+        
+        return raw[:len(valid_rows)], valid_rows, errors
+    
+    def _score(self, raw: np.ndarray, operation: str, explain: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Transform raw rows, predict class probabilities and explain them
+        
+        Runs in the inference pool when one was started, otherwise in the calling thread.
+        With the ONNX backend the exported graph maps the raw rows to probabilities.
+        
+        Args:
+            raw (np.ndarray): Raw input features of shape (n_samples, n_input_features)
+            operation (str): Operation name for the stage timings
+            explain (bool): Also compute per-feature contributions (skipped for occlusion
+                explanations of more than MAX_OCCLUSION_ROWS rows)
+            
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Class probabilities, and contributions
+            (None when not requested or no explainer is available)
+        """
+        if self.inference_pool is not None:
+            with timed_stage(operation, 'infer'):
+                return self.inference_pool.score(raw, explain=explain)
+        
+        if self.compiled_model is not None:
+            # The ONNX graph includes the preprocessing; explanations still need the features
+            with timed_stage(operation, 'infer'):
+                probabilities = self.compiled_model.predict_proba(raw)
+            processed_data = None
+        else:
+            with timed_stage(operation, 'preprocess'):
+                processed_data = self._transform(raw)
+            
+            with timed_stage(operation, 'infer'):
+                probabilities = self.model.predict_proba(processed_data)
+        
+        contributions = None
+        if explain and self.explainer is not None and (
+                self.explainer.method != 'occlusion' or len(raw) <= MAX_OCCLUSION_ROWS):
+            if processed_data is None:
+                with timed_stage(operation, 'preprocess'):
+                    processed_data = self._transform(raw)
+            with timed_stage(operation, 'explain'):
+                contributions = self.explainer.explain(processed_data)
+        return probabilities, contributions
+    
+    def _importances_from(self, contributions: np.ndarray, n_rows: int) -> List[Dict[str, float]]:
+        """Turn per-row contributions into feature importance dicts, or use global importances"""
+        if contributions is None:
+            feature_importance = self._global_feature_importance()
+            return [dict(feature_importance) for _ in range(n_rows)]
+        return [dict(zip(self.feature_names, row)) for row in contributions.tolist()]
+    
+    def _explanation_info(self, contributions: np.ndarray) -> Dict[str, Any]:
+        """Describe how feature_importance was computed"""
+        if contributions is None:
+            return {"method": "global"}
+        return {
+            "method": self.explainer.method,
+            "units": self.explainer.units,
+            "expected_value": self.explainer.expected_value
+        }
+    
+    def population_percentile(self, probability: float, patient_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Find where a predicted probability falls within the patient's reference population
+        
+        Args:
+            probability (float): Predicted probability of heart disease
+            patient_data (Dict[str, Any]): Patient data dictionary (uses 'age' and 'sex')
+            
+        Returns:
+            Dict[str, Any]: Percentile result, or None if no percentile index is loaded
+        """
+        if self.percentile_index is None:
+            return None
+        
+        try:
+            age, sex = float(patient_data['age']), float(patient_data['sex'])
+        except (KeyError, TypeError, ValueError):
+            age = sex = None
+        return self.percentile_index.percentile(probability, age, sex)
+    
+    def population_percentiles(self, probabilities: np.ndarray,
+                               data_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Find the population percentiles of many predictions at once
+        
+        Args:
+            probabilities (np.ndarray): Predicted probability of heart disease per patient
+            data_list (List[Dict[str, Any]]): Patient data dictionaries in the same order
+            
+        Returns:
+            List[Dict[str, Any]]: Percentile result per patient, or None if no percentile index is loaded
+        """
+        if self.percentile_index is None:
+            return None
+        
+        age, sex = np.full(len(data_list), np.nan), np.full(len(data_list), np.nan)
+        for i, patient_data in enumerate(data_list):
+            try:
+                age[i], sex[i] = float(patient_data['age']), float(patient_data['sex'])
+            except (KeyError, TypeError, ValueError):
+                age[i] = sex[i] = np.nan
+        return self.percentile_index.percentiles(probabilities, age, sex)
+    
+    def drift_report(self) -> Dict[str, Any]:
+        """
+        Compare recent inputs with the training distribution
+        
+        Returns:
+            Dict[str, Any]: Drift statistics per feature, or None if no drift reference is loaded
+        """
+        if self.drift_monitor is None:
+            return None
+        return self.drift_monitor.report()
+    
+    def models_report(self) -> Dict[str, Any]:
+        """
+        Describe the served models
+        
+        Returns:
+            Dict[str, Any]: Registry report, or this bundle alone when no registry is started
+        """
+        if self.registry is not None:
+            return self.registry.report()
+        return {
+            'primary': 'primary',
+            'models': {'primary': {'version': self.model_version,
+                                   'type': type(self.model).__name__ if self.model is not None else None,
+                                   'role': 'primary', 'weight': 1.0}},
+            'shadow_dropped': 0
+        }
+    
+    def _global_feature_importance(self) -> Dict[str, float]:
+        """Get model feature importances, or mock values if the model has none"""
+        feature_importance = {}
+        if hasattr(self.model, 'feature_importances_'):
+            importances = self.model.feature_importances_
+            for i, feature in enumerate(self.feature_names):
+                feature_importance[feature] = float(importances[i])
+        else:
+            # Mock feature importance for demonstration
+            mock_importance = [
+                0.12, 0.08, 0.15, 0.10, 0.09, 0.05,
+                0.07, 0.13, 0.06, 0.08, 0.04, 0.02, 0.01
+            ]
+            for i, feature in enumerate(self.feature_names):
+                feature_importance[feature] = mock_importance[i] if i < len(mock_importance) else 0.01
+        return feature_importance
+    
+    def _build_result(self, prediction: int, prob_heart_disease: float,
+                      feature_importance: Dict[str, float]) -> Dict[str, Any]:
+        """
+        Build the prediction response for one patient
+        
+        Args:
+            prediction (int): Predicted class
+            prob_heart_disease (float): Probability of the positive class
+            feature_importance (Dict[str, float]): Feature importance to report
+            
+        Returns:
+            Dict[str, Any]: Prediction results
+        """
+        # Calculate risk level
+        if prob_heart_disease < LOW_RISK_BELOW:
+            risk_level = "Low"
+        elif prob_heart_disease < HIGH_RISK_FROM:
+            risk_level = "Medium"
+        else:
+            risk_level = "High"
+        
+        # Format confidence
+        confidence = f"{prob_heart_disease * 100:.1f}%"
+        
+        # Generate recommendations based on risk level
+        recommendations = []
+        if risk_level == "High":
+            recommendations = [
+                "Consult a cardiologist immediately",
+                "Consider stress tests and echocardiograms",
+                "Review lifestyle factors (diet, exercise, smoking)",
+                "Monitor blood pressure and cholesterol regularly"
+            ]
+        elif risk_level == "Medium":
+            recommendations = [
+                "Schedule a checkup with your doctor",
+                "Consider lifestyle modifications",
+                "Monitor symptoms and risk factors",
+                "Regular exercise and healthy diet"
+            ]
+        else:
+            recommendations = [
+                "Maintain healthy lifestyle habits",
+                "Regular checkups as recommended by your doctor",
+                "Continue current exercise regimen",
+                "Monitor risk factors periodically"
+            ]
+        
+        # Create result dictionary
+        return {
+            "prediction": int(prediction),
+            "probability": float(prob_heart_disease),
+            "risk_level": risk_level,
+            "confidence": confidence,
+            "feature_importance": feature_importance,
+            "recommendations": recommendations
+        }
+    
+    def predict(self, patient_data: Dict[str, Any], routing_key: str = None) -> Dict[str, Any]:
         """
         Make heart disease prediction for a single patient
         
         Args:
             patient_data (Dict[str, Any]): Patient data dictionary
+            routing_key (str): Key that always selects the same model when a registry routes traffic
             
         Returns:
             Dict[str, Any]: Prediction results
         """
+        if self.registry is not None:
+            return self.registry.predict(patient_data, routing_key)
+        return self._predict_patient(patient_data)
+    
+    def _predict_patient(self, patient_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Make a prediction for a single patient with this bundle"""
         try:
-            # Preprocess input
-            processed_data = self.preprocess_input(patient_data)
+            # Missing features default to 0
+            raw = np.array(
+                [[float(patient_data.get(feature, 0)) for feature in self._input_feature_names()]],
+                dtype=self.dtype
+            )
             
-            # Make prediction
-            prediction = self.model.predict(processed_data)[0]
-            probability = self.model.predict_proba(processed_data)[0]
+            # Make prediction; the class is derived from the same probabilities that are reported
+            start = time.perf_counter()
+            probabilities, contributions = self._score(raw, 'predict', explain=True)
+            probability = probabilities[0]
+            prediction = self.model.classes_[np.argmax(probability)]
+            self._log_predictions(raw, probabilities, [prediction], time.perf_counter() - start)
             
             # Get probability for positive class (heart disease)
             prob_heart_disease = probability[1]
             
-            # Calculate risk level
-            if prob_heart_disease < 0.3:
-                risk_level = "Low"
-            elif prob_heart_disease < 0.7:
-                risk_level = "Medium"
-            else:
-                risk_level = "High"
-            
-            # Format confidence
-            confidence = f"{prob_heart_disease * 100:.1f}%"
-            
-            # Create feature importance (mock values since we don't have SHAP explainer)
-            feature_importance = {}
-            if hasattr(self.model, 'feature_importances_'):
-                importances = self.model.feature_importances_
-                for i, feature in enumerate(self.feature_names):
-                    feature_importance[feature] = float(importances[i])
-            else:
-                # Mock feature importance for demonstration
-                mock_importance = [
-                    0.12, 0.08, 0.15, 0.10, 0.09, 0.05,
-                    0.07, 0.13, 0.06, 0.08, 0.04, 0.02, 0.01
-                ]
-                for i, feature in enumerate(self.feature_names):
-                    feature_importance[feature] = mock_importance[i] if i < len(mock_importance) else 0.01
-            
-            # Generate recommendations based on risk level
-            recommendations = []
-            if risk_level == "High":
-                recommendations = [
-                    "Consult a cardiologist immediately",
-                    "Consider stress tests and echocardiograms",
-                    "Review lifestyle factors (diet, exercise, smoking)",
-                    "Monitor blood pressure and cholesterol regularly"
-                ]
-            elif risk_level == "Medium":
-                recommendations = [
-                    "Schedule a checkup with your doctor",
-                    "Consider lifestyle modifications",
-                    "Monitor symptoms and risk factors",
-                    "Regular exercise and healthy diet"
-                ]
-            else:
-                recommendations = [
-                    "Maintain healthy lifestyle habits",
-                    "Regular checkups as recommended by your doctor",
-                    "Continue current exercise regimen",
-                    "Monitor risk factors periodically"
-                ]
-            
-            # Create result dictionary
-            result = {
-                "prediction": int(prediction),
-                "probability": float(prob_heart_disease),
-                "risk_level": risk_level,
-                "confidence": confidence,
-                "feature_importance": feature_importance,
-                "recommendations": recommendations
-            }
+            with timed_stage('predict', 'build_result'):
+                feature_importance = self._importances_from(contributions, 1)[0]
+                result = self._build_result(prediction, prob_heart_disease, feature_importance)
+                result["explanation"] = self._explanation_info(contributions)
+                
+                if self.percentile_index is not None:
+                    result["population_percentile"] = self.population_percentile(prob_heart_disease, patient_data)
             
+            PREDICTIONS.labels('predict', 'success').inc()
             return result
             
         except Exception as e:
+            PREDICTIONS.labels('predict', 'error').inc()
             logger.error(f"Error making prediction: {str(e)}")
             raise
     
@@ -232,28 +772,137 @@ class HeartDiseasePredictor:
         processed_data = self.preprocess_input(patient_data)
         return self.model.predict_proba(processed_data)[0]
     
-    def batch_predict(self, data_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def batch_predict(self, data_list: List[Dict[str, Any]], routing_key: str = None,
+                      explain: bool = False) -> List[Dict[str, Any]]:
         """
         Make predictions for multiple patients
         
+        All valid rows are preprocessed and scored with a single model call.
+        
         Args:
             data_list (List[Dict[str, Any]]): List of patient data dictionaries
+            routing_key (str): Key that always selects the same model when a registry routes traffic
+            explain (bool): Compute per-patient contributions instead of reporting the
+                global feature importances
             
         Returns:
             List[Dict[str, Any]]: List of prediction results
         """
-        results = []
-        for patient_data in data_list:
-            try:
-                result = self.predict(patient_data)
-                results.append(result)
-            except Exception as e:
-                results.append({
-                    "error": "Prediction failed",
-                    "message": str(e)
-                })
+        if self.registry is not None:
+            return self.registry.batch_predict(data_list, routing_key, explain)
+        return self._batch_predict(data_list, explain)
+    
+    def _batch_predict(self, data_list: List[Dict[str, Any]], explain: bool = False) -> List[Dict[str, Any]]:
+        """Make predictions for multiple patients with this bundle"""
+        results = [None] * len(data_list)
+        
+        try:
+            raw, valid_rows, errors = self._parse_batch(data_list)
+            
+            if valid_rows:
+                start = time.perf_counter()
+                probabilities, contributions = self._score(raw, 'batch_predict', explain=explain)
+                predictions = self.model.classes_[np.argmax(probabilities, axis=1)]
+                self._log_predictions(raw, probabilities, predictions, time.perf_counter() - start)
+                
+                with timed_stage('batch_predict', 'build_result'):
+                    feature_importances = self._importances_from(contributions, len(valid_rows))
+                    explanation = self._explanation_info(contributions)
+                    percentiles = self.population_percentiles(probabilities[:, 1],
+                                                              [data_list[i] for i in valid_rows])
+                    for j, (i, prediction, prob_heart_disease, feature_importance) in enumerate(zip(
+                            valid_rows, predictions, probabilities[:, 1], feature_importances)):
+                        results[i] = self._build_result(prediction, prob_heart_disease, feature_importance)
+                        results[i]["explanation"] = explanation
+                        if percentiles is not None:
+                            results[i]["population_percentile"] = percentiles[j]
+                PREDICTIONS.labels('batch_predict', 'success').inc(len(valid_rows))
+        except Exception as e:
+            logger.error(f"Error making batch prediction: {str(e)}")
+            errors = {i: str(e) for i in range(len(data_list))}
+        
+        if errors:
+            PREDICTIONS.labels('batch_predict', 'error').inc(len(errors))
+        for i, message in errors.items():
+            results[i] = {
+                "error": "Prediction failed",
+                "message": message
+            }
         return results
 
+    def sweep(self, patient_data: Dict[str, Any], sweeps: List[Dict[str, Any]],
+              max_variants: int = MAX_SWEEP_VARIANTS) -> Dict[str, Any]:
+        """
+        Score what-if variants of one patient over a grid of feature values
+        
+        The full perturbation matrix is built in NumPy and scored with a single
+        predict_proba call, together with the unmodified patient.
+        
+        Args:
+            patient_data (Dict[str, Any]): Base patient data dictionary
+            sweeps (List[Dict[str, Any]]): One entry per swept feature, either
+                {"feature": "chol", "start": 150, "stop": 350, "step": 5} (stop inclusive)
+                or {"feature": "cp", "values": [0, 1, 2, 3]}
+            max_variants (int): Maximum number of grid points
+            
+        Returns:
+            Dict[str, Any]: Base probability, the values of each axis, and the probability
+            for every grid point as a nested list indexed in the order of ``sweeps``
+            
+        Raises:
+            ValueError: If a sweep specification is invalid or the grid is too large
+        """
+        input_features = self._input_feature_names()
+        
+        if not sweeps:
+            raise ValueError("At least one feature to sweep is required")
+        
+        features, axes = [], []
+        for spec in sweeps:
+            feature = spec.get('feature')
+            if feature not in input_features:
+                raise ValueError(f"Unknown feature to sweep: {feature}")
+            if feature in features:
+                raise ValueError(f"Feature swept more than once: {feature}")
+            
+            if 'values' in spec:
+                values = np.asarray(spec['values'], dtype=np.float64)
+            else:
+                start, stop, step = (float(spec[key]) for key in ('start', 'stop', 'step'))
+                if step <= 0 or stop < start:
+                    raise ValueError(f"Invalid range for {feature}: start={start}, stop={stop}, step={step}")
+                if (stop - start) / step + 1 > max_variants:
+                    raise ValueError(f"Sweep of {feature} exceeds {max_variants} variants")
+                values = np.arange(start, stop + step / 2, step)
+            
+            if values.ndim != 1 or values.size == 0:
+                raise ValueError(f"No values to sweep for {feature}")
+            features.append(feature)
+            axes.append(values)
+        
+        shape = tuple(len(values) for values in axes)
+        n_variants = int(np.prod(shape))
+        if n_variants > max_variants:
+            raise ValueError(f"Sweep has {n_variants} variants, the maximum is {max_variants}")
+        
+        base = np.array([float(patient_data.get(feature, 0)) for feature in input_features], dtype=self.dtype)
+        
+        # Row 0 is the unmodified patient, followed by every grid point in C order
+        raw = np.tile(base, (n_variants + 1, 1))
+        grid = np.meshgrid(*axes, indexing='ij')
+        for feature, values in zip(features, grid):
+            raw[1:, input_features.index(feature)] = values.ravel()
+        
+        probabilities = self._score(raw, 'sweep', explain=False)[0][:, 1]
+        
+        return {
+            "base_probability": float(probabilities[0]),
+            "features": features,
+            "axes": {feature: values.tolist() for feature, values in zip(features, axes)},
+            "probabilities": probabilities[1:].reshape(shape).tolist(),
+            "n_variants": n_variants
+        }
+
 # For testing the predictor
 if __name__ == "__main__":
     # Example usage
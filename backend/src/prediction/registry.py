@@ -0,0 +1,301 @@
+"""
+Serving several model bundles side by side
+
+A ModelRegistry holds the primary bundle and candidate bundles (directories
+written by the training pipeline). Each request is served by one bundle, chosen
+by weighted A/B routing: a candidate with weight 0.1 serves about 10% of the
+requests, and a routing key (e.g. a patient or session id) always maps to the
+same bundle. Shadow bundles score a copy of every served batch in a background
+thread after the response is built; their probabilities are compared with the
+served ones to measure agreement.
+
+Shadow scoring runs in the serving process and would compete with requests for
+the GIL, so it only runs while no request is being served: it scores in chunks
+of SHADOW_CHUNK_ROWS and waits for the worker to be idle before each chunk. Shadow
+batches that arrive while max_pending_shadow are already waiting are dropped.
+"""
+import os
+import time
+import hashlib
+import random
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Tuple
+
+import numpy as np
+
+from src.services.metrics import MODEL_SECONDS, SHADOW_COMPARISONS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CANDIDATES_DIR = 'candidates'
+
+# Rows a shadow bundle scores between checks for requests being served
+SHADOW_CHUNK_ROWS = 256
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """
+    Parse an A/B weight specification
+
+    Args:
+        spec (str): Comma-separated name=weight pairs, e.g. 'xgboost_tuned=0.1'
+
+    Returns:
+        Dict[str, float]: Share of requests per candidate
+    """
+    weights = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, weight = item.partition('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+class _ModelStats:
+    """Running latency and shadow agreement counts of one bundle"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.compared = 0
+        self.agreed = 0
+        self.abs_difference = 0.0
+
+    def add_latency(self, n_rows: int, seconds: float):
+        with self.lock:
+            self.requests += 1
+            self.rows += n_rows
+            self.seconds += seconds
+
+    def add_comparison(self, agreed: int, compared: int, abs_difference: float):
+        with self.lock:
+            self.agreed += agreed
+            self.compared += compared
+            self.abs_difference += abs_difference
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'rows': self.rows,
+                'mean_latency_ms': self.seconds / self.requests * 1000 if self.requests else None,
+                'compared': self.compared,
+                'agreement': self.agreed / self.compared if self.compared else None,
+                'mean_abs_probability_difference': self.abs_difference / self.compared if self.compared else None
+            }
+
+class ModelRegistry:
+    """
+    Primary and candidate model bundles with A/B routing and shadow scoring
+
+    Args:
+        primary (HeartDiseasePredictor): Bundle serving all traffic not routed to a candidate
+        primary_name (str): Name of the primary bundle
+        max_pending_shadow (int): Shadow batches queued before new ones are dropped
+    """
+
+    def __init__(self, primary, primary_name: str = 'primary', max_pending_shadow: int = 100):
+        self.primary = primary_name
+        self.bundles = {primary_name: primary}
+        self.weights = {}
+        self.shadows = []
+        self.max_pending_shadow = max_pending_shadow
+        self.shadow_dropped = 0
+        self._stats = {primary_name: _ModelStats()}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow-scoring')
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        # Requests being served; shadow scoring waits for none
+        self._in_flight = 0
+        self._idle = threading.Condition()
+
+    def add(self, name: str, predictor):
+        """Register a candidate bundle; it shares the primary's prediction log and drift monitor"""
+        if predictor.model is None:
+            raise ValueError(f"Candidate {name} has no model")
+        primary = self.bundles[self.primary]
+        predictor.prediction_log = primary.prediction_log
+        predictor.drift_monitor = primary.drift_monitor or predictor.drift_monitor
+        self.bundles[name] = predictor
+        self._stats[name] = _ModelStats()
+
+    def load_candidates(self, directory: str, names: List[str] = None):
+        """
+        Load candidate bundles from the subdirectories of a directory
+
+        Args:
+            directory (str): Directory with one model bundle per subdirectory
+            names (List[str]): Candidates to load (default: all)
+        """
+        from src.prediction.predictor import HeartDiseasePredictor
+
+        for name in names if names is not None else sorted(os.listdir(directory)):
+            bundle_dir = os.path.join(directory, name)
+            if not os.path.exists(os.path.join(bundle_dir, 'best_model.pkl')):
+                raise ValueError(f"No candidate model named {name} in {directory}")
+            self.add(name, HeartDiseasePredictor(model_path=bundle_dir))
+
+    def configure(self, weights: Dict[str, float] = None, shadows: List[str] = None):
+        """
+        Set the A/B weights and shadow bundles
+
+        Args:
+            weights (Dict[str, float]): Share of requests served by each candidate
+            shadows (List[str]): Candidates scoring every served batch in the background
+        """
+        weights, shadows = dict(weights or {}), list(shadows or [])
+        for name in list(weights) + shadows:
+            if name not in self.bundles or name == self.primary:
+                raise ValueError(f"Unknown candidate model: {name}")
+        if any(weight < 0 for weight in weights.values()) or sum(weights.values()) > 1:
+            raise ValueError("Candidate weights must be non-negative and sum to at most 1")
+        self.weights, self.shadows = weights, shadows
+
+    def choose(self, routing_key: str = None) -> str:
+        """
+        Pick the bundle serving a request
+
+        Args:
+            routing_key (str): Key mapped to the same bundle on every request (default: random)
+
+        Returns:
+            str: Bundle name
+        """
+        if routing_key is None:
+            point = random.random()
+        else:
+            point = int(hashlib.sha256(routing_key.encode()).hexdigest()[:8], 16) / 0x100000000
+        for name, weight in self.weights.items():
+            if point < weight:
+                return name
+            point -= weight
+        return self.primary
+
+    def _serve(self, name: str, method: str, payload: Any, n_rows: int, *args) -> Any:
+        bundle = self.bundles[name]
+        with self._idle:
+            self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            result = getattr(bundle, method)(payload, *args)
+        finally:
+            with self._idle:
+                self._in_flight -= 1
+                if not self._in_flight:
+                    self._idle.notify_all()
+        seconds = time.perf_counter() - start
+        MODEL_SECONDS.labels(name, 'served').observe(seconds)
+        self._stats[name].add_latency(n_rows, seconds)
+        return result
+
+    def _describe(self, name: str) -> Dict[str, str]:
+        return {'name': name, 'version': self.bundles[name].model_version}
+
+    def predict(self, patient_data: Dict[str, Any], routing_key: str = None) -> Dict[str, Any]:
+        """Score one patient with the routed bundle and queue shadow scoring"""
+        name = self.choose(routing_key)
+        result = self._serve(name, '_predict_patient', patient_data, 1)
+        result['model'] = self._describe(name)
+        self._submit_shadow(name, [patient_data], [(0, result['probability'])])
+        return result
+
+    def batch_predict(self, data_list: List[Dict[str, Any]], routing_key: str = None,
+                      explain: bool = False) -> List[Dict[str, Any]]:
+        """Score a batch with the routed bundle and queue shadow scoring"""
+        name = self.choose(routing_key)
+        results = self._serve(name, '_batch_predict', data_list, len(data_list), explain)
+        model = self._describe(name)
+        served = []
+        for i, result in enumerate(results):
+            if 'probability' in result:
+                result['model'] = model
+                served.append((i, result['probability']))
+        self._submit_shadow(name, data_list, served)
+        return results
+
+    def _submit_shadow(self, served_by: str, data_list: List[Dict[str, Any]], served: List[Tuple[int, float]]):
+        """Queue shadow scoring of the served rows, dropping it when the queue is full"""
+        shadows = [name for name in self.shadows if name != served_by]
+        if not shadows or not served:
+            return
+        with self._pending_lock:
+            if self._pending >= self.max_pending_shadow:
+                self.shadow_dropped += 1
+                return
+            self._pending += 1
+        self._executor.submit(self._run_shadow, shadows, data_list, served)
+
+    def _run_shadow(self, shadows: List[str], data_list: List[Dict[str, Any]], served: List[Tuple[int, float]]):
+        try:
+            rows = [data_list[i] for i, _ in served]
+            served_probabilities = np.array([probability for _, probability in served])
+            for name in shadows:
+                bundle = self.bundles[name]
+                self._wait_until_idle()
+                start = time.perf_counter()
+                raw, valid_rows, _ = bundle._parse_batch(rows)
+                seconds = time.perf_counter() - start
+
+                # Time spent waiting for requests to finish is not counted as scoring time
+                chunks = []
+                for chunk_start in range(0, len(raw), SHADOW_CHUNK_ROWS):
+                    self._wait_until_idle()
+                    start = time.perf_counter()
+                    chunk = raw[chunk_start:chunk_start + SHADOW_CHUNK_ROWS]
+                    chunks.append(bundle._score(chunk, 'shadow', explain=False)[0][:, 1])
+                    seconds += time.perf_counter() - start
+                probabilities = np.concatenate(chunks) if chunks else np.empty(0)
+                MODEL_SECONDS.labels(name, 'shadow').observe(seconds)
+                self._stats[name].add_latency(len(valid_rows), seconds)
+
+                expected = served_probabilities[valid_rows]
+                agreed = int(np.sum((probabilities >= 0.5) == (expected >= 0.5)))
+                self._stats[name].add_comparison(agreed, len(valid_rows), float(np.abs(probabilities - expected).sum()))
+                SHADOW_COMPARISONS.labels(name, 'agree').inc(agreed)
+                SHADOW_COMPARISONS.labels(name, 'disagree').inc(len(valid_rows) - agreed)
+        except Exception as e:
+            logger.error(f"Shadow scoring failed: {str(e)}")
+        finally:
+            with self._pending_lock:
+                self._pending -= 1
+
+    def _wait_until_idle(self):
+        """Block until no request is being served"""
+        with self._idle:
+            self._idle.wait_for(lambda: not self._in_flight)
+
+    def wait_for_shadows(self, timeout: float = 10.0) -> bool:
+        """Wait until queued shadow scoring has finished"""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return not self._pending
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Describe the bundles and their statistics
+
+        Returns:
+            Dict[str, Any]: Per bundle its version, role, A/B weight, served latency and,
+            for shadows, agreement with the served predictions
+        """
+        models = {}
+        for name, bundle in self.bundles.items():
+            if name == self.primary:
+                role = 'primary'
+            elif name in self.shadows:
+                role = 'shadow'
+            elif self.weights.get(name):
+                role = 'ab'
+            else:
+                role = 'idle'
+            models[name] = dict({
+                'version': bundle.model_version,
+                'type': type(bundle.model).__name__,
+                'role': role,
+                'weight': 1 - sum(self.weights.values()) if name == self.primary else self.weights.get(name, 0.0)
+            }, **self._stats[name].summary())
+        return {'primary': self.primary, 'models': models, 'shadow_dropped': self.shadow_dropped}
@@ -0,0 +1,182 @@
+"""
+Admission control and load shedding for the API workers
+
+Each endpoint class (cheap predictions, batch scoring, PDF reports) has its own
+concurrency limit and bounded FIFO queue inside a worker-wide capacity. Slots
+reserved for a class cannot be taken by the others, so a burst of reports never
+starves predictions. A request is turned away immediately instead of queueing
+when its class queue is full (429) or when the expected wait, estimated from
+recent service times, would exceed its deadline (503); a queued request whose
+deadline passes is shed as well. Rejections carry a Retry-After hint.
+
+The deadline of an admitted request is kept in a context variable so downstream
+waits (e.g. for an inference process) can be capped by remaining_time().
+"""
+import math
+import time
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, NamedTuple, Optional
+
+from src.services.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_SHED, ADMISSION_WAIT_SECONDS
+
+# Weight of the latest request in the moving average of service times
+EWMA_ALPHA = 0.2
+
+_deadline = ContextVar('request_deadline', default=None)
+
+class EndpointClass(NamedTuple):
+    """
+    Limits of one class of endpoints
+
+    name: class name used in metrics
+    max_concurrency: requests of the class running at once
+    max_queue: requests of the class waiting at once
+    default_deadline: seconds allowed when the request names no deadline
+    reserved: slots of the worker capacity kept for this class only
+    """
+    name: str
+    max_concurrency: int
+    max_queue: int
+    default_deadline: float
+    reserved: int = 0
+
+class AdmissionRejected(Exception):
+    """
+    Request shed by admission control
+
+    Args:
+        status_code (int): 429 when the queue is full, 503 when the deadline cannot be met
+        reason (str): 'queue_full', 'deadline' or 'deadline_expired'
+        retry_after (int): Seconds the client should wait before retrying
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Ticket(NamedTuple):
+    """Admitted request; pass back to AdmissionController.release"""
+    endpoint_class: str
+    admitted_at: float
+    deadline: float
+
+def remaining_time() -> Optional[float]:
+    """Seconds left until the current request's deadline, or None outside admitted requests"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+class AdmissionController:
+    """
+    Per-worker concurrency limits with bounded queues and deadline-aware shedding
+
+    Args:
+        capacity (int): Requests of all classes running at once
+        classes (Dict[str, EndpointClass]): Limits per class name
+    """
+
+    def __init__(self, capacity: int, classes: Dict[str, EndpointClass]):
+        self.capacity = capacity
+        self.classes = classes
+        self._condition = threading.Condition()
+        self._in_flight = {name: 0 for name in classes}
+        self._queues = {name: deque() for name in classes}
+        self._service_seconds = {name: None for name in classes}
+
+    def _can_start(self, name: str) -> bool:
+        """Check the class limit and the capacity left after other classes' unused reservations"""
+        if self._in_flight[name] >= self.classes[name].max_concurrency:
+            return False
+        held_for_others = sum(max(0, limits.reserved - self._in_flight[other])
+                              for other, limits in self.classes.items() if other != name)
+        return sum(self._in_flight.values()) < self.capacity - held_for_others
+
+    def expected_wait(self, name: str) -> float:
+        """Estimate the queueing time of a new request of a class"""
+        service = self._service_seconds[name]
+        if service is None:
+            return 0.0
+        rounds = math.ceil((len(self._queues[name]) + 1) / self.classes[name].max_concurrency)
+        return rounds * service
+
+    def _retry_after(self, name: str) -> int:
+        return max(1, math.ceil(self.expected_wait(name)))
+
+    def _shed(self, name: str, status_code: int, reason: str):
+        ADMISSION_SHED.labels(name, reason).inc()
+        raise AdmissionRejected(status_code, reason, self._retry_after(name))
+
+    def _admit(self, name: str, deadline: float, queued_at: float) -> Ticket:
+        self._in_flight[name] += 1
+        ADMISSION_IN_FLIGHT.labels(name).inc()
+        now = time.monotonic()
+        ADMISSION_WAIT_SECONDS.labels(name).observe(now - queued_at)
+        _deadline.set(deadline)
+        return Ticket(name, now, deadline)
+
+    def acquire(self, name: str, timeout: float = None) -> Ticket:
+        """
+        Wait for a slot of a class, or reject the request
+
+        Args:
+            name (str): Endpoint class
+            timeout (float): Seconds the client will wait for the response
+                (default: the class's default deadline)
+
+        Returns:
+            Ticket: The admitted request
+
+        Raises:
+            AdmissionRejected: If the request is shed
+        """
+        limits = self.classes[name]
+        now = time.monotonic()
+        deadline = now + (limits.default_deadline if timeout is None else timeout)
+        queue = self._queues[name]
+
+        with self._condition:
+            if not queue and self._can_start(name):
+                return self._admit(name, deadline, now)
+            if len(queue) >= limits.max_queue:
+                self._shed(name, 429, 'queue_full')
+            if now + self.expected_wait(name) > deadline:
+                self._shed(name, 503, 'deadline')
+
+            waiter = object()
+            queue.append(waiter)
+            ADMISSION_QUEUE_DEPTH.labels(name).inc()
+            try:
+                while not (queue[0] is waiter and self._can_start(name)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._shed(name, 503, 'deadline_expired')
+                    self._condition.wait(remaining)
+                return self._admit(name, deadline, now)
+            finally:
+                queue.remove(waiter)
+                ADMISSION_QUEUE_DEPTH.labels(name).dec()
+                # The next waiter of this class may be able to start now
+                self._condition.notify_all()
+
+    def release(self, ticket: Ticket):
+        """Free the slot of an admitted request and record its service time"""
+        seconds = time.monotonic() - ticket.admitted_at
+        with self._condition:
+            name = ticket.endpoint_class
+            self._in_flight[name] -= 1
+            previous = self._service_seconds[name]
+            self._service_seconds[name] = seconds if previous is None else (
+                EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * previous)
+            self._condition.notify_all()
+        ADMISSION_IN_FLIGHT.labels(name).dec()
+        _deadline.set(None)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Running and queued requests and the average service time per class"""
+        with self._condition:
+            return {name: {'in_flight': self._in_flight[name], 'queued': len(self._queues[name]),
+                           'service_seconds': self._service_seconds[name]}
+                    for name in self.classes}
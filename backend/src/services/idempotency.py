@@ -0,0 +1,213 @@
+"""
+Idempotency-Key response store shared by all workers on a host
+
+A client that retries a request with the same ``Idempotency-Key`` gets the stored
+response of the first attempt instead of a new inference. The store is a SQLite
+file in WAL mode so every gunicorn worker sees the same keys:
+
+- The first request for a key claims it (a 'pending' row) and runs the view.
+- Duplicates arriving meanwhile wait for that row to complete, so concurrent
+  retries are coalesced into one inference. Waiters in the same process are woken
+  by an event; waiters in other workers poll the row.
+- Completed rows expire after ``ttl`` seconds, and the least recently used rows
+  are evicted beyond ``max_entries``.
+- A pending row whose owner died is taken over after ``lock_timeout`` seconds.
+"""
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+import logging
+from typing import Callable, Optional, NamedTuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of a key claimed by another worker
+POLL_INTERVAL = 0.01
+
+# Completions between sweeps of expired and excess rows
+EVICT_EVERY = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    state TEXT NOT NULL,
+    status_code INTEGER,
+    content_type TEXT,
+    body BLOB,
+    updated REAL NOT NULL,
+    expires REAL NOT NULL,
+    last_used REAL NOT NULL
+)
+'''
+
+class Claim(NamedTuple):
+    """
+    Outcome of claiming a key
+
+    outcome is 'owner' (run the request and complete or release the key), 'replay'
+    (a stored response is available), 'mismatch' (the key was used for a different
+    request) or 'timeout' (another request still holds the key).
+    """
+    outcome: str
+    status_code: Optional[int] = None
+    content_type: Optional[str] = None
+    body: Optional[bytes] = None
+    waited: bool = False
+
+class IdempotencyStore:
+    """
+    Bounded, TTL-evicting store of responses keyed by idempotency key
+
+    Args:
+        path (str): SQLite database file shared by the workers
+        ttl (float): Seconds a completed response is replayed for
+        max_entries (int): Maximum number of stored responses
+        wait_timeout (float): Seconds a duplicate waits for the original request
+        lock_timeout (float): Seconds after which a pending key is considered abandoned
+    """
+
+    def __init__(self, path: str, ttl: float = 86400, max_entries: int = 100000,
+                 wait_timeout: float = 30.0, lock_timeout: float = 60.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.lock_timeout = lock_timeout
+        self._local = threading.local()
+        self._events = {}
+        self._events_lock = threading.Lock()
+        self._completions = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(SCHEMA)
+
+    @classmethod
+    def from_environment(cls) -> 'IdempotencyStore':
+        """Build the store configured by IDEMPOTENCY_DB and IDEMPOTENCY_TTL_SECONDS"""
+        path = os.environ.get('IDEMPOTENCY_DB') or os.path.join(tempfile.gettempdir(), 'heart_idempotency.sqlite3')
+        return cls(path, ttl=float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 86400)))
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads; keep one per thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _try_claim(self, key: str, fingerprint: str) -> Optional[Claim]:
+        """Claim or read a key in one transaction; None while another request holds it"""
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT fingerprint, state, status_code, content_type, body, updated, expires '
+                'FROM idempotency WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is None or row[6] < now or (row[1] == 'pending' and now - row[5] > self.lock_timeout):
+                connection.execute(
+                    'INSERT OR REPLACE INTO idempotency (key, fingerprint, state, updated, expires, last_used) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', (key, fingerprint, 'pending', now, now + self.ttl, now)
+                )
+                claim = Claim('owner')
+            elif row[0] != fingerprint:
+                claim = Claim('mismatch')
+            elif row[1] == 'done':
+                connection.execute('UPDATE idempotency SET last_used = ? WHERE key = ?', (now, key))
+                claim = Claim('replay', row[2], row[3], bytes(row[4]))
+            else:
+                claim = None
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return claim
+
+    def claim(self, key: str, fingerprint: str, on_wait: Callable[[], None] = None) -> Claim:
+        """
+        Claim a key, or wait for the request that holds it and return its response
+
+        Args:
+            key (str): Idempotency key (scoped by the caller, e.g. to the endpoint)
+            fingerprint (str): Digest of the request; reusing a key for another request is a mismatch
+            on_wait (Callable[[], None]): Called once before the first wait for another request
+
+        Returns:
+            Claim: What the caller should do
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            claim = self._try_claim(key, fingerprint)
+            if claim is not None:
+                if claim.outcome == 'owner':
+                    with self._events_lock:
+                        self._events[key] = threading.Event()
+                return claim._replace(waited=waited)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return Claim('timeout', waited=True)
+            if not waited and on_wait is not None:
+                on_wait()
+            waited = True
+            with self._events_lock:
+                event = self._events.get(key)
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(POLL_INTERVAL, remaining))
+
+    def _wake(self, key: str):
+        with self._events_lock:
+            event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def complete(self, key: str, status_code: int, content_type: str, body: bytes):
+        """Store the response of a claimed key and wake its waiters"""
+        now = time.time()
+        try:
+            self._connection().execute(
+                'UPDATE idempotency SET state = ?, status_code = ?, content_type = ?, body = ?, '
+                'updated = ?, expires = ?, last_used = ? WHERE key = ?',
+                ('done', status_code, content_type, body, now, now + self.ttl, now, key)
+            )
+        finally:
+            self._wake(key)
+
+        self._completions += 1
+        if self._completions % EVICT_EVERY == 0:
+            self.evict()
+
+    def release(self, key: str):
+        """Give up a claimed key without a response, so a retry runs the request again"""
+        try:
+            self._connection().execute("DELETE FROM idempotency WHERE key = ? AND state = 'pending'", (key,))
+        finally:
+            self._wake(key)
+
+    def evict(self):
+        """Delete expired responses and the least recently used ones beyond max_entries"""
+        connection = self._connection()
+        connection.execute('DELETE FROM idempotency WHERE expires < ?', (time.time(),))
+        excess = connection.execute('SELECT COUNT(*) FROM idempotency').fetchone()[0] - self.max_entries
+        if excess > 0:
+            connection.execute(
+                "DELETE FROM idempotency WHERE key IN (SELECT key FROM idempotency WHERE state = 'done' "
+                "ORDER BY last_used LIMIT ?)", (excess,)
+            )
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM idempotency').fetchone()[0]
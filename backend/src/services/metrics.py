@@ -0,0 +1,535 @@
+"""
+In-process metrics registry with Prometheus text exposition
+
+Counters, gauges and fixed-bucket histograms are kept in plain Python lists when
+the API runs as a single process. When METRICS_MULTIPROC_DIR is set (gunicorn),
+every worker writes its values into its own memory-mapped file in that
+directory and /metrics sums the files of all workers, so counters stay correct
+whichever worker serves the scrape. Counter and histogram files of exited
+workers are kept so totals never go backwards; gauge files are removed by
+mark_process_dead.
+"""
+import os
+import json
+import mmap
+import glob
+import time
+import struct
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Tuple, Iterable
+
+from src.services.tracing import current_trace
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MULTIPROC_DIR_ENV = 'METRICS_MULTIPROC_DIR'
+
+# Latency buckets in seconds, from sub-millisecond inference up to slow PDF renders
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_SLOT = struct.Struct('d')
+
+def _format_value(value: float) -> str:
+    """Format a sample value for the text exposition format"""
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value):
+        return f'{int(value)}.0'
+    return repr(float(value))
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    """Format label pairs as {name="value",...}"""
+    labels = list(labels)
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+class _MemoryStore:
+    """Value slots held in a Python list (single process)"""
+
+    def __init__(self):
+        self.keys = {}
+        self.values = []
+
+    def slot(self, key: str) -> int:
+        if key not in self.keys:
+            self.keys[key] = len(self.values)
+            self.values.append(0.0)
+        return self.keys[key]
+
+    def inc(self, slot: int, amount: float):
+        self.values[slot] += amount
+
+    def set(self, slot: int, value: float):
+        self.values[slot] = value
+
+    def snapshot(self) -> Dict[str, float]:
+        return {key: self.values[slot] for key, slot in self.keys.items()}
+
+class _FileStore:
+    """
+    Value slots held in a memory-mapped file of float64 values
+
+    The key of every slot is recorded in a JSON layout file next to the data
+    file, rewritten atomically whenever a new slot is allocated.
+    """
+
+    def __init__(self, path: str, initial_slots: int = 1024):
+        self.path = path
+        self.layout_path = path + '.json'
+        self.keys = {}
+
+        if os.path.exists(self.layout_path):
+            with open(self.layout_path) as f:
+                self.keys = json.load(f)
+
+        self._file = open(path, 'a+b')
+        size = max(os.path.getsize(path), initial_slots * _SLOT.size, (len(self.keys) + 1) * _SLOT.size)
+        self._map(size)
+
+    def _map(self, size: int):
+        """(Re)map the data file, growing it to at least size bytes"""
+        if os.path.getsize(self.path) < size:
+            self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._capacity = size // _SLOT.size
+
+    def slot(self, key: str) -> int:
+        if key not in self.keys:
+            slot = len(self.keys)
+            if slot >= self._capacity:
+                self._mmap.close()
+                self._map(self._capacity * 2 * _SLOT.size)
+            self.keys[key] = slot
+
+            tmp_path = f'{self.layout_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.keys, f)
+            os.replace(tmp_path, self.layout_path)
+        return self.keys[key]
+
+    def inc(self, slot: int, amount: float):
+        offset = slot * _SLOT.size
+        _SLOT.pack_into(self._mmap, offset, _SLOT.unpack_from(self._mmap, offset)[0] + amount)
+
+    def set(self, slot: int, value: float):
+        _SLOT.pack_into(self._mmap, slot * _SLOT.size, value)
+
+    def snapshot(self) -> Dict[str, float]:
+        return {key: _SLOT.unpack_from(self._mmap, slot * _SLOT.size)[0] for key, slot in self.keys.items()}
+
+def _read_file_store(path: str) -> Dict[str, float]:
+    """Read the values of another process's data file"""
+    try:
+        with open(path + '.json') as f:
+            keys = json.load(f)
+        with open(path, 'rb') as f:
+            data = f.read()
+    except (OSError, ValueError):
+        return {}
+
+    return {
+        key: _SLOT.unpack_from(data, slot * _SLOT.size)[0]
+        for key, slot in keys.items() if (slot + 1) * _SLOT.size <= len(data)
+    }
+
+class _Child:
+    """A metric with all label values bound; resolves its value slots per process"""
+
+    def __init__(self, metric: '_Metric', label_values: Tuple[str, ...]):
+        self._metric = metric
+        self._labels = tuple(zip(metric.labelnames, label_values))
+        self._pid = None
+        self._slots = None
+
+    def _bind(self):
+        """Allocate this child's slots in the current process's store"""
+        registry = self._metric.registry
+        store = registry._store(self._metric.kind)
+        self._slots = [store.slot(json.dumps([name, labels])) for name, labels in self._metric._sample_keys(self._labels)]
+        self._store = store
+        self._pid = os.getpid()
+
+class _CounterChild(_Child):
+
+    def inc(self, amount: float = 1.0):
+        """Increment the counter"""
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts")
+        with self._metric.registry._lock:
+            if self._pid != os.getpid():
+                self._bind()
+            self._store.inc(self._slots[0], amount)
+
+class _GaugeChild(_Child):
+
+    def inc(self, amount: float = 1.0):
+        """Increment the gauge"""
+        with self._metric.registry._lock:
+            if self._pid != os.getpid():
+                self._bind()
+            self._store.inc(self._slots[0], amount)
+
+    def dec(self, amount: float = 1.0):
+        """Decrement the gauge"""
+        self.inc(-amount)
+
+    def set(self, value: float):
+        """Set the gauge"""
+        with self._metric.registry._lock:
+            if self._pid != os.getpid():
+                self._bind()
+            self._store.set(self._slots[0], value)
+
+class _HistogramChild(_Child):
+
+    def observe(self, value: float):
+        """Record one observation"""
+        index = bisect.bisect_left(self._metric.buckets, value)
+        with self._metric.registry._lock:
+            if self._pid != os.getpid():
+                self._bind()
+            store, slots = self._store, self._slots
+            store.inc(slots[index], 1.0)
+            store.inc(slots[-2], value)
+            store.inc(slots[-1], 1.0)
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+class _Metric:
+    """Base class for registered metrics"""
+
+    kind = 'counter'
+    type_name = 'untyped'
+    child_class = _Child
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _sample_keys(self, labels):
+        """Sample names and labels of the value slots of one child"""
+        return [(self.name, labels)]
+
+    def labels(self, *values, **kwargs):
+        """
+        Get the child metric for a set of label values
+
+        Returns:
+            The child metric, cached so repeated lookups are cheap
+        """
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self.child_class(self, values))
+        return child
+
+    def render(self, samples: Dict[Tuple[str, tuple], float]) -> list:
+        """Render the aggregated samples of this metric"""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for (name, labels), value in sorted(samples.items()):
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    type_name = 'counter'
+    child_class = _CounterChild
+
+    def inc(self, amount: float = 1.0):
+        """Increment an unlabelled counter"""
+        self.labels().inc(amount)
+
+class Gauge(_Metric):
+    """Value that can go up and down; summed over live processes"""
+
+    kind = 'gauge'
+    type_name = 'gauge'
+    child_class = _GaugeChild
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+class Histogram(_Metric):
+    """Histogram with fixed upper bounds, exposed as cumulative buckets"""
+
+    type_name = 'histogram'
+    child_class = _HistogramChild
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _sample_keys(self, labels):
+        bounds = [_format_value(b) for b in self.buckets] + ['+Inf']
+        return (
+            [(f'{self.name}_bucket', labels + (('le', le),)) for le in bounds]
+            + [(f'{self.name}_sum', labels), (f'{self.name}_count', labels)]
+        )
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render(self, samples):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+        # Buckets are stored per bucket and made cumulative here
+        by_labels = {}
+        for (name, labels), value in samples.items():
+            if name.endswith('_bucket'):
+                base_labels = tuple(pair for pair in labels if pair[0] != 'le')
+                entry = by_labels.setdefault(base_labels, {})
+                entry.setdefault('buckets', {})[dict(labels)['le']] = value
+            else:
+                by_labels.setdefault(labels, {})[name[len(self.name):]] = value
+
+        for labels in sorted(by_labels):
+            entry = by_labels[labels]
+            cumulative = 0.0
+            for le, value in sorted(entry.get('buckets', {}).items(), key=lambda item: float(item[0])):
+                cumulative += value
+                lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", le),))} {_format_value(cumulative)}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(entry.get("_sum", 0.0))}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {_format_value(entry.get("_count", 0.0))}')
+        return lines
+
+class MetricsRegistry:
+    """
+    Registry of metrics for one application
+
+    Args:
+        multiproc_dir (str): Directory shared by all worker processes, or None
+            to keep values in memory
+    """
+
+    def __init__(self, multiproc_dir: str = None):
+        self.multiproc_dir = multiproc_dir
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._stores = {}
+        self._pid = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            existing = self.metrics[metric.name]
+            if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                raise ValueError(f"Metric {metric.name} is already registered differently")
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """Register (or get) a counter"""
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        """Register (or get) a gauge"""
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Register (or get) a histogram"""
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _store(self, kind: str):
+        """Get the value store of the current process (called with the lock held)"""
+        pid = os.getpid()
+        if pid != self._pid:
+            # First use in this process, or first use after a fork
+            self._stores = {}
+            self._pid = pid
+
+        if kind not in self._stores:
+            if self.multiproc_dir:
+                os.makedirs(self.multiproc_dir, exist_ok=True)
+                self._stores[kind] = _FileStore(os.path.join(self.multiproc_dir, f'{kind}_{pid}.db'))
+            else:
+                self._stores[kind] = _MemoryStore()
+        return self._stores[kind]
+
+    def collect(self) -> Dict[Tuple[str, tuple], float]:
+        """
+        Aggregate the values of all processes
+
+        Returns:
+            Dict[Tuple[str, tuple], float]: Value per (sample name, labels)
+        """
+        if self.multiproc_dir:
+            snapshots = [_read_file_store(path[:-len('.json')])
+                         for path in glob.glob(os.path.join(self.multiproc_dir, '*.db.json'))]
+        else:
+            with self._lock:
+                stores = self._stores.values() if self._pid == os.getpid() else []
+                snapshots = [store.snapshot() for store in stores]
+
+        totals = {}
+        for snapshot in snapshots:
+            for key, value in snapshot.items():
+                name, labels = json.loads(key)
+                sample = (name, tuple(tuple(pair) for pair in labels))
+                totals[sample] = totals.get(sample, 0.0) + value
+        return totals
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format
+
+        Returns:
+            str: Exposition text
+        """
+        samples = self.collect()
+
+        lines = []
+        for metric in self.metrics.values():
+            names = {name for name, _ in metric._sample_keys(())}
+            metric_samples = {key: value for key, value in samples.items() if key[0] in names}
+            lines.extend(metric.render(metric_samples))
+        return '\n'.join(lines) + '\n'
+
+def mark_process_dead(pid: int, multiproc_dir: str = None):
+    """
+    Remove the gauge values of an exited worker
+
+    Counter and histogram files are kept so totals never decrease.
+
+    Args:
+        pid (int): Process id of the exited worker
+        multiproc_dir (str): Metrics directory (defaults to METRICS_MULTIPROC_DIR)
+    """
+    multiproc_dir = multiproc_dir or os.environ.get(MULTIPROC_DIR_ENV)
+    if not multiproc_dir:
+        return
+    for path in glob.glob(os.path.join(multiproc_dir, f'gauge_{pid}.db*')):
+        os.remove(path)
+
+def process_memory() -> Dict[str, float]:
+    """
+    Report this process's memory use
+
+    Returns:
+        Dict[str, float]: pid, resident set size, and the part of it that is shared
+        file or shared-memory pages (e.g. memory-mapped model weights), in MB.
+        Only the peak RSS is available where /proc is missing.
+    """
+    memory = {'pid': os.getpid()}
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        kb = {key: float(status[key].split()[0]) for key in ('VmRSS', 'RssFile', 'RssShmem') if key in status}
+        memory['rss_mb'] = round(kb['VmRSS'] / 1024, 1)
+        memory['shared_mb'] = round((kb.get('RssFile', 0.0) + kb.get('RssShmem', 0.0)) / 1024, 1)
+        memory['private_mb'] = round(memory['rss_mb'] - memory['shared_mb'], 1)
+    except (OSError, KeyError, ValueError):
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory['peak_rss_mb'] = round(peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024, 1)
+    return memory
+
+# Registry shared by the API, the predictor and the PDF generator
+REGISTRY = MetricsRegistry(os.environ.get(MULTIPROC_DIR_ENV))
+
+REQUESTS = REGISTRY.counter(
+    'heart_api_requests_total', 'HTTP requests handled', ('method', 'endpoint', 'status')
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    'heart_api_request_duration_seconds', 'HTTP request latency in seconds', ('method', 'endpoint')
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    'heart_stage_duration_seconds', 'Time spent in each stage of an operation in seconds', ('operation', 'stage')
+)
+PREDICTIONS = REGISTRY.counter(
+    'heart_predictions_total', 'Patient records scored', ('operation', 'outcome')
+)
+ADMISSION_IN_FLIGHT = REGISTRY.gauge(
+    'heart_admission_in_flight', 'Admitted requests running per endpoint class', ('endpoint_class',)
+)
+ADMISSION_QUEUE_DEPTH = REGISTRY.gauge(
+    'heart_admission_queue_depth', 'Requests waiting for admission per endpoint class', ('endpoint_class',)
+)
+ADMISSION_SHED = REGISTRY.counter(
+    'heart_admission_shed_total', 'Requests rejected by admission control', ('endpoint_class', 'reason')
+)
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    'heart_admission_wait_seconds', 'Time admitted requests waited for a slot in seconds', ('endpoint_class',)
+)
+MODEL_SECONDS = REGISTRY.histogram(
+    'heart_model_duration_seconds', 'Scoring time per model bundle in seconds', ('model', 'role')
+)
+SHADOW_COMPARISONS = REGISTRY.counter(
+    'heart_shadow_comparisons_total', 'Shadow predictions compared with the served class', ('model', 'outcome')
+)
+IDEMPOTENT_REQUESTS = REGISTRY.counter(
+    'heart_idempotent_requests_total', 'Requests with an Idempotency-Key by outcome', ('endpoint', 'outcome')
+)
+PREDICTION_LOG_RECORDS = REGISTRY.counter(
+    'heart_prediction_log_records_total', 'Prediction log records written or dropped', ('outcome',)
+)
+
+@contextmanager
+def timed_stage(operation: str, stage: str):
+    """
+    Record the duration of one stage of an operation
+
+    The duration goes to the stage histogram and, inside a request, to the
+    request's trace. Its Server-Timing entry, named operation.stage, holds only
+    the time not spent in stages nested in this one, so the entries add up to at
+    most the request's total.
+
+    Args:
+        operation (str): Operation name, e.g. 'predict'
+        stage (str): Stage name, e.g. 'infer'
+    """
+    child = STAGE_SECONDS.labels(operation, stage)
+    trace = current_trace()
+    span = trace.start_span(f'{operation}.{stage}') if trace is not None and trace.sampled else None
+    if trace is not None:
+        trace.begin_stage()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        child.observe(duration)
+        if trace is not None:
+            trace.end_stage(f'{operation}.{stage}', duration)
+            if span is not None:
+                trace.end_span(span, duration)
@@ -11,6 +11,8 @@ from reportlab.graphics.charts.piecharts import Pie
 import base64
 from io import BytesIO
 
+from src.services.metrics import timed_stage
+
 class PDFGenerator:
     def __init__(self):
         self.styles = getSampleStyleSheet()
@@ -85,38 +87,40 @@ class PDFGenerator:
         Returns:
             bytes: PDF file as bytes
         """
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
-        story = []
-        
-        # Add header
-        story.extend(self._create_header())
-        
-        # Add patient information
-        story.extend(self._create_patient_info(prediction_data))
-        
-        # Add prediction results
-        story.extend(self._create_prediction_results(prediction_data))
-        
-        # Add feature importance analysis
-        story.extend(self._create_feature_importance(prediction_data))
-        
-        # Add medical insights
-        story.extend(self._create_medical_insights(prediction_data))
-        
-        # Add technical information
-        story.extend(self._create_technical_info())
-        
-        # Add disclaimer
-        story.extend(self._create_disclaimer())
-        
-        # Add footer
-        story.extend(self._create_footer())
+        with timed_stage('report', 'build'):
+            buffer = io.BytesIO()
+            doc = SimpleDocTemplate(buffer, pagesize=A4)
+            story = []
+            
+            # Add header
+            story.extend(self._create_header())
+            
+            # Add patient information
+            story.extend(self._create_patient_info(prediction_data))
+            
+            # Add prediction results
+            story.extend(self._create_prediction_results(prediction_data))
+            
+            # Add feature importance analysis
+            story.extend(self._create_feature_importance(prediction_data))
+            
+            # Add medical insights
+            story.extend(self._create_medical_insights(prediction_data))
+            
+            # Add technical information
+            story.extend(self._create_technical_info())
+            
+            # Add disclaimer
+            story.extend(self._create_disclaimer())
+            
+            # Add footer
+            story.extend(self._create_footer())
         
         # Build the PDF
-        doc.build(story)
-        pdf_bytes = buffer.getvalue()
-        buffer.close()
+        with timed_stage('report', 'render'):
+            doc.build(story)
+            pdf_bytes = buffer.getvalue()
+            buffer.close()
         
         return pdf_bytes
     
@@ -256,10 +260,10 @@ class PDFGenerator:
         top_features = sorted_features[:10]
         
         # Create table data
-        table_data = [["Feature", "Importance", "Impact"]]
+        table_data = [["Feature", "Contribution", "Impact"]]
         for feature, importance in top_features:
-            impact = "Positive" if importance > 0 else "Negative"
-            table_data.append([feature, f"{importance:.3f}", impact])
+            impact = "Raises risk" if importance > 0 else "Lowers risk"
+            table_data.append([feature, f"{importance:+.3f}", impact])
         
         table = Table(table_data, colWidths=[3*inch, 1.5*inch, 1.5*inch])
         table.setStyle(TableStyle([
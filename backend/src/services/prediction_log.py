@@ -0,0 +1,328 @@
+"""
+Asynchronous append-only log of every prediction
+
+Requests copy their rows (inputs, probability, predicted class, latency and
+model version) into a bounded in-memory ring buffer and return; a background
+thread flushes the buffer in batches. When the buffer is full the rows that do
+not fit are dropped and counted instead of blocking the request.
+
+Each process writes its own files, rotated by size:
+
+    file   = MAGIC, uint32 header length, JSON header, padding to 8 bytes, block*
+    block  = b'BLK1', uint32 n_rows, one contiguous array per column, padding to 8 bytes
+
+The JSON header lists the columns (name, dtype, per-row shape) and the input
+feature names. Blocks are columnar, so scan_prediction_log can map a file and
+view every column of a block without parsing or copying it.
+"""
+import os
+import glob
+import json
+import time
+import struct
+import atexit
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from src.services.metrics import PREDICTION_LOG_RECORDS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAGIC = b'HDPLOG1\n'
+BLOCK_MAGIC = b'BLK1'
+FILE_PATTERN = 'predictions-*.plog'
+
+_HEADER_LENGTH = struct.Struct('<I')
+_BLOCK_HEADER = struct.Struct('<4sI')
+
+def _columns(n_inputs: int) -> List[tuple]:
+    """Column name, dtype and per-row shape, widest dtypes first so columns stay aligned"""
+    return [
+        ('timestamp', 'f8', ()),
+        ('inputs', 'f8', (n_inputs,)),
+        ('probability', 'f8', ()),
+        ('latency_ms', 'f4', ()),
+        ('model_version', 'S16', ()),
+        ('prediction', 'i1', ())
+    ]
+
+def _padding(n_bytes: int) -> int:
+    return -n_bytes % 8
+
+class PredictionLog:
+    """
+    Bounded ring buffer of prediction records flushed to rotating columnar files
+
+    Args:
+        directory (str): Directory for the log files
+        input_features (Sequence[str]): Names of the raw input features, in column order
+        capacity (int): Rows held in memory before new rows are dropped
+        batch_size (int): Buffered rows that wake the writer before flush_interval
+        flush_interval (float): Seconds between flushes of a partly filled buffer
+        max_file_bytes (int): Size at which a new file is started
+    """
+
+    def __init__(self, directory: str, input_features: Sequence[str], capacity: int = 65536,
+                 batch_size: int = 4096, flush_interval: float = 1.0, max_file_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.input_features = list(input_features)
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.columns = _columns(len(self.input_features))
+        self.dropped = 0
+        self.written = 0
+
+        self._buffers = {name: np.zeros((capacity,) + shape, dtype=dtype) for name, dtype, shape in self.columns}
+        self._head = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = None
+        self._file = None
+        self._file_path = None
+        self._sequence = 0
+        self._closed = False
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        # Started lazily so every forked worker runs its own writer
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='prediction-log', daemon=True)
+                    self._thread.start()
+
+    def record(self, inputs: np.ndarray, probabilities: np.ndarray, predictions: np.ndarray,
+               latency_ms: float, model_version: Optional[str]):
+        """
+        Buffer the records of one scoring call; never blocks on I/O
+
+        Args:
+            inputs (np.ndarray): Raw input features of shape (n_rows, n_input_features)
+            probabilities (np.ndarray): Probability of heart disease per row
+            predictions (np.ndarray): Predicted class per row
+            latency_ms (float): Scoring time of the call in milliseconds
+            model_version (str): Version of the model that scored the rows
+        """
+        if self._closed:
+            return
+        self._ensure_thread()
+
+        n_rows = len(inputs)
+        values = {
+            'timestamp': time.time(),
+            'inputs': inputs,
+            'probability': probabilities,
+            'latency_ms': latency_ms,
+            'model_version': (model_version or '').encode()[:16],
+            'prediction': predictions
+        }
+        with self._lock:
+            accepted = min(n_rows, self.capacity - self._count)
+            start = (self._head + self._count) % self.capacity
+            # The free space may wrap around the end of the buffers
+            first = min(accepted, self.capacity - start)
+            for name, value in values.items():
+                buffer = self._buffers[name]
+                if np.ndim(value) == 0:
+                    buffer[start:start + first] = value
+                    buffer[:accepted - first] = value
+                else:
+                    buffer[start:start + first] = value[:first]
+                    buffer[:accepted - first] = value[first:accepted]
+            self._count += accepted
+            if self._count:
+                self._idle.clear()
+            buffered = self._count
+            self.dropped += n_rows - accepted
+
+        if accepted < n_rows:
+            PREDICTION_LOG_RECORDS.labels('dropped').inc(n_rows - accepted)
+        if buffered >= self.batch_size:
+            self._wake.set()
+
+    def _take(self) -> Dict[str, np.ndarray]:
+        """Copy the buffered rows out and empty the buffer"""
+        with self._lock:
+            head, count = self._head, self._count
+            indices = (head + np.arange(count)) % self.capacity
+            rows = {name: buffer[indices] for name, buffer in self._buffers.items()}
+            self._head = (head + count) % self.capacity
+            self._count = 0
+        return rows
+
+    def _run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            rows = self._take()
+            n_rows = len(rows['timestamp'])
+            try:
+                if n_rows:
+                    self._write_block(rows, n_rows)
+                    with self._lock:
+                        self.written += n_rows
+                    PREDICTION_LOG_RECORDS.labels('written').inc(n_rows)
+            except OSError as e:
+                with self._lock:
+                    self.dropped += n_rows
+                PREDICTION_LOG_RECORDS.labels('dropped').inc(n_rows)
+                logger.warning(f"Could not write prediction log: {str(e)}")
+            finally:
+                with self._lock:
+                    if not self._count:
+                        self._idle.set()
+
+    def _open_file(self):
+        """Start a new log file with the schema header"""
+        if self._file is not None:
+            self._file.close()
+        self._sequence += 1
+        name = f"predictions-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}-{self._sequence:04d}.plog"
+        self._file_path = os.path.join(self.directory, name)
+        self._file = open(self._file_path, 'ab')
+
+        header = json.dumps({
+            'columns': [[name, dtype, list(shape)] for name, dtype, shape in self.columns],
+            'input_features': self.input_features
+        }).encode()
+        prefix = len(MAGIC) + _HEADER_LENGTH.size + len(header)
+        self._file.write(MAGIC + _HEADER_LENGTH.pack(len(header)) + header + b'\0' * _padding(prefix))
+
+    def _write_block(self, rows: Dict[str, np.ndarray], n_rows: int):
+        if self._file is None or self._file.tell() >= self.max_file_bytes:
+            self._open_file()
+
+        parts = [_BLOCK_HEADER.pack(BLOCK_MAGIC, n_rows)]
+        n_bytes = _BLOCK_HEADER.size
+        for name, _, _ in self.columns:
+            data = np.ascontiguousarray(rows[name]).tobytes()
+            parts.append(data)
+            n_bytes += len(data)
+        parts.append(b'\0' * _padding(n_bytes))
+        # A single write keeps blocks whole for readers scanning a file being written
+        self._file.write(b''.join(parts))
+        self._file.flush()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        Wait until buffered records are written
+
+        Returns:
+            bool: Whether the buffer was drained within the timeout
+        """
+        if self._thread is None:
+            return True
+        self._wake.set()
+        return self._idle.wait(timeout)
+
+    def close(self):
+        """Write the remaining records and close the current file"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, int]:
+        """Buffered, written and dropped record counts of this process"""
+        with self._lock:
+            return {'buffered': self._count, 'written': self.written, 'dropped': self.dropped,
+                    'capacity': self.capacity}
+
+def _read_header(data: np.ndarray, path: str):
+    """Parse a file header; returns (columns, input features, offset of the first block)"""
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"Not a prediction log file: {path}")
+    offset = len(MAGIC)
+    header_length, = _HEADER_LENGTH.unpack(bytes(data[offset:offset + _HEADER_LENGTH.size]))
+    offset += _HEADER_LENGTH.size
+    header = json.loads(bytes(data[offset:offset + header_length]))
+    offset += header_length
+    columns = [(name, np.dtype(dtype), tuple(shape)) for name, dtype, shape in header['columns']]
+    return columns, header['input_features'], offset + _padding(offset)
+
+def scan_prediction_log(directory: str) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Iterate over the blocks of every log file, oldest file first
+
+    Files are memory-mapped; each yielded block maps column names to read-only
+    array views into the file. A block still being written is skipped.
+
+    Args:
+        directory (str): Prediction log directory
+
+    Yields:
+        Dict[str, np.ndarray]: Columns of one block, plus 'input_features'
+    """
+    for path in sorted(glob.glob(os.path.join(directory, FILE_PATTERN)), key=os.path.getmtime):
+        if os.path.getsize(path) == 0:
+            continue
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        columns, input_features, offset = _read_header(data, path)
+
+        while offset + _BLOCK_HEADER.size <= len(data):
+            magic, n_rows = _BLOCK_HEADER.unpack(bytes(data[offset:offset + _BLOCK_HEADER.size]))
+            if magic != BLOCK_MAGIC:
+                logger.warning(f"Corrupt block in {path} at byte {offset}")
+                break
+            position = offset + _BLOCK_HEADER.size
+            block = {'input_features': input_features}
+            for name, dtype, shape in columns:
+                n_items = n_rows * int(np.prod(shape, dtype=np.int64))
+                if position + n_items * dtype.itemsize > len(data):
+                    block = None
+                    break
+                block[name] = np.frombuffer(data, dtype=dtype, count=n_items, offset=position).reshape(
+                    (n_rows,) + shape)
+                position += n_items * dtype.itemsize
+            if block is None:
+                break
+            yield block
+            offset = position + _padding(position - offset)
+
+def read_prediction_log(directory: str, columns: Sequence[str] = None, since: float = None,
+                        until: float = None) -> Dict[str, np.ndarray]:
+    """
+    Load logged predictions, optionally only some columns and a time range
+
+    Args:
+        directory (str): Prediction log directory
+        columns (Sequence[str]): Columns to return (default: all)
+        since (float): Earliest Unix timestamp to include
+        until (float): Latest Unix timestamp to include
+
+    Returns:
+        Dict[str, np.ndarray]: Concatenated columns of the matching records,
+        plus 'input_features'
+    """
+    selected, input_features = {}, None
+    for block in scan_prediction_log(directory):
+        input_features = block['input_features']
+        timestamps = block['timestamp']
+        mask = np.ones(len(timestamps), dtype=bool)
+        if since is not None:
+            mask &= timestamps >= since
+        if until is not None:
+            mask &= timestamps <= until
+        if not mask.any():
+            continue
+        for name in columns or [name for name in block if name != 'input_features']:
+            selected.setdefault(name, []).append(block[name][mask])
+
+    result = {name: np.concatenate(parts) for name, parts in selected.items()}
+    result['input_features'] = input_features
+    return result
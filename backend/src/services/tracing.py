@@ -0,0 +1,240 @@
+"""
+Request-scoped stage timings and trace spans
+
+Every request gets a RequestTrace held in a context variable. timed_stage (see
+metrics) adds each stage's own duration to it, without the stages nested in it,
+which becomes the Server-Timing response header. When tracing is enabled (TRACE_EXPORT_PATH), stages are also
+recorded as spans of a W3C trace: an incoming ``traceparent`` header is continued,
+the response carries the server span's ``traceparent``, and finished spans are
+written as JSON lines by a background exporter.
+
+Outside a request the context variable is unset and stages pay a single lookup.
+"""
+import os
+import re
+import json
+import time
+import queue
+import random
+import threading
+import logging
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_trace = ContextVar('current_trace', default=None)
+
+def _new_id(n_bytes: int) -> str:
+    return '%0*x' % (n_bytes * 2, random.getrandbits(n_bytes * 8))
+
+def parse_traceparent(header: str):
+    """
+    Parse a W3C traceparent header
+
+    Args:
+        header (str): Header value, e.g. '00-<trace id>-<parent id>-01'
+
+    Returns:
+        tuple: (trace_id, parent_span_id, sampled), or None if the header is missing or invalid
+    """
+    match = TRACEPARENT_RE.match((header or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+class RequestTrace:
+    """
+    Stage timings and (optionally) spans of one request
+
+    Args:
+        sampled (bool): Record spans for export
+        trace_id (str): Trace id to continue, or None to start a new trace
+        parent_span_id (str): Span id of the caller, if any
+    """
+
+    def __init__(self, sampled: bool = False, trace_id: str = None, parent_span_id: str = None):
+        self.timings = {}
+        self.sampled = sampled
+        self.trace_id = trace_id or _new_id(16)
+        self.parent_span_id = parent_span_id
+        self.span_id = _new_id(8)
+        self.start_ns = time.time_ns()
+        self.spans = []
+        self._stack = [self.span_id]
+        # Time of the finished stages nested in each open stage (the first entry is the request)
+        self._nested_seconds = [0.0]
+
+    def add_timing(self, stage: str, seconds: float):
+        """Add a stage duration; repeated stages are summed"""
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def begin_stage(self):
+        """Open a stage; stages opened before it ends are nested in it"""
+        self._nested_seconds.append(0.0)
+
+    def end_stage(self, stage: str, seconds: float):
+        """Close a stage opened with begin_stage, adding its time minus that of its nested stages"""
+        nested = self._nested_seconds.pop()
+        self._nested_seconds[-1] += seconds
+        self.add_timing(stage, seconds - nested)
+
+    def start_span(self, name: str) -> dict:
+        """Open a child span of the innermost open span"""
+        span = {
+            'trace_id': self.trace_id,
+            'span_id': _new_id(8),
+            'parent_span_id': self._stack[-1],
+            'name': name,
+            'start_time_unix_nano': time.time_ns()
+        }
+        self._stack.append(span['span_id'])
+        return span
+
+    def end_span(self, span: dict, seconds: float):
+        """Close a span opened with start_span"""
+        span['duration_ns'] = int(seconds * 1e9)
+        self._stack.pop()
+        self.spans.append(span)
+
+    def finish(self, name: str, attributes: Dict) -> List[dict]:
+        """Close the server span and return every span of the request"""
+        root = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_span_id,
+            'name': name,
+            'start_time_unix_nano': self.start_ns,
+            'duration_ns': time.time_ns() - self.start_ns,
+            'attributes': attributes
+        }
+        return [root] + self.spans
+
+    def traceparent(self) -> str:
+        """traceparent header identifying the server span"""
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def server_timing(self, total_seconds: float = None) -> str:
+        """Server-Timing header value with durations in milliseconds"""
+        entries = [f'{stage};dur={seconds * 1000:.3f}' for stage, seconds in self.timings.items()]
+        if total_seconds is not None:
+            entries.append(f'total;dur={total_seconds * 1000:.3f}')
+        return ', '.join(entries)
+
+def current_trace() -> Optional[RequestTrace]:
+    """Get the trace of the request being handled, or None"""
+    return _current_trace.get()
+
+def begin_request_trace(trace: RequestTrace):
+    """Make a trace current; returns a token for end_request_trace"""
+    return _current_trace.set(trace)
+
+def end_request_trace(token):
+    """Restore the context from before begin_request_trace"""
+    _current_trace.reset(token)
+
+class FileSpanExporter:
+    """
+    Write spans as JSON lines from a background thread
+
+    Requests only enqueue their spans; when the queue is full spans are dropped
+    and counted rather than slowing requests down.
+
+    Args:
+        path (str): File to append spans to
+        max_queue (int): Maximum number of pending span batches
+    """
+
+    def __init__(self, path: str, max_queue: int = 10000):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Started lazily so every forked worker runs its own writer
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+                    self._thread.start()
+
+    def export(self, spans: List[dict]):
+        """Queue the spans of one request for writing"""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += len(spans)
+
+    def _run(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, 'a') as f:
+                    for spans in batch:
+                        for span in spans:
+                            f.write(json.dumps(span) + '\n')
+            except OSError as e:
+                logger.warning(f"Could not export spans: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until queued spans are written"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+class Tracer:
+    """
+    Decides which requests are traced and exports their spans
+
+    Args:
+        exporter: Object with an export(spans) method, or None to disable tracing
+        sample_rate (float): Fraction of requests without a traceparent header to trace
+    """
+
+    def __init__(self, exporter=None, sample_rate: float = 1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def from_environment(cls) -> 'Tracer':
+        """Build the tracer configured by TRACE_EXPORT_PATH and TRACE_SAMPLE_RATE"""
+        path = os.environ.get('TRACE_EXPORT_PATH')
+        exporter = FileSpanExporter(path) if path else None
+        return cls(exporter, float(os.environ.get('TRACE_SAMPLE_RATE', 1.0)))
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start(self, traceparent: str = None) -> RequestTrace:
+        """Start the trace of a request, continuing the caller's trace if given"""
+        if not self.enabled:
+            return RequestTrace()
+
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_span_id, sampled = parent
+            return RequestTrace(sampled, trace_id, parent_span_id)
+        return RequestTrace(random.random() < self.sample_rate)
+
+    def finish(self, trace: RequestTrace, name: str, attributes: Dict):
+        """Export the spans of a sampled request"""
+        if self.enabled and trace.sampled:
+            self.exporter.export(trace.finish(name, attributes))
@@ -0,0 +1,134 @@
+"""
+Benchmark harness for hot paths of the Heart Disease Prediction System
+
+The benchmarks are skipped unless HEART_BENCH=1 is set:
+
+    HEART_BENCH=1 pytest tests/benchmarks -q                  # measure, write results/latest.json
+    HEART_BENCH=1 HEART_BENCH_UPDATE=1 pytest tests/benchmarks # also store the timings as baselines.json
+    HEART_BENCH=1 HEART_BENCH_GATE=25 pytest tests/benchmarks  # fail if a path is >25% slower than its baseline
+
+Each benchmark reports the median time per call over several rounds and the
+peak memory allocated by Python during one call (tracemalloc). Baselines are
+machine-specific: regenerate them on the machine that runs the gate.
+"""
+
+import gc
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+
+import pytest
+
+BENCH_DIR = os.path.dirname(__file__)
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baselines.json')
+RESULTS_FILE = os.path.join(BENCH_DIR, 'results', 'latest.json')
+
+_results = {}
+
+def _load_baselines():
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE) as f:
+        return json.load(f).get('benchmarks', {})
+
+def pytest_collection_modifyitems(config, items):
+    """Skip the benchmarks unless they were asked for"""
+    if os.environ.get('HEART_BENCH') == '1':
+        return
+    skip = pytest.mark.skip(reason="benchmarks run only with HEART_BENCH=1")
+    for item in items:
+        if BENCH_DIR in str(item.fspath):
+            item.add_marker(skip)
+
+def pytest_sessionfinish(session, exitstatus):
+    """Write the measured timings, and the baselines when updating"""
+    if not _results:
+        return
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()
+        },
+        'benchmarks': dict(sorted(_results.items()))
+    }
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if os.environ.get('HEART_BENCH_UPDATE') == '1':
+        baselines = {'environment': report['environment'], 'benchmarks': _load_baselines()}
+        baselines['benchmarks'].update(_results)
+        baselines['benchmarks'] = dict(sorted(baselines['benchmarks'].items()))
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2)
+
+class Benchmark:
+    """Time a callable and compare it with its stored baseline"""
+
+    def __init__(self, baselines, gate):
+        self.baselines = baselines
+        self.gate = gate
+
+    def __call__(self, name, func, *args, rounds=None, min_time=0.5, **kwargs):
+        """
+        Benchmark one hot path
+
+        Args:
+            name (str): Benchmark name, used as the baseline key
+            func (callable): Function to time
+            rounds (int): Number of timed calls (default: as many as fit in min_time, 3 to 50)
+            min_time (float): Target total measuring time in seconds
+
+        Returns:
+            dict: Median, min and mean seconds per call and peak memory in MB
+        """
+        # Warm up caches and lazily built state, then measure peak memory of one call
+        func(*args, **kwargs)
+        gc.collect()
+        tracemalloc.start()
+        func(*args, **kwargs)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        if rounds is None:
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            single = time.perf_counter() - start
+            rounds = int(min(50, max(3, min_time / max(single, 1e-9))))
+
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            timings.append(time.perf_counter() - start)
+
+        result = {
+            'median_seconds': statistics.median(timings),
+            'min_seconds': min(timings),
+            'mean_seconds': statistics.mean(timings),
+            'rounds': rounds,
+            'peak_memory_mb': round(peak_memory / 1024 ** 2, 3)
+        }
+        _results[name] = result
+
+        baseline = self.baselines.get(name)
+        if self.gate is not None and baseline:
+            limit = baseline['median_seconds'] * (1 + self.gate / 100)
+            if result['median_seconds'] > limit:
+                pytest.fail(
+                    f"{name} regressed: median {result['median_seconds'] * 1000:.3f} ms vs baseline "
+                    f"{baseline['median_seconds'] * 1000:.3f} ms (gate {self.gate:g}%)"
+                )
+        return result
+
+@pytest.fixture(scope='session')
+def benchmark():
+    """Benchmark runner, gated by HEART_BENCH_GATE (percent) when set"""
+    gate = os.environ.get('HEART_BENCH_GATE')
+    return Benchmark(_load_baselines(), float(gate) if gate else None)
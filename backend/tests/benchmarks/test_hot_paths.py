@@ -0,0 +1,50 @@
+"""
+Benchmarks for the hot paths of the Heart Disease Prediction System
+"""
+
+import pytest
+from tests.conftest import make_patients
+from src.prediction.predictor import HeartDiseasePredictor
+from src.data_processing.feature_engineering import get_all_engineered_features, HeartFeatureTransformer
+from src.data_processing.preprocess import preprocess_pipeline, CategoricalEncoder
+from src.services.pdf_generator import PDFGenerator
+
+BATCH_SIZES = [1, 100, 10000, 100000]
+
+@pytest.fixture(scope='module')
+def predictor(trained_model_dir):
+    return HeartDiseasePredictor(model_path=trained_model_dir)
+
+@pytest.fixture(scope='module')
+def patient():
+    return make_patients(1, seed=7).drop(columns=['target']).to_dict('records')[0]
+
+def test_preprocess_input(benchmark, predictor, patient):
+    benchmark('preprocess_input', predictor.preprocess_input, patient)
+
+def test_predict(benchmark, predictor, patient):
+    benchmark('predict', predictor.predict, patient)
+
+@pytest.mark.parametrize('n_rows', BATCH_SIZES)
+def test_batch_predict(benchmark, predictor, n_rows):
+    patients = make_patients(n_rows, seed=1).drop(columns=['target']).to_dict('records')
+    result = benchmark(f'batch_predict[{n_rows}]', predictor.batch_predict, patients)
+    assert result['median_seconds'] > 0
+
+@pytest.mark.parametrize('n_rows', [10000])
+def test_get_all_engineered_features(benchmark, n_rows):
+    df = make_patients(n_rows)
+    benchmark(f'get_all_engineered_features[{n_rows}]', get_all_engineered_features, df)
+
+@pytest.mark.parametrize('n_rows', [10000])
+def test_preprocess_pipeline(benchmark, n_rows):
+    df = make_patients(n_rows)
+    benchmark(
+        f'preprocess_pipeline[{n_rows}]',
+        lambda: preprocess_pipeline(df, feature_transformer=HeartFeatureTransformer(), encoder=CategoricalEncoder())
+    )
+
+def test_generate_heart_disease_report(benchmark, predictor, patient):
+    prediction = predictor.predict(patient)
+    prediction['input_data'] = patient
+    benchmark('generate_heart_disease_report', PDFGenerator().generate_heart_disease_report, prediction)
@@ -0,0 +1,62 @@
+"""
+Shared fixtures for Heart Disease Prediction System tests
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+def make_patients(n_rows: int = 200, seed: int = 0) -> pd.DataFrame:
+    """
+    Create a synthetic heart disease dataset within the validated feature ranges
+    
+    Args:
+        n_rows (int): Number of patients
+        seed (int): Random seed
+        
+    Returns:
+        pd.DataFrame: Patients with the 13 standard features and a target column
+    """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'age': rng.integers(29, 78, n_rows),
+        'sex': rng.integers(0, 2, n_rows),
+        'cp': rng.integers(0, 4, n_rows),
+        'trestbps': rng.integers(94, 200, n_rows),
+        'chol': rng.integers(126, 564, n_rows),
+        'fbs': rng.integers(0, 2, n_rows),
+        'restecg': rng.integers(0, 3, n_rows),
+        'thalach': rng.integers(71, 202, n_rows),
+        'exang': rng.integers(0, 2, n_rows),
+        'oldpeak': rng.integers(0, 62, n_rows) / 10,
+        'slope': rng.integers(0, 3, n_rows),
+        'ca': rng.integers(0, 4, n_rows),
+        'thal': rng.integers(0, 3, n_rows)
+    })
+    risk = 0.04 * (df['age'] - 50) + 0.8 * df['cp'] - 0.02 * (df['thalach'] - 150) + 0.6 * df['exang']
+    df['target'] = (risk + rng.normal(0, 1, n_rows) > 0.5).astype(int)
+    return df
+
+@pytest.fixture(scope='session')
+def trained_model_dir(tmp_path_factory):
+    """Train a small random forest on engineered features and save it like the training pipeline"""
+    from sklearn.ensemble import RandomForestClassifier
+    from src.data_processing.feature_engineering import HeartFeatureTransformer
+    from src.data_processing.preprocess import preprocess_pipeline, CategoricalEncoder
+    from src.model_training.train import save_best_model, build_percentile_index
+    from src.prediction.drift import DriftReference
+    
+    df = make_patients()
+    feature_transformer = HeartFeatureTransformer()
+    categorical_encoder = CategoricalEncoder()
+    X_train, X_test, y_train, y_test, scaler = preprocess_pipeline(
+        df, feature_transformer=feature_transformer, encoder=categorical_encoder
+    )
+    model = RandomForestClassifier(n_estimators=20, max_depth=5, random_state=42).fit(X_train.to_numpy(), y_train)
+    percentile_index = build_percentile_index(model, pd.concat([X_train, X_test]), pd.concat([y_train, y_test]), df)
+    
+    model_path = tmp_path_factory.mktemp('trained_models')
+    save_best_model(model, scaler, list(X_train.columns), model_path=str(model_path),
+                    feature_transformer=feature_transformer, categorical_encoder=categorical_encoder,
+                    percentile_index=percentile_index, drift_reference=DriftReference().fit(df))
+    return str(model_path)
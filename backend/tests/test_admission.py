@@ -0,0 +1,58 @@
+"""
+Tests for admission control
+"""
+
+import time
+import threading
+import pytest
+from src.services.admission import AdmissionController, AdmissionRejected, EndpointClass, remaining_time
+
+def _controller(capacity=2, reserved=1):
+    return AdmissionController(capacity, {
+        'predict': EndpointClass('predict', capacity, max_queue=4, default_deadline=1.0, reserved=reserved),
+        'report': EndpointClass('report', capacity, max_queue=1, default_deadline=1.0)
+    })
+
+def test_reserved_capacity_keeps_predictions_flowing():
+    """Test that reports cannot take the slot reserved for predictions"""
+    controller = _controller()
+    report = controller.acquire('report')
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('report', timeout=0.05)
+    assert rejected.value.status_code == 503
+    assert rejected.value.reason == 'deadline_expired'
+    
+    predict = controller.acquire('predict', timeout=0.05)
+    assert 0 < remaining_time() <= 0.05
+    controller.release(predict)
+    controller.release(report)
+    assert controller.stats()['report']['in_flight'] == 0
+    assert controller.stats()['predict']['service_seconds'] is not None
+
+def test_full_queue_and_unmeetable_deadline_are_shed():
+    """Test 429 when the class queue is full and 503 when the expected wait exceeds the deadline"""
+    controller = _controller(capacity=1, reserved=0)
+    ticket = controller.acquire('report')
+    controller._service_seconds['report'] = 0.2
+    
+    waiter = threading.Thread(target=lambda: controller.release(controller.acquire('report', timeout=5)))
+    waiter.start()
+    while not controller.stats()['report']['queued']:
+        time.sleep(0.001)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('report')
+    assert (rejected.value.status_code, rejected.value.reason) == (429, 'queue_full')
+    assert rejected.value.retry_after >= 1
+    
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('predict', timeout=0.1)
+    assert (rejected.value.status_code, rejected.value.reason) == (503, 'deadline_expired')
+    
+    controller._service_seconds['predict'] = 0.5
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.acquire('predict', timeout=0.1)
+    assert (rejected.value.status_code, rejected.value.reason) == (503, 'deadline')
+    
+    controller.release(ticket)
+    waiter.join()
+    assert controller.stats()['report']['in_flight'] == 0
@@ -24,6 +24,7 @@ def test_health_endpoint(client):
     assert 'status' in data
     assert data['status'] == 'healthy'
     assert 'timestamp' in data
+    assert data['memory']['pid'] > 0
 
 def test_features_endpoint(client):
     """Test the features endpoint"""
@@ -89,6 +90,12 @@ def test_predict_endpoint_invalid_data(client):
     
     # Should return 400 for bad request
     assert response.status_code == 400
+    
+    # NaN and infinite values are reported as missing
+    patient = dict(next(iter(json.load(open('data/sample_data.json')).values())), chol=float('nan'), age='inf')
+    response = client.post('/api/predict', data=json.dumps(patient), content_type='application/json')
+    assert response.status_code == 400
+    assert json.loads(response.data)['error'] == "Missing required fields: ['age', 'chol']"
 
 def test_predict_endpoint_invalid_json(client):
     """Test the predict endpoint with invalid JSON"""
@@ -96,4 +103,300 @@ def test_predict_endpoint_invalid_json(client):
                           data='invalid json',
                           content_type='application/json')
     
-    assert response.status_code == 400
\ No newline at end of file
+    assert response.status_code == 400
+
+def test_what_if_endpoint(client, trained_model_dir, monkeypatch):
+    """Test the what-if sweep endpoint"""
+    from api import routes
+    from src.prediction.predictor import HeartDiseasePredictor
+    
+    monkeypatch.setattr(routes, 'predictor', HeartDiseasePredictor(model_path=trained_model_dir))
+    patient = {
+        "age": 63, "sex": 1, "cp": 3, "trestbps": 145, "chol": 233, "fbs": 1,
+        "restecg": 0, "thalach": 150, "exang": 0, "oldpeak": 2.3, "slope": 0,
+        "ca": 0, "thal": 1
+    }
+    
+    response = client.post('/api/what-if',
+                           data=json.dumps({
+                               "patient": patient,
+                               "sweep": [{"feature": "chol", "start": 150, "stop": 350, "step": 5}]
+                           }),
+                           content_type='application/json')
+    
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert len(data['probabilities']) == 41
+    
+    response = client.post('/api/what-if',
+                           data=json.dumps({"patient": patient, "sweep": [{"feature": "unknown", "values": [1]}]}),
+                           content_type='application/json')
+    assert response.status_code == 400
+    
+    response = client.post('/api/what-if', data=json.dumps([patient]), content_type='application/json')
+    assert response.status_code == 400
+
+def test_batch_predict_endpoint(client, trained_model_dir, monkeypatch):
+    """Test batch prediction from a CSV upload and from a JSON list"""
+    from io import BytesIO
+    from api import routes
+    from src.prediction.predictor import HeartDiseasePredictor
+    
+    monkeypatch.setattr(routes, 'predictor', HeartDiseasePredictor(model_path=trained_model_dir))
+    
+    with open('data/sample_batch.csv', 'rb') as f:
+        csv_bytes = f.read()
+    response = client.post('/api/predict/batch',
+                           data={'file': (BytesIO(csv_bytes), 'patients.csv')},
+                           content_type='multipart/form-data')
+    
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['statistics']['total'] == 10
+    assert data['statistics']['successful'] == 10
+    assert sum(data['statistics']['risk_distribution'].values()) == 10
+    
+    patients = [p for p in json.load(open('data/sample_data.json')).values()]
+    response = client.post('/api/predict/batch',
+                           data=json.dumps(patients + [{"age": 50}]),
+                           content_type='application/json')
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert data['statistics']['failed'] == 1
+    assert data['predictions'][-1]['error'] == 'Invalid input'
+    assert data['predictions'][0]['explanation'] == {'method': 'global'}
+    
+    response = client.post('/api/predict/batch?explain=true', data=json.dumps(patients),
+                           content_type='application/json')
+    assert json.loads(response.data)['predictions'][0]['explanation']['method'] == 'tree_path'
+    
+    response = client.post('/api/predict/batch', data=json.dumps([]), content_type='application/json')
+    assert response.status_code == 400
+
+def test_metrics_endpoint(client):
+    """Test that /metrics exposes request counts and stage latency histograms"""
+    client.get('/health')
+    
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    
+    text = response.data.decode('utf-8')
+    assert '# TYPE heart_api_requests_total counter' in text
+    assert 'heart_api_requests_total{method="GET",endpoint="/health",status="200"}' in text
+    assert '# TYPE heart_stage_duration_seconds histogram' in text
+
+def test_profiling_endpoints_require_admin_token(client, monkeypatch, tmp_path):
+    """Test that profiling is hidden without ADMIN_TOKEN and guarded by it otherwise"""
+    assert client.get('/admin/profiling/tracemalloc/snapshot').status_code == 404
+    
+    monkeypatch.setenv('ADMIN_TOKEN', 'secret')
+    monkeypatch.setenv('PROFILE_DIR', str(tmp_path))
+    assert client.get('/admin/profiling/tracemalloc/snapshot').status_code == 403
+    
+    headers = {'X-Admin-Token': 'secret'}
+    response = client.get('/health', headers=dict(headers, **{'X-Profile': '1'}))
+    profile_id = response.headers['X-Profile-Id']
+    response = client.get(f'/admin/profiling/profiles/{profile_id}', headers=headers)
+    assert response.status_code == 200
+    assert b'function calls' in response.data
+    
+    response = client.post('/admin/profiling/stacks?seconds=0.05&wait=1', headers=headers)
+    assert response.status_code == 200
+    
+    assert client.post('/admin/profiling/tracemalloc/start', headers=headers).status_code == 200
+    try:
+        assert 'top' in json.loads(client.get('/admin/profiling/tracemalloc/snapshot', headers=headers).data)
+        assert 'growth' in json.loads(client.get('/admin/profiling/tracemalloc/snapshot', headers=headers).data)
+    finally:
+        client.post('/admin/profiling/tracemalloc/stop', headers=headers)
+
+def test_server_timing_and_trace_propagation(trained_model_dir, monkeypatch, tmp_path):
+    """Test the per-stage Server-Timing header and traceparent propagation"""
+    from api import routes
+    from src.prediction.predictor import HeartDiseasePredictor
+    
+    trace_file = tmp_path / 'spans.jsonl'
+    monkeypatch.setenv('TRACE_EXPORT_PATH', str(trace_file))
+    monkeypatch.setattr(routes, 'predictor', HeartDiseasePredictor(model_path=trained_model_dir))
+    app = create_app()
+    
+    patient = {
+        "age": 63, "sex": 1, "cp": 3, "trestbps": 145, "chol": 233, "fbs": 1,
+        "restecg": 0, "thalach": 150, "exang": 0, "oldpeak": 2.3, "slope": 0,
+        "ca": 0, "thal": 1
+    }
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    with app.test_client() as client:
+        response = client.post('/api/predict', data=json.dumps(patient), content_type='application/json',
+                               headers={'traceparent': f'00-{trace_id}-00f067aa0ba902b7-01'})
+    
+    assert response.status_code == 200
+    timings = {entry.split(';dur=')[0]: float(entry.split(';dur=')[1])
+               for entry in response.headers['Server-Timing'].split(', ')}
+    for stage in ['predict_request.parse', 'predict_request.validate', 'predict.preprocess', 'predict.infer',
+                  'predict_request.serialize', 'total']:
+        assert stage in timings
+    # Stages are disjoint: a stage's entry leaves out the stages nested in it
+    assert sum(seconds for stage, seconds in timings.items() if stage != 'total') <= timings['total'] + 0.01
+    assert response.headers['traceparent'].startswith(f'00-{trace_id}-')
+    
+    app.extensions['tracer'].exporter.flush()
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert all(span['trace_id'] == trace_id for span in spans)
+    root = spans[0]
+    assert root['parent_span_id'] == '00f067aa0ba902b7'
+    names = {span['name']: span for span in spans}
+    assert names['predict.infer']['parent_span_id'] == names['predict_request.predict']['span_id']
+    nested_ms = sum(span['duration_ns'] for name, span in names.items() if name.startswith('predict.')) / 1e6
+    assert timings['predict_request.predict'] == pytest.approx(
+        names['predict_request.predict']['duration_ns'] / 1e6 - nested_ms, abs=0.01)
+
+def test_liveness_and_readiness_endpoints(client, trained_model_dir, monkeypatch):
+    """Test that readiness waits for a loaded, warmed-up model while liveness does not"""
+    from api import routes
+    from src.prediction.predictor import HeartDiseasePredictor
+    
+    monkeypatch.setattr(routes, 'predictor', HeartDiseasePredictor(model_path='/nonexistent'))
+    assert client.get('/health/live').status_code == 200
+    response = client.get('/health/ready')
+    assert response.status_code == 503
+    assert json.loads(response.data)['reason'] == 'No trained model loaded'
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    monkeypatch.setattr(routes, 'predictor', predictor)
+    assert client.get('/api/health/ready').status_code == 503
+    
+    predictor.warm_up()
+    response = client.get('/api/health/ready')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['status'] == 'ready'
+    assert len(data['model']['version']) == 12
+    assert data['model']['load_seconds'] > 0
+    assert set(data['warm_up']['seconds']) == {'1', '32', '512'}
+    assert data['caches']['warm']
+    assert json.loads(client.get('/health').data)['ready']
+
+def test_drift_endpoint(client, trained_model_dir, monkeypatch):
+    """Test that predictions feed the drift report"""
+    from api import routes
+    from src.prediction.predictor import HeartDiseasePredictor
+    from tests.conftest import make_patients
+    
+    monkeypatch.setattr(routes, 'predictor', HeartDiseasePredictor(model_path='/nonexistent'))
+    assert client.get('/api/drift').status_code == 503
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    monkeypatch.setattr(routes, 'predictor', predictor)
+    patients = make_patients(150, seed=3).drop(columns=['target']).to_dict('records')
+    response = client.post('/api/predict/batch', data=json.dumps(patients), content_type='application/json')
+    assert response.status_code == 200
+    
+    response = client.get('/api/drift')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['observations'] == 150
+    assert set(data['features']) == set(routes.REQUIRED_FIELDS)
+    assert data['features']['chol']['status'] in ('stable', 'moderate')
+
+def test_predict_idempotency_key(client, trained_model_dir, monkeypatch, tmp_path):
+    """Test that a retried prediction with the same Idempotency-Key is replayed"""
+    from api import routes
+    from src.prediction.predictor import HeartDiseasePredictor
+    from src.services.idempotency import IdempotencyStore
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    monkeypatch.setattr(routes, 'predictor', predictor)
+    monkeypatch.setattr(routes, 'idempotency_store', IdempotencyStore(str(tmp_path / 'keys.sqlite3')))
+    calls = []
+    predict = predictor.predict
+    monkeypatch.setattr(predictor, 'predict', lambda data, *args: calls.append(data) or predict(data, *args))
+    
+    patient = {
+        "age": 63, "sex": 1, "cp": 3, "trestbps": 145, "chol": 233, "fbs": 1,
+        "restecg": 0, "thalach": 150, "exang": 0, "oldpeak": 2.3, "slope": 0,
+        "ca": 0, "thal": 1
+    }
+    headers = {'Idempotency-Key': 'ehr-123'}
+    first = client.post('/api/predict', data=json.dumps(patient), content_type='application/json', headers=headers)
+    retry = client.post('/api/predict', data=json.dumps(patient), content_type='application/json', headers=headers)
+    
+    assert first.status_code == retry.status_code == 200
+    assert retry.data == first.data
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert len(calls) == 1
+    
+    response = client.post('/api/predict', data=json.dumps(dict(patient, age=40)),
+                           content_type='application/json', headers=headers)
+    assert response.status_code == 422
+
+def test_overloaded_predict_is_shed_with_retry_after(monkeypatch):
+    """Test that a prediction that cannot start before its deadline gets 503 and Retry-After"""
+    monkeypatch.setenv('ADMISSION_CAPACITY', '1')
+    monkeypatch.setenv('ADMISSION_PREDICT_RESERVED', '0')
+    app = create_app()
+    controller = app.extensions['admission']
+    ticket = controller.acquire('report')
+    
+    with app.test_client() as client:
+        response = client.post('/api/predict', data=json.dumps({"age": 63}), content_type='application/json',
+                               headers={'X-Request-Deadline-Ms': '50'})
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) >= 1
+        assert client.get('/health').status_code == 200
+        
+        controller.release(ticket)
+        response = client.post('/api/predict', data=json.dumps({"age": 63}), content_type='application/json')
+        assert response.status_code == 400
+    
+    assert controller.stats()['predict']['in_flight'] == 0
+    assert 'heart_admission_shed_total{endpoint_class="predict",reason="deadline_expired"}' in \
+        app.test_client().get('/metrics').get_data(as_text=True)
+
+def test_coalesced_predict_does_not_hold_an_admission_slot(monkeypatch, tmp_path):
+    """Test that a duplicate waiting on an Idempotency-Key gives its admission slot back"""
+    import hashlib
+    import threading
+    from api import routes
+    from src.services.idempotency import IdempotencyStore
+    
+    monkeypatch.setenv('ADMISSION_CAPACITY', '1')
+    monkeypatch.setenv('ADMISSION_PREDICT_RESERVED', '0')
+    app = create_app()
+    controller = app.extensions['admission']
+    store = IdempotencyStore(str(tmp_path / 'keys.sqlite3'))
+    monkeypatch.setattr(routes, 'idempotency_store', store)
+    
+    body = json.dumps({"age": 63})
+    key = '/api/predict ehr-456'
+    assert store.claim(key, hashlib.sha256(body.encode()).hexdigest()).outcome == 'owner'
+    
+    waiting = threading.Event()
+    try_claim = store._try_claim
+    monkeypatch.setattr(store, '_try_claim', lambda *args: try_claim(*args) or waiting.set())
+    responses = []
+    def post():
+        with app.test_client() as client:
+            responses.append(client.post('/api/predict', data=body, content_type='application/json',
+                                         headers={'Idempotency-Key': 'ehr-456'}))
+    duplicate = threading.Thread(target=post)
+    duplicate.start()
+    assert waiting.wait(5)
+    
+    ticket = controller.acquire('predict', timeout=5)
+    assert controller.stats()['predict']['in_flight'] == 1
+    controller.release(ticket)
+    
+    store.complete(key, 200, 'application/json', b'{"prediction": 1}')
+    duplicate.join(5)
+    assert responses[0].status_code == 200
+    assert responses[0].headers['Idempotent-Replayed'] == 'true'
+    assert controller.stats()['predict']['in_flight'] == 0
+
+def test_models_endpoint(client):
+    """Test that the served models are listed"""
+    response = client.get('/api/models')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['primary'] in data['models']
@@ -0,0 +1,77 @@
+"""
+Data Loading Tests for Heart Disease Prediction System
+"""
+
+import pytest
+import pandas as pd
+from src.data_processing.load_data import (
+    get_column_dtypes,
+    iter_csv_chunks,
+    load_csv_chunked,
+    REQUIRED_COLUMNS
+)
+
+def _write_dataset(path, n_rows=10):
+    """Write a small dataset CSV with all required columns"""
+    row = {
+        'age': 63, 'sex': 1, 'cp': 3, 'trestbps': 145, 'chol': 233, 'fbs': 1,
+        'restecg': 0, 'thalach': 150, 'exang': 0, 'oldpeak': 2.3, 'slope': 0,
+        'ca': 0, 'thal': 1, 'target': 1
+    }
+    pd.DataFrame([row] * n_rows).to_csv(path, index=False)
+
+def test_column_dtypes():
+    """Test compact dtypes derived from the feature descriptions"""
+    dtypes = get_column_dtypes()
+    
+    assert set(REQUIRED_COLUMNS) <= set(dtypes)
+    assert dtypes['sex'] == 'Int8'
+    assert dtypes['cp'] == 'Int8'
+    assert dtypes['target'] == 'Int8'
+    assert dtypes['chol'] == 'float32'
+    assert dtypes['oldpeak'] == 'float32'
+
+def test_iter_csv_chunks(tmp_path):
+    """Test streaming a CSV file in chunks"""
+    csv_path = tmp_path / 'heart.csv'
+    _write_dataset(csv_path, n_rows=10)
+    
+    chunks = list(iter_csv_chunks(str(csv_path), chunksize=4))
+    
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    assert chunks[0]['sex'].dtype == 'Int8'
+    assert chunks[0]['chol'].dtype == 'float32'
+
+def test_iter_csv_chunks_blank_categorical(tmp_path):
+    """Test that a blank categorical cell is read as missing instead of failing the chunk"""
+    csv_path = tmp_path / 'heart.csv'
+    _write_dataset(csv_path, n_rows=3)
+    lines = csv_path.read_text().splitlines()
+    lines[2] = lines[2].replace(',1,3,', ',,3,', 1)
+    csv_path.write_text('\n'.join(lines) + '\n')
+    
+    chunk = next(iter_csv_chunks(str(csv_path)))
+    
+    assert chunk['sex'].dtype == 'Int8'
+    assert chunk['sex'].isna().tolist() == [False, True, False]
+
+def test_iter_csv_chunks_missing_columns(tmp_path):
+    """Test that missing columns are rejected from the header alone"""
+    csv_path = tmp_path / 'bad.csv'
+    pd.DataFrame({'age': [63], 'sex': [1]}).to_csv(csv_path, index=False)
+    
+    with pytest.raises(ValueError):
+        next(iter_csv_chunks(str(csv_path)))
+
+def test_load_csv_chunked(tmp_path):
+    """Test chunked loading with statistics"""
+    csv_path = tmp_path / 'heart.csv'
+    _write_dataset(csv_path, n_rows=25)
+    
+    df, stats = load_csv_chunked(str(csv_path), chunksize=10)
+    
+    assert df.shape == (25, len(REQUIRED_COLUMNS))
+    assert stats['rows'] == 25
+    assert stats['chunks'] == 3
+    assert stats['rows_per_sec'] > 0
+    assert 'peak_memory_mb' in stats
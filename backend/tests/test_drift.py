@@ -0,0 +1,57 @@
+"""
+Tests for the data drift monitor
+"""
+
+import multiprocessing
+import numpy as np
+from src.prediction.drift import DriftReference, DriftMonitor
+from tests.conftest import make_patients
+
+def _observe(reference, directory, n_rows):
+    """Feed rows to a drift monitor in a separate worker process"""
+    monitor = DriftMonitor(reference, reference.features, directory=directory)
+    monitor.update(make_patients(n_rows, seed=n_rows)[reference.features].to_numpy(dtype=np.float64))
+
+def test_drift_detects_shifted_feature():
+    """Test that a unit change in one feature is flagged while the others stay stable"""
+    reference = DriftReference().fit(make_patients(2000, seed=0))
+    features = reference.features
+    monitor = DriftMonitor(reference, features)
+
+    live = make_patients(2000, seed=1)[features].to_numpy(dtype=np.float64)
+    live[:, features.index('chol')] /= 38.67
+    for batch in np.array_split(live, 50):
+        monitor.update(batch)
+
+    report = monitor.report()
+    assert report['observations'] == 2000
+    assert report['drifted_features'] == ['chol']
+    assert report['features']['chol']['ks'] > 0.9
+    assert report['features']['age']['status'] == 'stable'
+    assert report['features']['cp']['psi'] < 0.1
+
+def test_drift_window_expires_old_observations():
+    """Test that observations older than the window no longer count"""
+    reference = DriftReference().fit(make_patients(500))
+    monitor = DriftMonitor(reference, reference.features, window_seconds=60, n_slots=6, min_count=10)
+    rows = make_patients(50)[reference.features].to_numpy(dtype=np.float64)
+
+    monitor.update(rows, now=1000)
+    monitor.update(rows[:20], now=1035)
+    assert monitor.report(now=1040)['observations'] == 70
+    assert monitor.report(now=1075)['observations'] == 20
+    assert monitor.report(now=1200)['features']['age']['status'] == 'insufficient_data'
+
+def test_drift_counts_aggregate_across_processes(tmp_path):
+    """Test that the report sums the window counts written by every worker process"""
+    reference = DriftReference().fit(make_patients(500))
+    processes = [multiprocessing.Process(target=_observe, args=(reference, str(tmp_path), n)) for n in (30, 50)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    monitor = DriftMonitor(reference, reference.features, directory=str(tmp_path))
+    monitor.update(make_patients(20)[reference.features].to_numpy(dtype=np.float64))
+    assert monitor.report()['observations'] == 100
+    assert len(list(tmp_path.glob('drift_model_*.npy'))) == 3
@@ -0,0 +1,88 @@
+"""
+Feature Engineering Tests for Heart Disease Prediction System
+"""
+
+import numpy as np
+import pandas as pd
+from src.data_processing.feature_engineering import (
+    create_age_groups,
+    create_bp_categories,
+    create_chol_categories,
+    create_risk_score,
+    create_interaction_features,
+    get_all_engineered_features
+)
+
+def _sample_frame():
+    """Create a frame covering every bin edge, out-of-range values and NaN"""
+    return pd.DataFrame({
+        'age': [25, 30, 45, 59, 60, 99, 100, np.nan],
+        'sex': [0, 1, 0, 1, 0, 1, 0, 1],
+        'trestbps': [85, 90, 120, 130, 140, 180, 200, np.nan],
+        'chol': [150, 200, 239, 240, 300, 100, 600, np.nan],
+        'thalach': [60, 100, 150, 200, 120, 90, 180, 170]
+    })
+
+def test_fused_matches_individual_steps():
+    """Test that the fused pipeline matches chaining the individual steps"""
+    df = _sample_frame()
+    
+    expected = df.copy()
+    for step in [create_age_groups, create_bp_categories, create_chol_categories,
+                 create_risk_score, create_interaction_features]:
+        expected = step(expected)
+    
+    result = get_all_engineered_features(df)
+    
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_fused_does_not_modify_input():
+    """Test that the input frame is left untouched unless inplace is requested"""
+    df = _sample_frame()
+    columns = list(df.columns)
+    
+    get_all_engineered_features(df)
+    assert list(df.columns) == columns
+    
+    get_all_engineered_features(df, inplace=True)
+    assert 'risk_score' in df.columns
+
+def test_fused_compact_dtypes():
+    """Test that interactions on compact integer dtypes do not overflow"""
+    df = pd.DataFrame({
+        'age': np.array([70], dtype=np.int8),
+        'trestbps': np.array([100], dtype=np.int8),
+        'chol': np.array([120], dtype=np.int8)
+    })
+    
+    result = get_all_engineered_features(df)
+    
+    assert result['age_trestbps_interaction'].iloc[0] == 7000
+    assert result['bp_category'].iloc[0] == 'Normal'
+
+def test_transformer_matches_fused_columns():
+    """Test that the transformer encodes the same engineered features"""
+    from src.data_processing.feature_engineering import HeartFeatureTransformer
+    
+    df = _sample_frame()
+    transformer = HeartFeatureTransformer().fit(df)
+    output = pd.DataFrame(transformer.transform(df), columns=transformer.get_feature_names_out())
+    engineered = get_all_engineered_features(df)
+    
+    np.testing.assert_allclose(output['risk_score'], engineered['risk_score'])
+    np.testing.assert_allclose(output['age_chol_interaction'], engineered['age_chol_interaction'])
+    for i, category in enumerate(engineered['bp_category']):
+        if category != 'Unknown':
+            assert output.loc[i, f'bp_category_{category}'] == 1
+    assert output.filter(like='age_group_').sum(axis=1).tolist() == [1, 1, 1, 1, 1, 1, 0, 0]
+
+def test_transformer_single_row_matches_batch():
+    """Test the single-row fast path against the batch path"""
+    from src.data_processing.feature_engineering import HeartFeatureTransformer
+    
+    df = _sample_frame()
+    transformer = HeartFeatureTransformer().fit(df)
+    batch = transformer.transform(df.to_numpy())
+    
+    for i in range(len(df)):
+        np.testing.assert_array_equal(transformer.transform(df.to_numpy()[i]), batch[i:i + 1])
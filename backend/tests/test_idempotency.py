@@ -0,0 +1,73 @@
+"""
+Tests for the idempotency key store
+"""
+
+import threading
+import multiprocessing
+from src.services.idempotency import IdempotencyStore
+
+def _claim_and_complete(path, results):
+    """Claim a key in a separate process, completing it if this process owns it"""
+    store = IdempotencyStore(path)
+    claim = store.claim('predict k1', 'body')
+    if claim.outcome == 'owner':
+        store.complete('predict k1', 200, 'application/json', b'{"probability": 0.4}')
+    results.put(claim.outcome)
+
+def test_concurrent_duplicates_are_coalesced(tmp_path):
+    """Test that only one of several concurrent requests runs and the others get its response"""
+    store = IdempotencyStore(str(tmp_path / 'keys.sqlite3'))
+    runs, outcomes = [], []
+    started = threading.Barrier(5)
+
+    def request():
+        started.wait()
+        claim = store.claim('predict k1', 'body')
+        if claim.outcome == 'owner':
+            runs.append(1)
+            threading.Event().wait(0.1)
+            store.complete('predict k1', 200, 'application/json', b'{"probability": 0.4}')
+        else:
+            outcomes.append((claim.outcome, claim.body, claim.waited))
+
+    threads = [threading.Thread(target=request) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(runs) == 1
+    assert outcomes == [('replay', b'{"probability": 0.4}', True)] * 4
+    assert store.claim('predict k1', 'other body').outcome == 'mismatch'
+
+def test_keys_are_shared_across_processes(tmp_path):
+    """Test that a key completed in one worker process is replayed in another"""
+    path = str(tmp_path / 'keys.sqlite3')
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_claim_and_complete, args=(path, results)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    outcomes = sorted(results.get() for _ in processes)
+    assert outcomes == ['owner', 'replay', 'replay']
+
+def test_expired_released_and_excess_keys_are_evicted(tmp_path):
+    """Test TTL expiry, release after failures, and the LRU bound"""
+    store = IdempotencyStore(str(tmp_path / 'keys.sqlite3'), ttl=0, max_entries=2)
+    assert store.claim('a', 'body').outcome == 'owner'
+    store.complete('a', 200, 'application/json', b'{}')
+    assert store.claim('a', 'body').outcome == 'owner'
+
+    store.release('a')
+    assert len(store) == 0
+
+    store.ttl = 60
+    for key in ['a', 'b', 'c']:
+        store.claim(key, 'body')
+        store.complete(key, 200, 'application/json', b'{}')
+    store.claim('a', 'body')
+    store.evict()
+    assert len(store) == 2
+    assert store.claim('b', 'body').outcome == 'owner'
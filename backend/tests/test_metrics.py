@@ -0,0 +1,57 @@
+"""
+Tests for the metrics registry
+"""
+
+import multiprocessing
+import pytest
+from src.services.metrics import MetricsRegistry, mark_process_dead
+
+def _record(metrics_dir, n):
+    """Record metrics in a separate process"""
+    registry = MetricsRegistry(metrics_dir)
+    registry.counter('jobs_total', 'Jobs', ('kind',)).labels('a').inc(n)
+    registry.histogram('job_seconds', 'Job time', buckets=(0.1, 1.0)).observe(0.5)
+    registry.gauge('busy', 'Busy workers').set(1)
+
+def _declare(registry):
+    registry.counter('jobs_total', 'Jobs', ('kind',))
+    registry.histogram('job_seconds', 'Job time', buckets=(0.1, 1.0))
+    registry.gauge('busy', 'Busy workers')
+
+def test_histogram_exposition():
+    """Test that buckets are cumulative and sum/count are exposed"""
+    registry = MetricsRegistry()
+    histogram = registry.histogram('latency_seconds', 'Latency', ('stage',), buckets=(0.1, 1.0))
+    for value in [0.05, 0.5, 0.5, 3.0]:
+        histogram.labels('inference').observe(value)
+    
+    text = registry.render()
+    assert 'latency_seconds_bucket{stage="inference",le="0.1"} 1.0' in text
+    assert 'latency_seconds_bucket{stage="inference",le="1.0"} 3.0' in text
+    assert 'latency_seconds_bucket{stage="inference",le="+Inf"} 4.0' in text
+    assert 'latency_seconds_sum{stage="inference"} 4.05' in text
+    assert 'latency_seconds_count{stage="inference"} 4.0' in text
+    
+    with pytest.raises(ValueError):
+        registry.counter('requests_total', 'Requests').inc(-1)
+
+def test_metrics_aggregate_across_processes(tmp_path):
+    """Test that values written by several worker processes are summed"""
+    processes = [multiprocessing.Process(target=_record, args=(str(tmp_path), n)) for n in (1, 2, 3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    
+    registry = MetricsRegistry(str(tmp_path))
+    _declare(registry)
+    text = registry.render()
+    assert 'jobs_total{kind="a"} 6.0' in text
+    assert 'job_seconds_count 3.0' in text
+    assert 'busy 3.0' in text
+    
+    # Exited workers keep their counts but no longer contribute to gauges
+    mark_process_dead(processes[0].pid, str(tmp_path))
+    text = registry.render()
+    assert 'jobs_total{kind="a"} 6.0' in text
+    assert 'busy 2.0' in text
@@ -3,6 +3,7 @@ Model Tests for Heart Disease Prediction System
 """
 
 import numpy as np
+import pytest
 from src.prediction.predictor import HeartDiseasePredictor
 
 def test_predictor_initialization():
@@ -62,4 +63,590 @@ def test_feature_names():
     predictor.feature_names = expected_features
     
     assert predictor.feature_names == expected_features
-    assert len(predictor.feature_names) == 13
\ No newline at end of file
+    assert len(predictor.feature_names) == 13
+
+def test_predictor_with_feature_transformer(trained_model_dir):
+    """Test that serving applies the saved training-time feature transform"""
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    assert predictor.feature_transformer is not None
+    
+    patient_data = {
+        'age': 63, 'sex': 1, 'cp': 3, 'trestbps': 145, 'chol': 233, 'fbs': 1,
+        'restecg': 0, 'thalach': 150, 'exang': 0, 'oldpeak': 2.3, 'slope': 0,
+        'ca': 0, 'thal': 1
+    }
+    
+    processed = predictor.preprocess_input(patient_data)
+    assert processed.shape == (1, len(predictor.feature_names))
+    
+    result = predictor.predict(patient_data)
+    assert 0.0 <= result['probability'] <= 1.0
+    assert result['risk_level'] in ['Low', 'Medium', 'High']
+
+def test_batch_predict_matches_single(trained_model_dir):
+    """Test that vectorized batch prediction matches single predictions"""
+    from tests.conftest import make_patients
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    patients = make_patients(20, seed=1).drop(columns=['target']).to_dict('records')
+    patients.insert(3, {'age': 'unknown'})
+    
+    results = predictor.batch_predict(patients)
+    
+    assert len(results) == 21
+    assert results[3]['error'] == 'Prediction failed'
+    for patient, result in zip(patients[:3] + patients[4:], results[:3] + results[4:]):
+        single = predictor.predict(patient)
+        assert result['prediction'] == single['prediction']
+        np.testing.assert_almost_equal(result['probability'], single['probability'])
+    
+    # Batches report the global importances unless explanations are asked for
+    assert results[0]['explanation'] == {'method': 'global'}
+    explained = predictor.batch_predict(patients[:3], explain=True)
+    for patient, result in zip(patients[:3], explained):
+        single = predictor.predict(patient)
+        assert result['explanation'] == single['explanation']
+        for feature, value in single['feature_importance'].items():
+            np.testing.assert_almost_equal(result['feature_importance'][feature], value)
+
+def test_occlusion_explanations_are_capped(trained_model_dir, monkeypatch):
+    """Test that batches too large for occlusion fall back to the global importances"""
+    from types import SimpleNamespace
+    from tests.conftest import make_patients
+    from src.prediction.predictor import MAX_OCCLUSION_ROWS
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    explained = []
+    monkeypatch.setattr(predictor, 'explainer', SimpleNamespace(
+        method='occlusion', units='probability', expected_value=0.5,
+        explain=lambda X: explained.append(len(X)) or np.zeros((len(X), len(predictor.feature_names)))
+    ))
+    patients = make_patients(MAX_OCCLUSION_ROWS + 1, seed=2).drop(columns=['target']).to_dict('records')
+    
+    assert predictor.batch_predict(patients[:2], explain=True)[0]['explanation']['method'] == 'occlusion'
+    assert predictor.batch_predict(patients, explain=True)[0]['explanation'] == {'method': 'global'}
+    assert explained == [2]
+
+def test_explainer_contributions_are_additive():
+    """Test that local contributions sum to the model output"""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
+    from src.prediction.explainer import PredictionExplainer
+    from tests.conftest import make_patients
+    
+    df = make_patients(300)
+    X = df.drop(columns=['target']).to_numpy(dtype=float)
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    y = df['target'].to_numpy()
+    names = list(df.columns[:-1])
+    
+    forest = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y)
+    explainer = PredictionExplainer(forest, names)
+    contributions = explainer.explain(X[:50])
+    np.testing.assert_allclose(
+        explainer.expected_value + contributions.sum(axis=1), forest.predict_proba(X[:50])[:, 1], atol=1e-9
+    )
+    
+    linear = LogisticRegression().fit(X, y)
+    explainer = PredictionExplainer(linear, names)
+    contributions = explainer.explain(X[:50])
+    np.testing.assert_allclose(
+        explainer.expected_value + contributions.sum(axis=1), linear.decision_function(X[:50]), atol=1e-9
+    )
+    
+    # XGBoost reports its expected value before any explanation; boosted sklearn trees use occlusion
+    from xgboost import XGBClassifier
+    from sklearn.ensemble import GradientBoostingClassifier
+    booster = XGBClassifier(n_estimators=10, max_depth=3).fit(X, y)
+    explainer = PredictionExplainer(booster, names)
+    expected_value = explainer.expected_value
+    margin = booster.predict(X[:50], output_margin=True)
+    np.testing.assert_allclose(expected_value + explainer.explain(X[:50]).sum(axis=1), margin, atol=1e-4)
+    assert PredictionExplainer(GradientBoostingClassifier(n_estimators=5).fit(X, y), names).method == 'occlusion'
+
+def test_predict_reports_local_contributions(trained_model_dir):
+    """Test that feature_importance differs between patients"""
+    from tests.conftest import make_patients
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    patients = make_patients(2, seed=3).drop(columns=['target']).to_dict('records')
+    
+    first, second = predictor.predict(patients[0]), predictor.predict(patients[1])
+    
+    assert first['explanation']['method'] == 'tree_path'
+    assert first['feature_importance'] != second['feature_importance']
+    np.testing.assert_almost_equal(
+        first['explanation']['expected_value'] + sum(first['feature_importance'].values()),
+        first['probability']
+    )
+
+def test_sweep_matches_individual_predictions(trained_model_dir):
+    """Test that a what-if grid is scored like the individual variants"""
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    patient_data = {
+        'age': 63, 'sex': 1, 'cp': 3, 'trestbps': 145, 'chol': 233, 'fbs': 1,
+        'restecg': 0, 'thalach': 150, 'exang': 0, 'oldpeak': 2.3, 'slope': 0,
+        'ca': 0, 'thal': 1
+    }
+    
+    result = predictor.sweep(patient_data, [
+        {'feature': 'chol', 'start': 150, 'stop': 350, 'step': 50},
+        {'feature': 'trestbps', 'values': [110, 160]}
+    ])
+    
+    assert result['axes']['chol'] == [150, 200, 250, 300, 350]
+    assert np.array(result['probabilities']).shape == (5, 2)
+    assert result['n_variants'] == 10
+    np.testing.assert_almost_equal(result['base_probability'], predictor.predict(patient_data)['probability'])
+    
+    variant = dict(patient_data, chol=300, trestbps=160)
+    np.testing.assert_almost_equal(result['probabilities'][3][1], predictor.predict(variant)['probability'])
+
+def test_sweep_rejects_invalid_specs(trained_model_dir):
+    """Test sweep validation"""
+    import pytest
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    patient_data = {'age': 63, 'sex': 1}
+    
+    with pytest.raises(ValueError):
+        predictor.sweep(patient_data, [{'feature': 'weight', 'values': [1, 2]}])
+    with pytest.raises(ValueError):
+        predictor.sweep(patient_data, [{'feature': 'chol', 'start': 100, 'stop': 600, 'step': 0}])
+    with pytest.raises(ValueError):
+        predictor.sweep(patient_data, [{'feature': 'chol', 'start': 100, 'stop': 600, 'step': 1},
+                                       {'feature': 'age', 'start': 20, 'stop': 100, 'step': 1}])
+
+def test_percentile_index_matches_reference_ranks():
+    """Test that percentiles match the rank of a probability within its stratum"""
+    from src.prediction.percentiles import PercentileIndex
+    
+    rng = np.random.default_rng(0)
+    probabilities = rng.random(5000)
+    age = rng.integers(29, 78, 5000)
+    sex = rng.integers(0, 2, 5000)
+    index = PercentileIndex(max_points=101).fit(probabilities, age, sex)
+    
+    result = index.percentile(0.5, age=65, sex=1)
+    stratum = probabilities[(age >= 60) & (sex == 1)]
+    assert result['stratum'] == {'age_group': '60+', 'sex': 'male'}
+    assert result['reference_size'] == len(stratum)
+    assert abs(result['percentile'] - 100 * np.mean(stratum < 0.5)) < 1.5
+    
+    # Ages outside the age groups fall back to the whole population
+    assert index.percentile(0.5, age=120, sex=0)['stratum']['age_group'] is None
+
+def test_percentile_index_uses_out_of_fold_probabilities():
+    """Test that the reference probabilities come from models that did not see the patient"""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import cross_val_predict
+    from tests.conftest import make_patients
+    from src.model_training.train import build_percentile_index
+    
+    df = make_patients()
+    X, y = df.drop(columns=['target']), df['target']
+    model = RandomForestClassifier(n_estimators=20, random_state=0).fit(X, y)
+    index = build_percentile_index(model, X, y, df)
+    
+    out_of_fold = cross_val_predict(RandomForestClassifier(n_estimators=20, random_state=0), X, y,
+                                    cv=5, method='predict_proba')[:, 1]
+    np.testing.assert_array_equal(index.strata['all']['values'], np.sort(out_of_fold))
+    assert not np.array_equal(index.strata['all']['values'], np.sort(model.predict_proba(X)[:, 1]))
+
+def test_predict_reports_population_percentile(trained_model_dir):
+    """Test that predictions report a percentile within the patient's stratum"""
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    assert predictor.percentile_index is not None
+    
+    patient_data = {
+        'age': 63, 'sex': 1, 'cp': 3, 'trestbps': 145, 'chol': 233, 'fbs': 1,
+        'restecg': 0, 'thalach': 150, 'exang': 0, 'oldpeak': 2.3, 'slope': 0,
+        'ca': 0, 'thal': 1
+    }
+    
+    percentile = predictor.predict(patient_data)['population_percentile']
+    assert 0.0 <= percentile['percentile'] <= 100.0
+    assert percentile['description'].startswith('higher than')
+    assert predictor.batch_predict([patient_data])[0]['population_percentile'] == percentile
+
+def test_inference_pool_matches_local_predictions(trained_model_dir):
+    """Test that the process-pool backend returns the same results as in-process inference"""
+    from tests.conftest import make_patients
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    patients = make_patients(1500, seed=3).drop(columns=['target']).to_dict('records')
+    expected = predictor.batch_predict(patients)
+    
+    predictor.start_inference_pool(processes=2)
+    try:
+        # More rows than the initial shared buffers hold, so they are regrown
+        results = predictor.batch_predict(patients)
+        single = predictor.predict(patients[0])
+    finally:
+        predictor.inference_pool.close()
+    
+    for result, reference in zip(results, expected):
+        np.testing.assert_almost_equal(result['probability'], reference['probability'])
+        assert result['feature_importance'] == pytest.approx(reference['feature_importance'])
+    np.testing.assert_almost_equal(single['probability'], expected[0]['probability'])
+
+def test_inference_pool_replaces_dead_worker(trained_model_dir):
+    """Test that a dead worker is dropped and replaced in the background, even after a failed restart"""
+    import time
+    from src.prediction.pool import InferencePool
+    
+    pool = InferencePool(trained_model_dir, processes=1)
+    try:
+        raw = np.zeros((2, pool._workers[0].n_inputs))
+        start_worker, attempts = pool._start_worker, []
+        
+        def flaky_start():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("simulated start failure")
+            return start_worker()
+        pool._start_worker = flaky_start
+        
+        pool._workers[0].process.kill()
+        pool._workers[0].process.join()
+        with pytest.raises(RuntimeError):
+            pool.score(raw)
+        # Only healthy workers are handed out again
+        assert pool._idle.qsize() == len(pool._workers) == 0
+        
+        deadline = time.time() + 120
+        while not pool._workers and time.time() < deadline:
+            time.sleep(0.2)
+        assert len(attempts) == 2
+        probabilities, _ = pool.score(raw)
+        assert probabilities.shape == (2, 2)
+    finally:
+        pool.close()
+
+def test_flat_forest_matches_pickled_model(trained_model_dir):
+    """Test that the memory-mapped flat forest reproduces the pickled random forest"""
+    import os
+    import pickle
+    from tests.conftest import make_patients
+    from src.prediction.flat_forest import FlatForest, ARRAYS
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    assert isinstance(predictor.model, FlatForest)
+    assert isinstance(predictor.model.value, np.memmap)
+    
+    with open(os.path.join(trained_model_dir, 'best_model.pkl'), 'rb') as f:
+        model = pickle.load(f)
+    patients = make_patients(300, seed=5).drop(columns=['target']).to_dict('records')
+    X, _, _ = predictor.preprocess_batch(patients)
+    
+    np.testing.assert_allclose(predictor.model.predict_proba(X), model.predict_proba(X), atol=1e-12)
+    np.testing.assert_array_equal(predictor.model.predict(X), model.predict(X))
+    
+    # Batches are walked in blocks of rows; a small batch is a single block
+    np.testing.assert_allclose(predictor.model.predict_proba(X[:5]), model.predict_proba(X[:5]), atol=1e-12)
+    np.testing.assert_array_equal(predictor.model.apply(X)[:5], predictor.model.apply(X[:5]))
+    
+    from src.prediction.explainer import PredictionExplainer
+    reference = PredictionExplainer(model, predictor.feature_names)
+    np.testing.assert_allclose(predictor.explainer.explain(X), reference.explain(X), atol=1e-12)
+    
+    # Warm-up scores large batches too, but the worker keeps scoring on the shared pages
+    predictor.warm_up()
+    assert predictor.warm_up_status == 'complete'
+    assert getattr(predictor.model, '_trees', None) is None
+    assert all(isinstance(getattr(predictor.model, name), np.memmap) for name in ARRAYS)
+
+def test_workers_only_load_flat_forest_arrays(trained_model_dir, tmp_path):
+    """Test that a stale flat forest is left alone by workers and rewritten by refresh_flat_forest"""
+    import os
+    import shutil
+    from src.prediction.flat_forest import FlatForest, FLAT_FOREST_DIR, refresh_flat_forest
+    
+    model_path = tmp_path / 'bundle'
+    shutil.copytree(trained_model_dir, model_path)
+    meta_file = model_path / FLAT_FOREST_DIR / 'meta.json'
+    stale = os.path.getmtime(meta_file) - 60
+    os.utime(meta_file, (stale, stale))
+    
+    predictor = HeartDiseasePredictor(model_path=str(model_path))
+    assert not isinstance(predictor.model, FlatForest)
+    assert os.path.getmtime(meta_file) == stale
+    
+    assert refresh_flat_forest(str(model_path))
+    assert not refresh_flat_forest(str(model_path))
+    assert isinstance(HeartDiseasePredictor(model_path=str(model_path)).model, FlatForest)
+
+def test_model_registry_routes_and_shadows(trained_model_dir, tmp_path):
+    """Test weighted sticky routing and shadow agreement between two bundles"""
+    import shutil
+    from tests.conftest import make_patients
+    
+    model_path = tmp_path / 'bundle'
+    shutil.copytree(trained_model_dir, model_path)
+    shutil.copytree(trained_model_dir, model_path / 'candidates' / 'forest_b')
+    
+    predictor = HeartDiseasePredictor(model_path=str(model_path))
+    with pytest.raises(ValueError):
+        predictor.start_model_registry(weights={'forest_b': 1.5})
+    predictor.start_model_registry(weights={'forest_b': 0.3}, shadows=['forest_b'])
+    registry = predictor.registry
+    
+    assert registry.choose('patient-7') == registry.choose('patient-7')
+    share = np.mean([registry.choose(f'patient-{i}') == 'forest_b' for i in range(4000)])
+    assert 0.25 < share < 0.35
+    
+    patients = make_patients(20, seed=2).drop(columns=['target']).to_dict('records')
+    routed = {predictor.predict(patient, routing_key=str(i))['model']['name'] for i, patient in enumerate(patients)}
+    assert routed == {'primary', 'forest_b'}
+    results = predictor.batch_predict(patients, routing_key='batch-1')
+    assert all(result['model']['name'] == registry.choose('batch-1') for result in results)
+    assert registry.wait_for_shadows()
+    
+    report = predictor.models_report()
+    assert report['models']['forest_b']['role'] == 'shadow'
+    assert report['models']['primary']['weight'] == pytest.approx(0.7)
+    assert report['models']['forest_b']['compared'] > 0
+    assert report['models']['forest_b']['agreement'] == 1.0
+    assert report['models']['forest_b']['mean_abs_probability_difference'] == 0.0
+
+def test_shadow_scoring_waits_for_idle_worker(trained_model_dir, tmp_path):
+    """Test that queued shadow scoring never runs while the primary path is serving"""
+    import shutil
+    import threading
+    import time
+    from tests.conftest import make_patients
+    
+    model_path = tmp_path / 'bundle'
+    shutil.copytree(trained_model_dir, model_path)
+    shutil.copytree(trained_model_dir, model_path / 'candidates' / 'forest_b')
+    predictor = HeartDiseasePredictor(model_path=str(model_path))
+    predictor.start_model_registry(shadows=['forest_b'])
+    registry = predictor.registry
+    
+    # One request stays in flight until released, like a slow client or a long batch
+    in_flight, release = threading.Event(), threading.Event()
+    serve = predictor._predict_patient
+    def slow_serve(patient):
+        if patient.get('hold'):
+            in_flight.set()
+            release.wait(5)
+        return serve(patient)
+    predictor._predict_patient = slow_serve
+    
+    shadow = registry.bundles['forest_b']
+    score = shadow._score
+    shadow_calls = []
+    shadow._score = lambda *args, **kwargs: shadow_calls.append(time.perf_counter()) or score(*args, **kwargs)
+    
+    patients = make_patients(6, seed=3).drop(columns=['target']).to_dict('records')
+    held = threading.Thread(target=predictor.predict, args=(dict(patients[0], hold=True),))
+    held.start()
+    assert in_flight.wait(5)
+    
+    # Requests served meanwhile queue their shadow batches without having them scored next to them
+    for patient in patients[1:]:
+        assert 'probability' in predictor.predict(patient)
+    time.sleep(0.2)
+    assert shadow_calls == []
+    
+    release.set()
+    held.join(5)
+    assert registry.wait_for_shadows()
+    assert len(shadow_calls) == len(patients)
+    assert predictor.models_report()['models']['forest_b']['compared'] == len(patients)
+
+def test_onnx_backend_matches_pickled_model(trained_model_dir, tmp_path, monkeypatch):
+    """Test that the exported ONNX graph passes its parity check and serves the same predictions"""
+    pytest.importorskip('skl2onnx')
+    pytest.importorskip('onnxruntime')
+    import shutil
+    from tests.conftest import make_patients
+    from src.prediction.onnx_export import export_onnx_model, load_onnx_model, OnnxModel
+    
+    model_path = str(tmp_path / 'bundle')
+    shutil.copytree(trained_model_dir, model_path)
+    monkeypatch.setenv('SHARED_MODEL_WEIGHTS', '0')
+    reference = HeartDiseasePredictor(model_path=model_path)
+    patients = make_patients(300, seed=6).drop(columns=['target'])
+    input_features = reference._input_feature_names()
+    
+    report = export_onnx_model(reference.model, reference.scaler, input_features,
+                               patients[input_features].to_numpy(dtype=np.float64), model_path=model_path,
+                               feature_transformer=reference.feature_transformer,
+                               categorical_encoder=reference.categorical_encoder)
+    assert report['exported'] and report['parity']['label_flips'] == 0
+    assert set(report['benchmark']) == {'1', '512'}
+    
+    monkeypatch.setenv('MODEL_BACKEND', 'onnx')
+    predictor = HeartDiseasePredictor(model_path=model_path)
+    assert isinstance(predictor.compiled_model, OnnxModel)
+    assert predictor.readiness()['model']['backend'] == 'onnx'
+    
+    records = patients.to_dict('records')
+    for result, expected in zip(predictor.batch_predict(records), reference.batch_predict(records)):
+        assert result['probability'] == pytest.approx(expected['probability'], abs=1e-5)
+        assert result['prediction'] == expected['prediction']
+        assert result['feature_importance'] == pytest.approx(expected['feature_importance'])
+    
+    # A graph exported from another model version is not used
+    assert load_onnx_model(model_path, predictor.model_version) is not None
+    assert load_onnx_model(model_path, 'other-model') is None
+
+def test_float32_inference_matches_float64(trained_model_dir, tmp_path):
+    """Test that float32 mode keeps tree branches and reports its deviation from float64"""
+    import os
+    import json
+    import shutil
+    from tests.conftest import make_patients
+    from src.prediction.flat_forest import FlatForest
+    from src.prediction.precision import validate_float32, VALIDATION_REPORT
+    
+    reference = HeartDiseasePredictor(model_path=trained_model_dir, precision='float64')
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir, precision='float32')
+    # The forest is not copied, so it keeps sharing the memory-mapped arrays
+    assert isinstance(predictor.model.value, np.memmap)
+    assert predictor.readiness()['model']['precision'] == 'float32'
+    
+    patients = make_patients(500, seed=8).drop(columns=['target'])
+    X, _, _ = predictor.preprocess_batch(patients.to_dict('records'))
+    assert X.dtype == np.float32
+    # Trees compare float32 features in both modes, so they take the same branches
+    np.testing.assert_array_equal(predictor.model.apply(X), reference.model.apply(X))
+    
+    # Preprocessing rounding may still move a value across a split; the report measures that
+    records = patients.to_dict('records')
+    probabilities = np.array([[result['probability'], expected['probability']] for result, expected in
+                              zip(predictor.batch_predict(records), reference.batch_predict(records))])
+    
+    model_path = str(tmp_path / 'bundle')
+    shutil.copytree(trained_model_dir, model_path)
+    report = validate_float32(patients[reference._input_feature_names()].to_numpy(), model_path=model_path)
+    assert report['rows'] == 500
+    assert report['max_abs_probability_difference'] == pytest.approx(
+        np.abs(probabilities[:, 0] - probabilities[:, 1]).max(), abs=1e-6)
+    assert report['mean_abs_probability_difference'] < 0.01
+    assert report['label_flips'] == np.sum((probabilities >= 0.5)[:, 0] != (probabilities >= 0.5)[:, 1])
+    assert report['label_flips'] == len(report['flipped_rows'])
+    assert set(report['rows_per_sec']) == {'float64', 'float32'} and report['float32_speedup'] > 0
+    with open(os.path.join(model_path, VALIDATION_REPORT)) as f:
+        assert json.load(f)['model_type'] == FlatForest.__name__
+
+def test_bulk_scoring_writes_in_order_and_resumes(trained_model_dir, tmp_path):
+    """Test that bulk scoring matches batch predictions, keeps invalid rows and resumes after interruption"""
+    import json
+    import pandas as pd
+    from tests.conftest import make_patients
+    from src.prediction.bulk import score_file, CHECKPOINT_SUFFIX, _load_predictor
+    from src.prediction.flat_forest import FlatForest
+    
+    # Workers score with the pickled scikit-learn model, not the shared flat arrays
+    assert not isinstance(_load_predictor(trained_model_dir, None).model, FlatForest)
+    
+    patients = make_patients(250, seed=9).drop(columns=['target'])
+    patients['patient_id'] = [f'p{i}' for i in range(len(patients))]
+    patients['age'] = patients['age'].astype(object)
+    patients.loc[7, 'age'] = 'unknown'
+    patients.loc[120, 'cp'] = 9
+    input_path, output_path = str(tmp_path / 'patients.csv'), str(tmp_path / 'scores.csv')
+    patients.to_csv(input_path, index=False)
+    
+    stats = score_file(input_path, output_path, model_path=trained_model_dir, chunk_rows=40, processes=2,
+                       id_column='patient_id', explain=True)
+    assert (stats['rows'], stats['invalid_rows'], stats['chunks']) == (250, 2, 7)
+    scores = pd.read_csv(output_path, keep_default_na=False)
+    assert scores['patient_id'].tolist() == patients['patient_id'].tolist()
+    assert scores.loc[7, 'error'] and scores.loc[120, 'error'].startswith('cp must be one of')
+    
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    valid = scores['error'] == ''
+    expected = predictor.batch_predict(patients[valid.to_numpy()].drop(columns=['patient_id']).to_dict('records'))
+    np.testing.assert_allclose(scores.loc[valid, 'probability'].astype(float),
+                               [result['probability'] for result in expected], atol=1e-6)
+    assert scores.loc[valid, 'risk_level'].tolist() == [result['risk_level'] for result in expected]
+    assert scores.loc[valid, 'explanation'].str.count(':').eq(3).all()
+    
+    # Simulate an interruption after three chunks, with a partly written fourth chunk
+    checkpoint_path = output_path + CHECKPOINT_SUFFIX
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    with open(output_path, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    with open(output_path, 'wb') as f:
+        f.write(b''.join(lines[:1 + 3 * 40]) + lines[130][:10])
+    checkpoint.update(chunks=3, rows=120, invalid_rows=1, output_bytes=len(b''.join(lines[:1 + 3 * 40])),
+                      complete=False)
+    with open(checkpoint_path, 'w') as f:
+        json.dump(checkpoint, f)
+    
+    resumed = score_file(input_path, output_path, model_path=trained_model_dir, chunk_rows=40, processes=1,
+                         id_column='patient_id', explain=True)
+    assert (resumed['rows'], resumed['resumed_from_rows'], resumed['total_scored']) == (130, 120, 250)
+    assert resumed['total_invalid'] == 2
+    pd.testing.assert_frame_equal(pd.read_csv(output_path, keep_default_na=False), scores)
+    
+    # A checkpoint is only used with the settings it was written with
+    with pytest.raises(ValueError):
+        score_file(input_path, output_path, model_path=trained_model_dir, chunk_rows=50, processes=1,
+                   id_column='patient_id', explain=True)
+
+def test_rescaled_splits_keep_tree_predictions():
+    """Test that mapping split thresholds to a new scaling keeps tree ensemble predictions"""
+    import copy
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import StandardScaler
+    from xgboost import XGBClassifier
+    from tests.conftest import make_patients
+    from src.model_training.incremental import rescale_splits
+    
+    df = make_patients(300, seed=10)
+    X, y = df.drop(columns=['target']).astype(float), df['target']
+    old_scaler = StandardScaler().fit(X[:150])
+    new_scaler = copy.deepcopy(old_scaler).partial_fit(X[150:] * 1.5)
+    for model in (RandomForestClassifier(n_estimators=10, random_state=0), XGBClassifier(n_estimators=10)):
+        model.fit(old_scaler.transform(X), y)
+        expected = model.predict_proba(old_scaler.transform(X))
+        # Values lying on a split keep their side too
+        rescale_splits(model, old_scaler, new_scaler, X=X)
+        np.testing.assert_allclose(model.predict_proba(new_scaler.transform(X)), expected, atol=1e-6)
+
+def test_incremental_training_extends_model(trained_model_dir, tmp_path):
+    """Test that incremental retraining adds trees, refits the scaler statistics and records lineage"""
+    import os
+    import shutil
+    from sklearn.preprocessing import StandardScaler
+    from tests.conftest import make_patients
+    from src.data_processing.feature_engineering import HeartFeatureTransformer
+    from src.data_processing.preprocess import preprocess_pipeline, CategoricalEncoder
+    from src.model_training.train import load_lineage
+    from src.model_training.incremental import incremental_training_pipeline
+    
+    model_path = str(tmp_path / 'bundle')
+    shutil.copytree(trained_model_dir, model_path)
+    before = HeartDiseasePredictor(model_path=model_path)
+    
+    result = incremental_training_pipeline(make_patients(300, seed=11), model_path=model_path, n_new_estimators=5)
+    entry = result['lineage_entry']
+    assert (entry['mode'], entry['estimators'], entry['estimators_added']) == ('incremental', 25, 5)
+    assert entry['parent'] == before.model_version
+    assert entry['rows'] == 240 and entry['rows_seen'] == 160 + 240
+    assert entry['rescale_check'] == {'max_abs_probability_difference': 0.0, 'label_flips': 0}
+    assert entry['percentile_index'] == {'built_for': before.model_version, 'stale': True}
+    assert load_lineage(model_path) == [entry]
+    with open(os.path.join(model_path, 'RandomForestClassifier_model_card.md')) as f:
+        model_card = f.read()
+    assert entry['version'] in model_card and 'percentile index was built for version' in model_card
+    
+    # The scaler statistics equal those of the old and new training rows together
+    train_rows = []
+    for patients in (make_patients(), make_patients(300, seed=11)):
+        X_train, _, _, _, scaler = preprocess_pipeline(patients, feature_transformer=HeartFeatureTransformer(),
+                                                       encoder=CategoricalEncoder())
+        train_rows.append(scaler.inverse_transform(X_train))
+    after = HeartDiseasePredictor(model_path=model_path)
+    full = StandardScaler().fit(np.vstack(train_rows))
+    np.testing.assert_allclose(after.scaler.mean_, full.mean_)
+    np.testing.assert_allclose(after.scaler.var_, full.var_)
+    
+    assert after.model_version == entry['version'] != before.model_version
+    patients = make_patients(50, seed=12).drop(columns=['target']).to_dict('records')
+    assert all(0 <= result['probability'] <= 1 for result in after.batch_predict(patients))
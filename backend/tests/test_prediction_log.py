@@ -0,0 +1,98 @@
+"""
+Tests for the asynchronous prediction log
+"""
+
+import numpy as np
+from src.services.prediction_log import PredictionLog, read_prediction_log, scan_prediction_log
+
+FEATURES = ['age', 'sex', 'chol']
+
+def _rows(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    inputs = rng.uniform(0, 300, (n_rows, len(FEATURES)))
+    probabilities = rng.uniform(0, 1, n_rows)
+    return inputs, probabilities, (probabilities >= 0.5).astype(int)
+
+def test_records_round_trip_through_rotated_files(tmp_path):
+    """Test that buffered records are written in order across rotated files and read back"""
+    log = PredictionLog(str(tmp_path), FEATURES, capacity=1000, batch_size=100, max_file_bytes=2000)
+    inputs, probabilities, predictions = _rows(250)
+    for start in range(0, 250, 50):
+        stop = start + 50
+        log.record(inputs[start:stop], probabilities[start:stop], predictions[start:stop], 1.5, 'abc123')
+        assert log.flush()
+    log.close()
+
+    assert len(list(tmp_path.glob('predictions-*.plog'))) > 1
+    assert sum(len(block['timestamp']) for block in scan_prediction_log(str(tmp_path))) == 250
+
+    data = read_prediction_log(str(tmp_path))
+    assert data['input_features'] == FEATURES
+    np.testing.assert_array_equal(data['inputs'], inputs)
+    np.testing.assert_array_equal(data['probability'], probabilities)
+    np.testing.assert_array_equal(data['prediction'], predictions)
+    assert set(data['model_version']) == {b'abc123'}
+    assert np.allclose(data['latency_ms'], 1.5)
+
+    subset = read_prediction_log(str(tmp_path), columns=['probability'], until=0)
+    assert 'probability' not in subset
+
+def test_full_buffer_drops_records_instead_of_blocking(tmp_path):
+    """Test that rows beyond the buffer capacity are counted as dropped"""
+    log = PredictionLog(str(tmp_path), FEATURES, capacity=100, batch_size=1000, flush_interval=60)
+    inputs, probabilities, predictions = _rows(150)
+    log.record(inputs, probabilities, predictions, 2.0, 'abc123')
+
+    assert log.dropped == 50
+    assert log.flush()
+    log.close()
+    data = read_prediction_log(str(tmp_path))
+    np.testing.assert_array_equal(data['inputs'], inputs[:100])
+
+def test_counts_are_exact_under_concurrent_records(tmp_path):
+    """Test that every row from concurrent request threads is counted as written or dropped"""
+    import sys
+    import threading
+    
+    log = PredictionLog(str(tmp_path), FEATURES, capacity=64, batch_size=16, flush_interval=0.01)
+    inputs, probabilities, predictions = _rows(5)
+    
+    def record():
+        for _ in range(400):
+            log.record(inputs, probabilities, predictions, 1.0, 'abc123')
+    
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert log.flush()
+    log.close()
+    
+    stats = log.stats()
+    assert stats['buffered'] == 0
+    assert stats['written'] + stats['dropped'] == 8 * 400 * 5
+    assert stats['written'] == sum(len(block['timestamp']) for block in scan_prediction_log(str(tmp_path)))
+
+def test_predictor_logs_predictions(trained_model_dir, tmp_path):
+    """Test that single and batch predictions are logged with the model version"""
+    from src.prediction.predictor import HeartDiseasePredictor
+
+    predictor = HeartDiseasePredictor(model_path=trained_model_dir)
+    predictor.start_prediction_log(str(tmp_path))
+    patient = {'age': 63, 'sex': 1, 'cp': 3, 'trestbps': 145, 'chol': 233, 'fbs': 1, 'restecg': 0,
+               'thalach': 150, 'exang': 0, 'oldpeak': 2.3, 'slope': 0, 'ca': 0, 'thal': 1}
+    result = predictor.predict(patient)
+    predictor.batch_predict([patient, dict(patient, age=40)])
+    predictor.prediction_log.close()
+
+    data = read_prediction_log(str(tmp_path))
+    assert len(data['probability']) == 3
+    assert data['probability'][0] == result['probability']
+    assert data['inputs'][2][data['input_features'].index('age')] == 40
+    assert data['model_version'][0].decode() == predictor.model_version
@@ -2,12 +2,14 @@
 Preprocessing Tests for Heart Disease Prediction System
 """
 
+import pytest
 import pandas as pd
 import numpy as np
 from src.data_processing.preprocess import (
     handle_missing_values,
     remove_outliers,
     encode_categorical,
+    CategoricalEncoder,
     scale_features,
     split_data
 )
@@ -48,6 +50,52 @@ def test_encode_categorical():
     assert 'cp_3' in df_encoded.columns
     # Note: cp_0 is dropped due to drop_first=True
 
+def test_encode_categorical_schema_columns():
+    """Test that automatic detection uses the schema and never encodes the target"""
+    df = pd.DataFrame({
+        'age': [25, 30, 35, 40],
+        'cp': [0, 1, 2, 3],
+        'ca': [0, 1, 0, 1],
+        'target': [0, 1, 0, 1]
+    })
+    
+    df_encoded = encode_categorical(df)
+    
+    assert {'cp_1', 'cp_2', 'cp_3'} <= set(df_encoded.columns)
+    assert 'target' in df_encoded.columns
+    assert 'ca' in df_encoded.columns
+
+def test_categorical_encoder_fixed_layout():
+    """Test that the fitted encoder layout doesn't depend on the values present"""
+    train = pd.DataFrame({'age': [50, 60], 'cp': [0, 3], 'thal': [1, 2]})
+    serve = pd.DataFrame({'age': [45], 'cp': [2], 'thal': [1]})
+    
+    encoder = CategoricalEncoder().fit(train)
+    
+    assert list(encoder.get_feature_names_out()) == ['age', 'cp_1', 'cp_2', 'cp_3', 'thal_1', 'thal_2']
+    assert encoder.transform(serve).tolist() == [[45, 0, 1, 0, 1, 0]]
+    assert encoder.transform(serve.to_numpy()[0]).tolist() == [[45, 0, 1, 0, 1, 0]]
+    
+    onehot = encoder.transform_onehot(serve)
+    assert onehot.dtype == np.uint8
+    
+    encoded = encode_categorical(serve, encoder=encoder)
+    assert list(encoded.columns) == list(encoder.get_feature_names_out())
+
+def test_categorical_encoder_unknown_categories():
+    """Test handling of categories missing from the schema"""
+    df = pd.DataFrame({'cp': [1, 7]})
+    
+    ignored = CategoricalEncoder(drop_first=False).fit(df).transform(df)
+    assert ignored.tolist() == [[0, 1, 0, 0], [0, 0, 0, 0]]
+    
+    sparse_onehot = CategoricalEncoder(drop_first=False, sparse_output=True).fit(df).transform_onehot(df)
+    assert sparse_onehot.nnz == 1
+    
+    strict = CategoricalEncoder(handle_unknown='error').fit(df)
+    with pytest.raises(ValueError, match='cp'):
+        strict.transform(df)
+
 def test_scale_features():
     """Test feature scaling"""
     # Create a DataFrame with numerical data
@@ -86,4 +134,54 @@ def test_split_data():
     
     # Check that target column is not in features
     assert 'target' not in X_train.columns
-    assert 'target' not in X_test.columns
\ No newline at end of file
+    assert 'target' not in X_test.columns
+
+def test_remove_outliers():
+    """Test IQR outlier removal and the per-column report"""
+    df = pd.DataFrame({
+        'age': [50, 52, 54, 56, 58, 60, 200],
+        'chol': [200, 210, 220, 230, 240, 900, 225],
+        'sex': [0, 1, 0, 1, 0, 1, 0]
+    })
+    
+    df_clean, report = remove_outliers(df, columns=['age', 'chol', 'missing'])
+    
+    assert report == {'age': 1, 'chol': 1}
+    assert df_clean.index.tolist() == [0, 1, 2, 3, 4]
+    
+    # Matches the column-by-column pandas definition
+    for column in ['age', 'chol']:
+        q1, q3 = df[column].quantile(0.25), df[column].quantile(0.75)
+        iqr = q3 - q1
+        assert df_clean[column].between(q1 - 1.5 * iqr, q3 + 1.5 * iqr).all()
+
+def test_remove_outliers_approximate():
+    """Test approximate outlier removal with a streaming quantile sketch"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'chol': rng.normal(240, 50, 20000),
+        'thalach': rng.normal(150, 20, 20000)
+    })
+    
+    exact, exact_report = remove_outliers(df)
+    approx, approx_report = remove_outliers(df, approximate=True, sketch_capacity=512)
+    
+    for column in df.columns:
+        assert abs(exact_report[column] - approx_report[column]) <= 0.002 * len(df)
+    assert abs(len(exact) - len(approx)) <= 0.004 * len(df)
+
+def test_quantile_sketch_merge():
+    """Test that merged sketches estimate quantiles of the combined data"""
+    from src.data_processing.sketches import QuantileSketch
+    
+    rng = np.random.default_rng(1)
+    data = rng.exponential(1.0, size=(50000, 2))
+    
+    left = QuantileSketch(n_columns=2, capacity=256).update(data[:30000])
+    right = QuantileSketch(n_columns=2, capacity=256).update(data[30000:])
+    merged = left.merge(right)
+    
+    np.testing.assert_allclose(
+        merged.quantile([0.1, 0.5, 0.9]), np.quantile(data, [0.1, 0.5, 0.9], axis=0), rtol=0.05
+    )
+    assert merged.count.tolist() == [50000, 50000]
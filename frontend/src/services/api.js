@@ -19,7 +19,8 @@ const apiClient = axios.create({
 // Request interceptor
 apiClient.interceptors.request.use(
   (config) => {
-    // Add any request preprocessing here
+    // Tell the server how long we will wait so it can shed requests it cannot answer in time
+    config.headers['X-Request-Deadline-Ms'] = String(config.timeout || TIMEOUT);
     console.log(`Making request to ${config.url}`);
     return config;
   },
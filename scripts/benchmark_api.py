@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Load Test and Latency Benchmark for Heart Disease Prediction System
+
+Replays patients against the API and reports throughput and tail latency per
+endpoint. Runs the Flask app in-process by default, or targets a running
+server with --url.
+
+Closed loop (default): --concurrency workers each send the next request as soon
+as the previous one returns. Open loop: --rate requests per second are issued on
+a fixed schedule regardless of how fast the server answers, and latency is
+measured from the scheduled send time so queueing delay is not hidden.
+
+Examples:
+    python scripts/benchmark_api.py --concurrency 8 --duration 20
+    python scripts/benchmark_api.py --url http://localhost:5000 --rate 200 --endpoints predict
+    python scripts/benchmark_api.py --synthetic 1000 --batch-size 100 --output results.json
+"""
+
+import argparse
+import csv
+import http.client
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+import numpy as np
+
+BACKEND_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+DEFAULT_CSV = os.path.join(BACKEND_PATH, 'data', 'sample_batch.csv')
+DEFAULT_JSON = os.path.join(BACKEND_PATH, 'data', 'sample_data.json')
+
+ENDPOINTS = {
+    'predict': '/api/predict',
+    'batch': '/api/predict/batch',
+    'pdf': '/api/generate-pdf',
+    'download-pdf': '/api/download-pdf'
+}
+
+PERCENTILES = [50, 95, 99, 99.9]
+
+# Used as the report payload when the prediction endpoint is unavailable (e.g. no trained model)
+EXAMPLE_RESULT = {
+    "prediction": 1,
+    "probability": 0.87,
+    "risk_level": "High",
+    "confidence": "87.0%",
+    "feature_importance": {"cp": 0.12, "thalach": -0.05, "oldpeak": 0.08},
+    "recommendations": ["Consult a cardiologist immediately"]
+}
+
+def load_patients(csv_path=DEFAULT_CSV, json_path=DEFAULT_JSON, synthetic=0, seed=0):
+    """
+    Load the patients to replay
+
+    Args:
+        csv_path (str): CSV file with one patient per row (optional)
+        json_path (str): JSON file mapping ids to patients (optional)
+        synthetic (int): Number of synthetic patients to use instead
+        seed (int): Random seed for synthetic patients
+
+    Returns:
+        list: Patient dictionaries
+    """
+    if synthetic:
+        rng = np.random.default_rng(seed)
+        ranges = {
+            'age': (29, 78), 'sex': (0, 2), 'cp': (0, 4), 'trestbps': (94, 200), 'chol': (126, 564),
+            'fbs': (0, 2), 'restecg': (0, 3), 'thalach': (71, 202), 'exang': (0, 2),
+            'oldpeak': (0, 62), 'slope': (0, 3), 'ca': (0, 4), 'thal': (0, 3)
+        }
+        columns = {name: rng.integers(low, high, synthetic) for name, (low, high) in ranges.items()}
+        columns['oldpeak'] = columns['oldpeak'] / 10
+        return [{name: values[i].item() for name, values in columns.items()} for i in range(synthetic)]
+
+    patients = []
+    if csv_path and os.path.exists(csv_path):
+        with open(csv_path, newline='') as f:
+            for row in csv.DictReader(f):
+                patients.append({key: float(value) for key, value in row.items()})
+    if json_path and os.path.exists(json_path):
+        with open(json_path) as f:
+            data = json.load(f)
+        patients.extend(data.values() if isinstance(data, dict) else data)
+
+    if not patients:
+        raise SystemExit("No patients found; pass --csv/--json or --synthetic N")
+    return patients
+
+class InProcessClient:
+    """Send requests to the Flask app in this process (one test client per thread)"""
+
+    def __init__(self):
+        sys.path.insert(0, BACKEND_PATH)
+        os.chdir(BACKEND_PATH)
+        from api.app import create_app
+
+        self.app = create_app()
+        self._local = threading.local()
+
+    def post(self, path, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, data=body, content_type='application/json')
+        return response.status_code, response.data
+
+class HTTPClient:
+    """Send requests to a running server over one keep-alive connection per thread"""
+
+    def __init__(self, url, timeout=30):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        self.prefix = parsed.path.rstrip('/')
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def post(self, path, body):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request('POST', self.prefix + path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request
+            connection.close()
+            self._local.connection = None
+            raise
+
+def build_payloads(endpoint, patients, batch_size, report_payload):
+    """
+    Encode the request bodies replayed for one endpoint
+
+    Returns:
+        list: JSON request bodies as bytes
+    """
+    if endpoint == 'predict':
+        return [json.dumps(patient).encode() for patient in patients]
+    if endpoint == 'batch':
+        # Repeat the patients when there are fewer than one full batch
+        pool = patients * (batch_size // len(patients) + 1)
+        return [
+            json.dumps(pool[i:i + batch_size]).encode()
+            for i in range(0, len(pool) - batch_size + 1, batch_size)
+        ]
+    return [json.dumps(report_payload).encode()]
+
+def run_closed_loop(client, path, payloads, concurrency, duration, max_requests):
+    """Each worker sends its next request as soon as the previous one completes"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(max_requests or 10 ** 12))
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        local_latencies, local_errors = [], 0
+        while time.perf_counter() < deadline:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            try:
+                status, _ = client.post(path, payloads[i % len(payloads)])
+                failed = status >= 400
+            except Exception:
+                failed = True
+            local_latencies.append(time.perf_counter() - start)
+            local_errors += failed
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+def run_open_loop(client, path, payloads, rate, duration, max_requests, max_in_flight):
+    """Issue requests on a fixed schedule; latency includes time spent waiting to be sent"""
+    n_requests = int(rate * duration)
+    if max_requests:
+        n_requests = min(n_requests, max_requests)
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def send(i, scheduled):
+        try:
+            status, _ = client.post(path, payloads[i % len(payloads)])
+            failed = status >= 400
+        except Exception:
+            failed = True
+        latency = time.perf_counter() - scheduled
+        with lock:
+            latencies.append(latency)
+            errors[0] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for i in range(n_requests):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, i, scheduled)
+    return latencies, errors[0], time.perf_counter() - start
+
+def summarize(latencies, errors, elapsed, rows_per_request=1):
+    """
+    Summarize one endpoint run
+
+    Returns:
+        dict: Request counts, throughput and latency percentiles in milliseconds
+    """
+    latencies_ms = np.asarray(latencies) * 1000
+    summary = {
+        'requests': len(latencies),
+        'errors': int(errors),
+        'elapsed_seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        'rows_per_second': round(len(latencies) * rows_per_request / elapsed, 2) if elapsed > 0 else 0.0,
+        'latency_ms': {}
+    }
+    if len(latencies_ms):
+        summary['latency_ms'] = {
+            'mean': round(float(latencies_ms.mean()), 3),
+            **{f'p{p:g}': round(float(np.percentile(latencies_ms, p)), 3) for p in PERCENTILES},
+            'max': round(float(latencies_ms.max()), 3)
+        }
+    return summary
+
+def main():
+    """Main benchmark function"""
+    parser = argparse.ArgumentParser(description="Benchmark the Heart Disease Prediction API")
+    parser.add_argument('--url', help="Base URL of a running server (default: run the app in-process)")
+    parser.add_argument('--endpoints', default='predict,batch,pdf,download-pdf',
+                        help="Comma-separated endpoints: " + ', '.join(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, default=4, help="Closed-loop workers (default: 4)")
+    parser.add_argument('--rate', type=float, help="Open-loop request rate per second (overrides --concurrency)")
+    parser.add_argument('--max-in-flight', type=int, default=256, help="Open-loop cap on outstanding requests")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per endpoint (default: 10)")
+    parser.add_argument('--requests', type=int, default=0, help="Stop each endpoint after this many requests")
+    parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per endpoint (default: 10)")
+    parser.add_argument('--batch-size', type=int, default=100, help="Patients per batch request (default: 100)")
+    parser.add_argument('--csv', default=DEFAULT_CSV, help="CSV file of patients")
+    parser.add_argument('--json', default=DEFAULT_JSON, help="JSON file of patients")
+    parser.add_argument('--synthetic', type=int, default=0, help="Use N synthetic patients instead of the files")
+    parser.add_argument('--output', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f"Unknown endpoints: {unknown}")
+
+    print("📈 Heart Disease Prediction System - API Benchmark")
+    print("=" * 50)
+
+    patients = load_patients(args.csv, args.json, args.synthetic)
+    client = HTTPClient(args.url) if args.url else InProcessClient()
+    target = args.url or 'in-process'
+    mode = f"open loop at {args.rate:g} req/s" if args.rate else f"closed loop with {args.concurrency} workers"
+    print(f"Target: {target} | {mode} | {len(patients)} patients")
+
+    # The PDF endpoints render the report of a real prediction when one is available
+    status, body = client.post(ENDPOINTS['predict'], json.dumps(patients[0]).encode())
+    report_payload = json.loads(body) if status == 200 else dict(EXAMPLE_RESULT, input_data=patients[0])
+
+    results = {}
+    for endpoint in endpoints:
+        path = ENDPOINTS[endpoint]
+        payloads = build_payloads(endpoint, patients, args.batch_size, report_payload)
+        rows_per_request = args.batch_size if endpoint == 'batch' else 1
+
+        for i in range(args.warmup):
+            try:
+                client.post(path, payloads[i % len(payloads)])
+            except Exception:
+                pass
+
+        if args.rate:
+            latencies, errors, elapsed = run_open_loop(client, path, payloads, args.rate, args.duration,
+                                                       args.requests, args.max_in_flight)
+        else:
+            latencies, errors, elapsed = run_closed_loop(client, path, payloads, args.concurrency,
+                                                         args.duration, args.requests)
+
+        results[endpoint] = summary = summarize(latencies, errors, elapsed, rows_per_request)
+        latency = summary['latency_ms']
+        print(f"\n{endpoint} ({path})")
+        print(f"   {summary['requests']} requests, {summary['errors']} errors, {summary['rps']} req/s")
+        if latency:
+            print("   latency ms: " + ', '.join(f"{key} {value}" for key, value in latency.items()))
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'target': target,
+        'mode': 'open' if args.rate else 'closed',
+        'config': {
+            'concurrency': args.concurrency,
+            'rate': args.rate,
+            'duration': args.duration,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'batch_size': args.batch_size,
+            'patients': len(patients),
+            'synthetic': bool(args.synthetic)
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'endpoints': results
+    }
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results saved to {output_path}")
+
+    print("\n🏁 Benchmark completed!")
+    return report
+
+if __name__ == "__main__":
+    main()
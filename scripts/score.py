@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Bulk Scoring Script for Heart Disease Prediction System
+
+Scores a CSV or Parquet file of patients with the trained model and writes one
+CSV row per input row: the row number (or --id-column), probability, predicted
+class, risk level, optionally the largest feature contributions, and the
+validation error of rows that could not be scored.
+
+The file is read in chunks that are scored by a pool of worker processes.
+Progress is checkpointed after every chunk, so rerunning the same command after
+an interruption continues where the previous run stopped (--restart starts over).
+
+Examples:
+    python scripts/score.py patients.csv scores.csv
+    python scripts/score.py history.parquet scores.csv --processes 16 --chunk-rows 200000
+    python scripts/score.py patients.csv scores.csv --explain --id-column patient_id
+"""
+
+import argparse
+import os
+import sys
+
+BACKEND_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+def main():
+    """Main scoring function"""
+    parser = argparse.ArgumentParser(description="Score a file of patients with the trained model")
+    parser.add_argument('input', help="CSV or Parquet file with the model input columns")
+    parser.add_argument('output', help="CSV file to write the scores to")
+    parser.add_argument('--model-path', help="Trained model directory (default: backend/models/trained_models)")
+    parser.add_argument('--chunk-rows', type=int, default=100_000, help="Rows per chunk (default: 100000)")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: CPU count)")
+    parser.add_argument('--id-column', help="Input column to identify rows by (default: row number)")
+    parser.add_argument('--explain', action='store_true', help="Add the largest feature contributions of every row")
+    parser.add_argument('--top-features', type=int, default=3, help="Contributions per explanation (default: 3)")
+    parser.add_argument('--precision', choices=['float64', 'float32'], help="Inference precision")
+    parser.add_argument('--backend', choices=['sklearn', 'onnx'], help="Scoring backend (sets MODEL_BACKEND)")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint of a previous run")
+    args = parser.parse_args()
+
+    if args.backend:
+        os.environ['MODEL_BACKEND'] = args.backend
+    sys.path.insert(0, BACKEND_PATH)
+    from src.prediction.bulk import score_file
+
+    print("🩺 Heart Disease Prediction System - Bulk Scoring")
+    print("=" * 50)
+    print(f"Input: {args.input} | Output: {args.output} | {args.processes} processes, {args.chunk_rows} rows per chunk")
+
+    def report(stats):
+        total = f"/{stats['total_rows']:,}" if stats['total_rows'] else ''
+        print(f"   chunk {stats['chunks']}: {stats['total_scored']:,}{total} rows, "
+              f"{stats['invalid_rows']:,} invalid, {stats['rows_per_sec']:,.0f} rows/sec", flush=True)
+
+    try:
+        stats = score_file(args.input, args.output, model_path=args.model_path, chunk_rows=args.chunk_rows,
+                           processes=args.processes, id_column=args.id_column, explain=args.explain,
+                           top_features=args.top_features, precision=args.precision,
+                           resume=not args.restart, progress=report)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ Scoring failed: {str(e)}")
+        sys.exit(1)
+
+    print()
+    if stats['resumed_from_rows']:
+        print(f"⏩ Resumed after {stats['resumed_from_rows']:,} rows")
+    print(f"✅ Scored {stats['rows']:,} rows in {stats['seconds']:.1f} s ({stats['rows_per_sec']:,.0f} rows/sec)")
+    print(f"⚠️  Invalid rows: {stats['total_invalid']:,} of {stats['total_scored']:,}")
+    print(f"💾 Scores saved to {args.output}")
+
+if __name__ == "__main__":
+    main()